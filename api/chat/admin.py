@@ -2,9 +2,10 @@
 
 from django.contrib import admin
 
-from .models import User, Connection, Message
+from .models import Blob, User, Connection, Message
 
 # Register your models here.
 admin.site.register(User)
 admin.site.register(Connection)
-admin.site.register(Message)
\ No newline at end of file
+admin.site.register(Message)
+admin.site.register(Blob)
@@ -0,0 +1,170 @@
+# api/chat/bench.py
+'''
+Shared helpers for the bench_* / loadtest management commands.
+
+Benchmarks never touch the real database: they run inside a throwaway test
+database seeded with synthetic users, connections and messages.
+'''
+import contextlib
+import time
+
+from django.db import connection
+from django.test.utils import override_settings
+
+from .consumers import ChatHandlers
+from .models import User, Connection, Message, SearchTerm
+from .search import terms_for
+
+IN_MEMORY_PRESENCE = {'BACKEND': 'memory'}
+
+IN_MEMORY_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'CONFIG': {
+            'capacity': 10000,
+        },
+    },
+}
+
+
+@contextlib.contextmanager
+def bench_database(channel_layers=None, name=None, presence=None, caches=None):
+    '''
+    Create a disposable test database (and by default an in-memory channel
+    layer, presence store and cache) for the duration of the block. `name` puts a
+    SQLite test database in that file instead of in memory.
+    '''
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    if name:
+        test_settings['NAME'] = name
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, keepdb=False
+    )
+    try:
+        with override_settings(
+            CHANNEL_LAYERS=channel_layers or IN_MEMORY_CHANNEL_LAYERS,
+            CHAT_PRESENCE=presence or IN_MEMORY_PRESENCE,
+            CACHES=caches or IN_MEMORY_CACHES,
+        ):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+
+
+def seed_chat(users=50, friends=10, messages=20, prefix='bench'):
+    '''
+    Create `users` users, each accepted-connected to the next `friends`
+    users (wrapping around), with `messages` messages per connection.
+    Returns the list of users.
+    '''
+    User.objects.bulk_create([
+        User(
+            username=f'{prefix}{i}',
+            first_name=f'first{i}',
+            last_name=f'last{i}',
+        )
+        for i in range(users)
+    ])
+    people = list(User.objects.filter(username__startswith=prefix).order_by('id'))
+    # bulk_create skips post_save, so build the search index by hand
+    SearchTerm.objects.bulk_create([
+        SearchTerm(user=person, term=term, kind=kind)
+        for person in people
+        for term, kind in terms_for(person)
+    ], batch_size=1000)
+
+    pairs = set()
+    for i in range(users):
+        for step in range(1, friends + 1):
+            j = (i + step) % users
+            if i != j and (j, i) not in pairs:
+                pairs.add((i, j))
+    connections = Connection.objects.bulk_create([
+        Connection(sender=people[i], receiver=people[j], accepted=True)
+        for i, j in sorted(pairs)
+    ])
+    rows = []
+    for conn in connections:
+        for n in range(messages):
+            author = conn.sender if n % 2 == 0 else conn.receiver
+            rows.append(Message(
+                connection=conn,
+                user=author,
+                text=f'message {n} from {author.username}',
+                delivered=True,
+            ))
+    Message.objects.bulk_create(rows, batch_size=500)
+    return people
+
+
+class ScopeUser:
+    '''
+    Tiny ASGI wrapper that authenticates every socket as `user`,
+    standing in for JWTAuthMiddlewareStack in benchmarks.
+    '''
+
+    def __init__(self, app, user):
+        self.app = app
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope, user=self.user)
+        return await self.app(scope, receive, send)
+
+
+class FrameRecorder(ChatHandlers):
+    '''
+    Runs protocol handlers for `user` without a socket. Every frame they
+    send (to any group or as a reply) is kept in `frames`. Deferred work
+    (media jobs) is kept in `deferred` and not run, so benchmarks measure
+    the handler alone.
+    '''
+
+    def __init__(self, user):
+        self.scope = {'user': user}
+        self.username = user.username
+        self.uploads = {}
+        self.frames = []
+        self.deferred = []
+
+    def send_group(self, group, source, data):
+        self.frames.append({'source': source, 'data': data})
+
+    def reply(self, source, data):
+        self.send_group(None, source, data)
+
+    def defer(self, func, *args):
+        self.deferred.append((func, args))
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Stopwatch:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def timeit(func, repeat=1000):
+    '''Average seconds per call of func() over `repeat` runs.'''
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
@@ -0,0 +1,118 @@
+# api/chat/blobs.py
+'''
+Content-addressed storage for message media.
+
+Every image, voice note, video and video thumbnail is stored once per
+distinct content, at blobs/<sha256[:2]>/<sha256>.<ext>, with a Blob row
+counting the message fields that point at it. The fields hold the blob's
+storage name, so URLs and serializers don't change.
+
+    - store(file): the same bytes sent twice are kept once; the second
+      copy only adds a reference
+    - add_refs(names): a forward shares the original's files, in one
+      UPDATE and without touching storage
+    - release(names): drops references; a file is deleted with its last
+
+Files stored before this (messages/<conn>/...) have no Blob row. They are
+deleted only once no message points at them, and `manage.py backfill_blobs`
+moves them in. See `manage.py bench_blobs` for the storage saved.
+'''
+import hashlib
+import os
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+
+from .models import Blob, Message
+
+MEDIA_FIELDS = ('image', 'voice', 'video', 'video_thumbnail')
+
+
+def content_hash(file):
+    '''sha256 hex digest of a Django File, read in chunks.'''
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ref_delta(counts, sign=1):
+    # refs +/- n per name, in a single UPDATE
+    return F('refs') + Case(
+        *[When(file=name, then=Value(sign * n)) for name, n in counts.items()],
+        default=Value(0)
+    )
+
+
+def store(file):
+    '''
+    Add a reference to `file`'s content, storing it if it's new. Returns
+    the storage name to put on the message field. Chunked uploads come with
+    their hash (see uploads.py); anything else is hashed here.
+    '''
+    digest = getattr(file, 'sha256', None) or content_hash(file)
+    with transaction.atomic():
+        if Blob.objects.filter(sha256=digest).update(refs=F('refs') + 1):
+            drop_upload(file)
+            return Blob.objects.values_list('file', flat=True).get(sha256=digest)
+        blob = Blob(sha256=digest, size=file.size, refs=1)
+        blob.file.save(file.name, file, save=False)
+        blob.save()
+    return blob.file.name
+
+
+def drop_upload(file):
+    # A finished chunked upload that turned out to be a duplicate: nothing
+    # will move its part file into storage, so remove it
+    if hasattr(file, 'temporary_file_path'):
+        file.close()
+        path = file.temporary_file_path()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def add_refs(names):
+    '''One more reference per name (repeats count), e.g. for forwarded copies.'''
+    counts = Counter(name for name in names if name)
+    if counts:
+        Blob.objects.filter(file__in=counts).update(refs=ref_delta(counts))
+
+
+def release(names):
+    '''
+    Drop one reference per name and delete files nothing points at any
+    more, once the surrounding transaction commits.
+    '''
+    counts = Counter(name for name in names if name)
+    if not counts:
+        return
+    with transaction.atomic():
+        Blob.objects.filter(file__in=counts).update(refs=ref_delta(counts, -1))
+        blobs = dict(Blob.objects.filter(file__in=counts).values_list('file', 'refs'))
+        dead = [name for name, refs in blobs.items() if refs <= 0]
+        if dead:
+            Blob.objects.filter(file__in=dead).delete()
+        legacy = [name for name in counts if name not in blobs]
+        if legacy:
+            still_used = referenced(legacy)
+            dead += [name for name in legacy if name not in still_used]
+    if dead:
+        transaction.on_commit(lambda: delete_files(dead))
+
+
+def referenced(names):
+    '''The names still used by any message field.'''
+    query = Q()
+    for field in MEDIA_FIELDS:
+        query |= Q(**{f'{field}__in': names})
+    found = set()
+    for row in Message.objects.filter(query).values_list(*MEDIA_FIELDS):
+        found.update(row)
+    return found
+
+
+def delete_files(names):
+    for name in names:
+        default_storage.delete(name)
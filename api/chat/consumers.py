@@ -1,163 +1,220 @@
 # api/chat/consumers.py
 import base64
-import json
-import os
+import logging
+import time
 
 from django.conf import settings
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.generic.websocket import WebsocketConsumer, AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.core.files.base import ContentFile
+from django.db import connection as db_connection, transaction
+from django.utils import timezone
 from django.db.models import Q, Exists, OuterRef
-from django.db.models.functions import Coalesce
 
+from .blobs import add_refs, store
 from .models import User, Connection, Message
-from .serializers import (
-    UserSerializer, 
-    SearchSerializer, 
-    RequestSerializer, 
-    FriendSerializer,
-    MessageSerializer
+from .fast_serializers import (
+    user_data,
+    search_data,
+    request_data,
+    friend_data,
+    message_data
 )
-from .utils import (
-    generate_waveform, 
-    extract_video_duration_ms, 
-    generate_video_thumbnail
+from .events import (
+    participants,
+    message_send_events,
+    message_batch_events,
+    request_accept_events
 )
+from . import metrics
+from .images import avatar_variants
+from .jobs import enqueue_media_job
+from .logs import fields, redact
+from .outbox import mark_delivered, outbox_data, skip_offline
+from .pagination import CursorError, get_page_size, paginate_messages
+from .presence import user_connected, user_disconnected, online_usernames
+from .protocol import Field, Handler, optional, validate
+from .search import search_user_ids
+from .sync import record_deletion, sync_frames
+from .timing import FrameTiming
+from .typing import start_typing, stop_typing, clear_typing, is_stale as is_stale_typing
+from .uploads import (
+    ChunkedUpload,
+    UploadError,
+    get_upload_settings,
+    parse_chunk_frame
+)
+from .wire import FrameError, negotiate
 
-class ChatConsumers(WebsocketConsumer):
-    
-    def connect(self):
-        user = self.scope['user']
-        print(user, user.is_authenticated)
-        if not user.is_authenticated:
-            return
-        # Save username to use as a group name for this user
-        self.username = user.username
-        
-        # Join this user to a group with their username
-        async_to_sync(self.channel_layer.group_add)(
-            self.username, self.channel_name
-        )
-        
-        self.accept()
-        
-        
-    def disconnect(self, close_code):
-        # Leave room/group
-        async_to_sync(self.channel_layer.group_discard)(
-            self.username, self.channel_name
-        )
+log = logging.getLogger(__name__)
+
+# source -> handler method and frame schema (see protocol.py)
+HANDLERS = {
+    'friend.list': Handler('receive_friend_list'),
+    'message.list': Handler('receive_message_list', {
+        'connectionId': Field(int),
+        'page': optional(int),
+        'cursor': optional(str),
+        'pageSize': optional(int),
+    }),
+    'message.send': Handler('receive_message_send', {
+        'connectionId': Field(int),
+        'message': optional(str),
+        # Media: inline base64 + filename, or a finished chunked upload
+        **{
+            f'{kind}{suffix}': optional(str)
+            for kind in ('image', 'voice', 'video')
+            for suffix in ('', '_filename', '_upload')
+        },
+    }),
+    'message.type': Handler('receive_message_type', {'username': Field(str)}),
+    'typing.stop': Handler('receive_typing_stop', {'username': Field(str)}),
+    'request.accept': Handler('receive_request_accept', {'username': Field(str)}),
+    'request.connect': Handler('receive_request_connect', {'username': Field(str)}),
+    'request.list': Handler('receive_request_list'),
+    'search': Handler('receive_search', {'query': optional(str)}),
+    'thumbnail': Handler('receive_thumbnail', {
+        'base64': Field(str),
+        'filename': optional(str),  # ignored: files are named by content
+    }),
+    'message.seen': Handler('receive_message_seen', {
+        'messageId': optional(int),
+        'connectionId': optional(int),
+        'upToId': optional(int),
+    }),
+    'message.delete': Handler('receive_message_delete', {
+        'connectionId': Field(int),
+        'messageId': Field(int),
+    }),
+    'message.forward': Handler('receive_message_forward', {
+        'fromConnectionId': Field(int),
+        'toConnectionId': Field(int),
+        'messageIds': Field(list, items=int),
+    }),
+    'message.delivered': Handler('receive_message_delivered', {
+        'messageIds': Field(list, items=int),
+    }),
+    'sync.since': Handler('receive_sync_since', {'cursor': optional(str)}),
+    'upload.start': Handler('receive_upload_start', {
+        'filename': Field(str),
+        'size': Field(int),
+    }),
+    # msgpack sockets only: JSON can't carry the bytes, raw binary frames
+    # go to receive_upload_chunk instead
+    'upload.chunk': Handler('receive_upload_chunk_frame', {
+        'uploadId': Field(str),
+        'offset': Field(int),
+        'data': Field(bytes),
+    }),
+}
+
+# Every source that gets timed under its own name; anything else is 'unknown'.
+# message.outbox is the drain run on connect.
+SOURCES = set(HANDLERS) | {'message.outbox'}
+
+# Sources whose handlers block on file I/O or the cache (Redis, see
+# typing.py) but never touch the database: run on a worker thread, off both
+# the event loop and the shared DB thread
+OFF_DB_SOURCES = {'upload.chunk', 'message.type', 'typing.stop'}
+
+
+class ChatHandlers:
+    '''
+    Protocol handlers shared by the sync and async consumers. Handlers are
+    plain sync code (ORM + serializers) and reply through self.send_group,
+    which each consumer implements for its own execution model.
+    '''
 
     #--------------------------
     #     Handle Requests
     #--------------------------
-    def receive(self, text_data):
-        # Receive message from Websocket
-        data = json.loads(text_data)
+    def dispatch_source(self, data):
         data_source = data.get('source')
-        
-        # Pretty print python dictionary
-        print('receive', json.dumps(data, indent=2))
-        
-        # Get friend list
-        if data_source == 'friend.list':
-            self.receive_friend_list(data)
-        
-        # Message List
-        elif data_source == 'message.list':
-            self.receive_message_list(data)
-        
-        # Message has been sent
-        elif data_source == 'message.send':
-            self.receive_message_send(data)
-        
-        # User is typing a message
-        elif data_source == 'message.type':
-            self.receive_message_type(data)
-        
-        # Accept friend request
-        elif data_source == 'request.accept':
-            self.receive_request_accept(data)
-        
-        # Make friend request
-        elif data_source == 'request.connect':
-            self.receive_request_connect(data)
-            
-        # Get request list
-        elif data_source == 'request.list':
-            self.receive_request_list(data)
-        
-        # Search / Filter Users
-        elif data_source == 'search':
-            self.receive_search(data)
-        
-        # Thumbnail Upload
-        elif data_source == 'thumbnail':
-            self.receive_thumbnail(data)
-        
-        # Message Seen  
-        elif data_source == 'message.seen':
-            self.receive_message_seen(data)
-        
-        # Message Delete
-        elif data_source == 'message.delete':
-            self.receive_message_delete(data)
+        entry = HANDLERS.get(data_source)
+        if entry is None:
+            log.warning('frame.unknown_source', extra=fields(source=data_source))
+            return
+
+        error = validate(entry.schema, data)
+        if error:
+            log.warning('frame.invalid', extra=fields(source=data_source, error=error))
+            self.reply('frame.error', {'source': data_source, 'error': error})
+            return
+
+        getattr(self, entry.method)(data)
 
-        # Message Forward
-        elif data_source == 'message.forward':
-            self.receive_message_forward(data)
+
+    def decode_frame(self, text_data, bytes_data):
+        '''The frame as a dict in this socket's wire format, or None.'''
+        try:
+            data = self.codec.decode(text_data, bytes_data)
+        except FrameError as e:
+            log.warning('frame.malformed', extra=fields(username=self.username, error=str(e)))
+            return None
+        log_frame(self.username, data)
+        return data
+
+
+    def handle_frame(self, source, handler, payload):
+        '''
+        Run one frame's handler under a FrameTiming (see timing.py). Must be
+        called on the thread that runs the handler's queries.
+        '''
+        self.timing = FrameTiming(source if source in SOURCES else 'unknown')
+        with db_connection.execute_wrapper(self.timing):
+            handler(payload)
+        self.timing.handler_done()
     
     
     def receive_friend_list(self, data):
         user = self.scope['user']
-        # Latest message subquery
-        latest_message = Message.objects.filter(
-            connection=OuterRef('id')
-        ).order_by('-created')[:1]
-        # Get connections for the user
+        # Get connections for the user, newest conversation first. The
+        # preview comes from the summary stored on the connection itself.
         connections = Connection.objects.filter(
             Q(sender=user) | Q(receiver=user),
             accepted=True
-        ).annotate(
-            latest_text=latest_message.values('text'),
-            latest_created=latest_message.values('created')
+        ).select_related(
+            'sender', 'receiver'
         ).order_by(
-            Coalesce('latest_created', 'updated').desc()
-        )
-        serialized = FriendSerializer(
-            connections, 
-            context={
-                'user': user
-            }, 
-            many=True
+            '-last_activity'
         )
+        serialized = [friend_data(connection, user) for connection in connections]
+        # Presence snapshot in the same round trip; `presence` events
+        # keep it current from here on
+        online = online_usernames(item['friend']['username'] for item in serialized)
+        for item in serialized:
+            item['online'] = item['friend']['username'] in online
         # Send data back to requesting user
-        self.send_group(user.username, 'friend.list', serialized.data)
+        self.send_group(user.username, 'friend.list', serialized)
     
     
     def receive_message_list(self, data):
         user = self.scope['user']
         connectionId = data.get('connectionId')
         page = data.get('page')
-        page_size = 15
+        page_size = get_page_size(data.get('pageSize'))
         try:
             connection = Connection.objects.get(id=connectionId)
         except Connection.DoesNotExist:
-            print('Error: Couldn\'t find connections')
+            log.warning('connection.missing', extra=fields(connection_id=connectionId))
+            return
+        # Get messages, one page newest first. Sending 'cursor' (null for the
+        # newest page) switches to keyset paging, see pagination.py
+        try:
+            messages, next_page = paginate_messages(
+                Message.objects.filter(connection=connection),
+                page_size,
+                page=page,
+                cursor=data.get('cursor'),
+                cursor_mode='cursor' in data
+            )
+        except CursorError as e:
+            log.warning('message_list.bad_cursor', extra=fields(error=str(e)))
+            self.reply('frame.error', {'source': 'message.list', 'error': str(e)})
             return
-        # Get messages
-        messages = Message.objects.filter(
-            connection=connection
-        ).order_by('-created')[page * page_size:(page + 1) * page_size]
         # Serialized Message
-        serialized_messages = MessageSerializer(
-            messages,
-            context={
-                'user': user
-            },
-            many=True
-        )
+        serialized_messages = [message_data(message, user) for message in messages]
         
         # Get recipient friend
         recipient = connection.sender
@@ -165,24 +222,12 @@ class ChatConsumers(WebsocketConsumer):
             recipient = connection.receiver
         
         # Serialize friend
-        serialized_friend = UserSerializer(recipient)
-        
-        # Count the total number of messages for this connection
-        messages_count = Message.objects.filter(
-            connection=connection
-        ).count()  
-        
-        # If there are still more messages beyond this slice, return the next page index
-        if (page + 1) * page_size < messages_count:
-            next_page = page + 1
-        else:
-            next_page = None
-
+        serialized_friend = user_data(recipient)
         
         data = {
-            'messages': serialized_messages.data,
+            'messages': serialized_messages,
             'next': next_page,
-            'friend': serialized_friend.data,
+            'friend': serialized_friend,
             'connection_id': connection.id   # ✅ add this
         }
         # Send back to the requestor
@@ -194,114 +239,84 @@ class ChatConsumers(WebsocketConsumer):
         user = self.scope['user']
         connectionId = data.get('connectionId')
         message_text = data.get('message')
-        image = data.get('image')
-        image_filename = data.get('image_filename')
-        voice = data.get('voice')
-        voice_filename = data.get('voice_filename')
-        video = data.get('video')
-        video_filename = data.get('video_filename')
 
         try:
             connection = Connection.objects.get(id=connectionId)
         except Connection.DoesNotExist:
-            print("Error: Couldn't find connection")
+            log.warning('connection.missing', extra=fields(connection_id=connectionId))
             return
 
-        message = Message.objects.create(
-            connection=connection,
-            user=user,
-            text=message_text,
-            delivered=True
-        )       
-
-        # New image code
-        if image and image_filename:
-            if ';base64,' in image:
-                _, imgstr = image.split(';base64,')
-            else:
-                imgstr = image  # ✅ assume raw base64 if no prefix
-            print(f"[receive_message_send] Saving image {image_filename}, length={len(imgstr)}")
-            message.image.save(image_filename, ContentFile(base64.b64decode(imgstr)), save=True)
-
-        # Voice
-        if voice and voice_filename:
-            format, voicestr = voice.split(';base64,') if ';base64,' in voice else ('', voice)
-            message.voice.save(voice_filename, ContentFile(base64.b64decode(voicestr)), save=True)
-            generate_waveform(message)
-            
-        
-        # Video
-        if video and video_filename:
-            videostr = video.split(';base64,')[-1] if ';base64,' in video else video
-            message.video.save(video_filename, ContentFile(base64.b64decode(videostr)), save=True)
-
-            try:
-                abs_path = message.video.path
-                print("[receive_message_send] Video path:", abs_path)
-
-                # Duration
-                duration_ms = extract_video_duration_ms(abs_path)
-                print("[receive_message_send] Duration ms:", duration_ms)
-                if duration_ms is not None:
-                    message.video_duration = round(duration_ms / 1000)
-                else:
-                    print("[receive_message_send] No duration extracted")
-
-                # Thumbnail
-                temp_dir = os.path.join(settings.MEDIA_ROOT, "tmp_thumbs")
-                os.makedirs(temp_dir, exist_ok=True)
-
-                thumb_name, thumb_path = generate_video_thumbnail(abs_path, temp_dir)
-                print("[receive_message_send] Thumbnail result:", thumb_name, thumb_path)
-                if thumb_name and thumb_path and os.path.exists(thumb_path):
-                    with open(thumb_path, "rb") as fh:
-                        message.video_thumbnail.save(
-                            thumb_name,
-                            ContentFile(fh.read(), name=thumb_name),
-                            save=False
-                        )
-                    print("[receive_message_send] Thumb saved:", thumb_name)
-                else:
-                    print("[receive_message_send] Thumbnail not created")
-
-                # Persist updated fields in one shot
-                message.save(update_fields=["video_duration", "video_thumbnail"])
-                print("[receive_message_send] Final saved:", message.id, message.video_duration, message.video_thumbnail)
-
-            except Exception as e:
-                print("[receive_message_send] Video metadata error:", e)
-            
-              
+        # Image variants and voice/video metadata are produced by the media
+        # job queue; the message goes out now with processing=True.
+        media_jobs = []
+        image = self.take_media(data, 'image')
+        voice = self.take_media(data, 'voice')
+        video = self.take_media(data, 'video')
+
+        # Message and conversation summary land together
+        with transaction.atomic():
+            message = Message.objects.create(
+                connection=connection,
+                user=user,
+                text=message_text
+            )
+
+            # Image
+            if image:
+                message.image.name = store(image)
+                image.close()
+                media_jobs.append(('image', message.image.path))
+
+            # Voice
+            if voice:
+                message.voice.name = store(voice)
+                voice.close()
+                media_jobs.append(('voice', message.voice.path))
+
+            # Video
+            if video:
+                message.video.name = store(video)
+                video.close()
+                media_jobs.append(('video', message.video.path))
+
+            if media_jobs:
+                message.processing = True
+                message.save()
+
+            connection.set_last_message(message)
+
         # Determine recipient
         recipient = connection.sender if connection.sender != user else connection.receiver
+        clear_typing(user.username, recipient.username)
 
-        # Send to sender
-        serialized_message = MessageSerializer(message, context={'user': user})
-        serialized_friend = UserSerializer(recipient)
-        self.send_group(user.username, 'message.send', {
-            'message': serialized_message.data,
-            'friend': serialized_friend.data,
-            'connection_id': connection.id
-        })
+        # Serialized once, per-recipient views (see events.py). An offline
+        # recipient gets it from their outbox on reconnect instead.
+        events = message_send_events(connection, user, message)
+        for username, event in skip_offline(events, recipient.username):
+            self.send_group(username, 'message.send', event)
 
-        # Send to recipient
-        serialized_message = MessageSerializer(message, context={'user': recipient})
-        serialized_friend = UserSerializer(user)
-        self.send_group(recipient.username, 'message.send', {
-            'message': serialized_message.data,
-            'friend': serialized_friend.data,
-            'connection_id': connection.id
-    })
+        # Queue media work only once both participants have the message
+        for kind, path in media_jobs:
+            self.defer(enqueue_media_job, kind, message, path)
         
     
     def receive_message_type(self, data):
         user = self.scope['user']
         recipient_username = data.get('username')
         
-        data = {
-            'username': user.username
-        }
-        self.send_group(recipient_username, 'message.type', data)
+        # Coalesced per sender/recipient, see typing.py
+        data = start_typing(user.username, recipient_username)
+        if data:
+            self.send_group(recipient_username, 'message.type', data)
+
+
+    def receive_typing_stop(self, data):
+        user = self.scope['user']
+        recipient_username = data.get('username')
+
+        data = stop_typing(user.username, recipient_username)
+        if data:
+            self.send_group(recipient_username, 'message.type', data)
     
     
     def receive_request_accept(self, data):
@@ -313,51 +328,25 @@ class ChatConsumers(WebsocketConsumer):
                 receiver=self.scope['user']
             )
         except Connection.DoesNotExist:
-            print('Error: Connection doesn\'t exists!')
+            log.warning('request.missing', extra=fields(sender=username))
             return
-        # Update the connection
+        # Update the connection, a new friend starts at the top of friend.list
         connection.accepted = True
+        connection.last_activity = timezone.now()
         connection.save()
         
-        serialized = RequestSerializer(connection)
-        # Send accepted request to sender
-        self.send_group(
-            connection.sender.username, 'request.accept', serialized.data
-        )
-        # Send accepted request to receiver
-        self.send_group(
-            connection.receiver.username, 'request.accept', serialized.data
-        )
-        # Notify both users to update their friend lists
-        # Send new friend object to sender
-        serialized_friend = FriendSerializer(
-            connection,
-            context={
-                'user': connection.sender
-            }
-        )
-        self.send_group(
-            connection.sender.username, 'friend.new', serialized_friend.data
-        )
-        
-        # Send new friend object to receiver
-        serialized_friend = FriendSerializer(
-            connection,
-            context={
-                'user': connection.receiver
-            }
-        )
-        self.send_group(
-            connection.receiver.username, 'friend.new', serialized_friend.data
-        )
-    
+        # request.accept to both, then friend.new so both friend lists update
+        for source, username, event in request_accept_events(connection):
+            self.send_group(username, source, event)
+
+
     def receive_request_connect(self, data):
         username = data.get('username')
         # Attempt to fetch the receiving user
         try:
             receiver = User.objects.get(username=username)
         except User.DoesNotExist:
-            print('Error: User not found!')
+            log.warning('user.missing', extra=fields(username=username))
             return
         # Create Connection
         connection, _ = Connection.objects.get_or_create(
@@ -365,14 +354,14 @@ class ChatConsumers(WebsocketConsumer):
             receiver=receiver
         )
         # Serialized Connection
-        serialized = RequestSerializer(connection)
+        serialized = request_data(connection)
         # Send Bact to Sender
         self.send_group(
-            connection.sender.username, 'request.connect', serialized.data
+            connection.sender.username, 'request.connect', serialized
         )
         # Send to Receiver
         self.send_group(
-            connection.receiver.username, 'request.connect', serialized.data
+            connection.receiver.username, 'request.connect', serialized
         )
         
     def receive_request_list(self, data):
@@ -381,21 +370,21 @@ class ChatConsumers(WebsocketConsumer):
         connections = Connection.objects.filter(
             receiver=user,
             accepted=False
+        ).select_related(
+            'sender', 'receiver'
         )
-        serialized = RequestSerializer(connections, many=True)
+        serialized = [request_data(connection) for connection in connections]
         # Send requests list back to this user
-        self.send_group(user.username, 'request.list', serialized.data)
+        self.send_group(user.username, 'request.list', serialized)
         
             
     def receive_search(self, data):
         query = data.get('query')
-        # Get users from query search term
+        # Ranked, capped ids from the search index (see search.py)
+        ids = search_user_ids(query, exclude_id=self.scope['user'].id)
+        # Connection status only for the returned page
         users = User.objects.filter(
-            Q(username__istartswith=query) | 
-            Q(first_name__istartswith=query) | 
-            Q(last_name__istartswith=query)             
-        ).exclude(
-            username=self.username
+            id__in=ids
         ).annotate(
             pending_them=Exists(
                 Connection.objects.filter(
@@ -418,33 +407,39 @@ class ChatConsumers(WebsocketConsumer):
                     accepted=True
                 )
             )
-        )
+        ).in_bulk()
+        users = [users[i] for i in ids if i in users]
         # serialize results
-        serialized = SearchSerializer(users, many=True)
+        serialized = [search_data(user) for user in users]
         
         # Send search results back to this user
-        self.send_group(self.username, 'search', serialized.data)
+        self.send_group(self.username, 'search', serialized)
             
             
     def receive_thumbnail(self, data):
         user = self.scope['user']
-        
-        # Convert base64 data to django content file
-        image_str = data.get('base64')
-        image = ContentFile(base64.b64decode(image_str))
-        
-        # Update thumbnail field
-        filename = data.get('filename')
-        user.thumbnail.save(filename, image, save=True)
+
+        # Square variants, small enough to make inline (see images.py)
+        try:
+            variants = avatar_variants(base64.b64decode(data['base64']))
+        except ValueError as e:
+            self.reply('frame.error', {'source': 'thumbnail', 'error': str(e)})
+            return
+        user.set_avatar(variants)
         
         # Serialize user
-        serialized = UserSerializer(user)
+        serialized = user_data(user)
         
         # Send updated user data including new thumbnail
-        self.send_group(self.username, 'thumbnail', serialized.data)
+        self.send_group(self.username, 'thumbnail', serialized)
       
     # New Message Seen handler:  
     def receive_message_seen(self, data):
+        # Batched variant: everything up to a message id in one UPDATE
+        if data.get('upToId') is not None:
+            self.receive_message_seen_up_to(data)
+            return
+
         user = self.scope['user']
         message_id = data.get('messageId')
         try:
@@ -455,11 +450,50 @@ class ChatConsumers(WebsocketConsumer):
         # Only recipient can mark seen
         if msg.user != user:
             msg.seen = True
+            msg.delivered = True
             msg.save()
 
-            serialized = MessageSerializer(msg, context={'user': user})
-            self.send_group(msg.connection.sender.username, 'message.seen', serialized.data)
-            self.send_group(msg.connection.receiver.username, 'message.seen', serialized.data)
+            serialized = message_data(msg, user)
+            self.send_group(msg.connection.sender.username, 'message.seen', serialized)
+            self.send_group(msg.connection.receiver.username, 'message.seen', serialized)
+
+
+    def receive_message_seen_up_to(self, data):
+        '''
+        {'source': 'message.seen', 'connectionId': 6, 'upToId': 151}
+        Marks every message up to upToId that the other participant sent
+        as seen, and tells both sides with one compact event instead of
+        re-serializing each message.
+        '''
+        user = self.scope['user']
+        connection_id = data.get('connectionId')
+        up_to_id = data.get('upToId')
+        try:
+            connection = Connection.objects.select_related('sender', 'receiver').get(
+                Q(sender=user) | Q(receiver=user),
+                id=connection_id
+            )
+        except Connection.DoesNotExist:
+            return
+
+        # Only recipient can mark seen
+        updated = Message.objects.filter(
+            connection=connection,
+            id__lte=up_to_id,
+            seen=False
+        ).exclude(
+            user=user
+        ).update(seen=True, delivered=True, updated=timezone.now())
+        if not updated:
+            return
+
+        data = {
+            'connection_id': connection.id,
+            'seen_up_to': up_to_id,
+            'username': user.username
+        }
+        self.send_group(connection.sender.username, 'message.seen_up_to', data)
+        self.send_group(connection.receiver.username, 'message.seen_up_to', data)
     
     # --------------------------
     #     Message Delete (client -> server)
@@ -478,14 +512,17 @@ class ChatConsumers(WebsocketConsumer):
         if msg.user != user:
             return
 
-        msg.delete()
-
         # Broadcast deletion back to both participants via usernames
         # Determine participants via connection
-        try:
-            connection = Connection.objects.get(id=connection_id)
-        except Connection.DoesNotExist:
-            return
+        connection = msg.connection
+
+        with transaction.atomic():
+            was_last = connection.last_message_id == msg.id
+            record_deletion(msg)
+            msg.delete()
+            # Fall back to the previous message for the friend.list preview
+            if was_last:
+                connection.refresh_summary()
 
         # Notify both users to remove message
         self.send_group(connection.sender.username, "message.deleted", {"messageId": message_id})
@@ -503,55 +540,232 @@ class ChatConsumers(WebsocketConsumer):
 
         # Validate target connection
         try:
-            target_connection = Connection.objects.get(id=to_conn)
+            target_connection = Connection.objects.select_related(
+                'sender', 'receiver'
+            ).get(id=to_conn)
         except Connection.DoesNotExist:
             return
 
-        for mid in ids:
-            try:
-                msg = Message.objects.get(id=mid, connection_id=from_conn)
-            except Message.DoesNotExist:
-                continue
+        # All source messages in one query, kept in the order requested
+        found = Message.objects.filter(id__in=ids, connection_id=from_conn).in_bulk()
+        sources = [found[mid] for mid in ids if mid in found]
+        if not sources:
+            return
 
-            # Duplicate into new connection (set sender = current user)
-            new_msg = Message.objects.create(
-                connection=target_connection,
-                user=user,
-                text=msg.text,
-                image=msg.image,
-                voice=msg.voice,
-                video=msg.video,
-                video_thumbnail=msg.video_thumbnail,
-                # video_duration_ms=msg.video_duration_ms,
-                video_duration=msg.video_duration,
-                delivered=True,
-            )
+        # Duplicate into new connection (set sender = current user). Media
+        # is already processed, so the copies share its files (one more
+        # reference each, see blobs.py) and metadata.
+        with transaction.atomic():
+            new_messages = Message.objects.bulk_create([
+                Message(
+                    connection=target_connection,
+                    user=user,
+                    text=msg.text,
+                    image=msg.image,
+                    image_variants=msg.image_variants,
+                    image_width=msg.image_width,
+                    image_height=msg.image_height,
+                    image_placeholder=msg.image_placeholder,
+                    voice=msg.voice,
+                    waveform=msg.waveform,
+                    video=msg.video,
+                    video_thumbnail=msg.video_thumbnail,
+                    video_duration=msg.video_duration,
+                    video_width=msg.video_width,
+                    video_height=msg.video_height,
+                )
+                for msg in sources
+            ])
+            add_refs(name for msg in sources for name in msg.media_names())
+            target_connection.set_last_message(new_messages[-1])
 
-            # Broadcast to both participants of target connection using DRF serializer
-            sender_ctx = {'user': target_connection.sender}
-            receiver_ctx = {'user': target_connection.receiver}
-
-            self.send_group(
-                target_connection.sender.username,
-                "message.send",
-                {
-                    "message": MessageSerializer(new_msg, context=sender_ctx).data,
-                    "friend": UserSerializer(target_connection.receiver).data,
-                    "connection_id": target_connection.id,
-                },
-            )
+        # One batched event per participant of the target connection
+        _, recipient = participants(target_connection, user)
+        events = message_batch_events(target_connection, user, new_messages)
+        for username, event in skip_offline(events, recipient.username):
+            self.send_group(username, "message.send_batch", event)
 
-            self.send_group(
-                target_connection.receiver.username,
-                "message.send",
-                {
-                    "message": MessageSerializer(new_msg, context=receiver_ctx).data,
-                    "friend": UserSerializer(target_connection.sender).data,
-                    "connection_id": target_connection.id,
-                },
-            )
+
+    # --------------------------
+    #     Delivery (see outbox.py)
+    # --------------------------
+    def receive_message_delivered(self, data):
+        '''
+        {'source': 'message.delivered', 'messageIds': [151, 152]}
+        One ack per batch of received messages. Each author hears about
+        theirs in one event per conversation.
+        '''
+        message_ids = data.get('messageIds')
+        if not isinstance(message_ids, list):
+            return
+        acked = mark_delivered(self.scope['user'], message_ids)
+        for (author, connection_id), ids in acked.items():
+            self.send_group(author, 'message.delivered', {
+                'connection_id': connection_id,
+                'messageIds': ids
+            })
+
+
+    def drain_outbox(self, data):
+        # Everything that arrived while this user was offline, in one push
+        # to the socket that just connected
+        outbox = outbox_data(self.scope['user'])
+        if outbox['batches']:
+            self.reply('message.outbox', outbox)
+
+
+    # --------------------------
+    #     Delta Sync (see sync.py)
+    # --------------------------
+    def receive_sync_since(self, data):
+        # Straight to the asking socket, in order; bounded per frame
+        for frame in sync_frames(self.scope['user'], data.get('cursor')):
+            self.reply('sync.since', frame)
+
+
+    # --------------------------
+    #     Chunked Uploads (see uploads.py)
+    # --------------------------
+    def receive_upload_start(self, data):
+        if len(self.uploads) >= get_upload_settings()['MAX_PENDING']:
+            self.reply('upload.error', {'error': 'Too many pending uploads'})
+            return
+        try:
+            upload = ChunkedUpload(data.get('filename'), data.get('size'))
+        except UploadError as e:
+            self.reply('upload.error', {'error': str(e)})
+            return
+        self.uploads[upload.upload_id] = upload
+        self.reply('upload.start', {
+            'uploadId': upload.upload_id,
+            'filename': upload.filename,
+            'offset': 0,
+            'chunk_size': upload.chunk_size
+        })
+
+
+    def receive_upload_chunk(self, bytes_data):
+        # Raw binary chunk frame (JSON sockets)
+        try:
+            upload_id, offset, payload = parse_chunk_frame(bytes_data)
+        except UploadError as e:
+            self.reply('upload.error', {'uploadId': None, 'offset': None, 'error': str(e)})
+            return
+        self.write_upload_chunk(upload_id, offset, payload)
+
+
+    def receive_upload_chunk_frame(self, data):
+        # {'source': 'upload.chunk', ...} (msgpack sockets, see wire.py)
+        self.write_upload_chunk(data['uploadId'], data['offset'], data['data'])
+
+
+    def write_upload_chunk(self, upload_id, offset, payload):
+        upload = self.uploads.get(upload_id)
+        try:
+            if upload is None:
+                raise UploadError(f'Unknown upload {upload_id}')
+            upload.write(offset, payload)
+        except UploadError as e:
+            self.reply('upload.error', {
+                'uploadId': upload.upload_id if upload else None,
+                'offset': upload.received if upload else None,
+                'error': str(e)
+            })
+            return
+        self.reply('upload.chunk', {
+            'uploadId': upload.upload_id,
+            'offset': upload.received,
+            'complete': upload.complete
+        })
+
+
+    def take_media(self, data, kind):
+        '''
+        Media for message.send arrives either as a finished chunked upload
+        (<kind>_upload) or, from older clients, as inline base64 (<kind> and
+        <kind>_filename). Returns a File named after the original upload.
+        '''
+        upload_id = data.get(f'{kind}_upload')
+        if upload_id:
+            upload = self.uploads.pop(upload_id, None)
+            if upload is None or not upload.complete:
+                log.warning('upload.incomplete', extra=fields(kind=kind, upload_id=upload_id))
+                if upload:
+                    upload.discard()
+                return None
+            return upload.as_file()
+
+        payload = data.get(kind)
+        filename = data.get(f'{kind}_filename')
+        if payload and filename:
+            payload = payload.split(';base64,')[-1]
+            return ContentFile(base64.b64decode(payload), name=filename)
+        return None
+
+
+    def discard_uploads(self):
+        for upload in self.uploads.values():
+            upload.discard()
+        self.uploads = {}
+
+
+class ChatConsumers(ChatHandlers, WebsocketConsumer):
     
+    def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            log.info('socket.rejected')
+            return
+        # Save username to use as a group name for this user
+        self.username = user.username
+        self.uploads = {}
+        # JSON or msgpack, from the offered subprotocols (see wire.py)
+        self.codec, subprotocol = negotiate(self.scope.get('subprotocols'))
         
+        # Join this user to a group with their username
+        async_to_sync(self.channel_layer.group_add)(
+            self.username, self.channel_name
+        )
+        
+        self.accept(subprotocol)
+        metrics.socket_opened()
+        user_connected(self.username)
+        # After user_connected: a message sent from here on is pushed live
+        self.handle_frame('message.outbox', self.drain_outbox, None)
+        self.timing.finish()
+        
+        
+    def disconnect(self, close_code):
+        if not hasattr(self, 'username'):
+            return
+        metrics.socket_closed()
+        self.codec.close()
+        user_disconnected(self.username)
+        # Leave room/group
+        async_to_sync(self.channel_layer.group_discard)(
+            self.username, self.channel_name
+        )
+        self.discard_uploads()
+
+    #--------------------------
+    #     Receive Frames
+    #--------------------------
+    def receive(self, text_data=None, bytes_data=None):
+        metrics.frame_received(text_data, bytes_data)
+        # On JSON sockets binary frames are upload chunks
+        if bytes_data is not None and not self.codec.binary:
+            self.handle_frame('upload.chunk', self.receive_upload_chunk, bytes_data)
+            self.timing.finish()
+            return
+
+        # Receive message from Websocket
+        data = self.decode_frame(text_data, bytes_data)
+        if data is None:
+            return
+
+        self.handle_frame(data.get('source'), self.dispatch_source, data)
+        self.timing.finish()
+
     #-------------------------------------------------
     #     Catch/All Broadcast to Client Helpers
     #-------------------------------------------------
@@ -561,9 +775,28 @@ class ChatConsumers(WebsocketConsumer):
             'source': source,
             'data': data
         }
+        start = time.perf_counter()
         async_to_sync(self.channel_layer.group_send)(
             group, response
         )
+        elapsed = time.perf_counter() - start
+        self.timing.add_send(elapsed)
+        metrics.group_sent(elapsed)
+
+
+    def send(self, text_data=None, bytes_data=None, close=False):
+        metrics.frame_sent(text_data, bytes_data)
+        super().send(text_data, bytes_data, close)
+
+
+    def reply(self, source, data):
+        # Straight back down this socket only (not the user's other devices)
+        self.send(**self.codec.encode({'source': source, 'data': data}))
+
+
+    def defer(self, func, *args):
+        # Replies were already sent synchronously, so just run it
+        func(*args)
         
         
     def broadcast_group(self, data):
@@ -575,14 +808,161 @@ class ChatConsumers(WebsocketConsumer):
         '''
         
         data.pop('type')
+        if is_stale_typing(data['source'], data['data']):
+            return
         '''
         return data:
             - source: Where it originated from?
             - data: What ever you want to send as a dictionary
         '''
         
-        self.send(text_data=json.dumps(data))
-        
+        self.send(**self.codec.encode(data))
+
+
+class AsyncChatConsumers(ChatHandlers, AsyncWebsocketConsumer):
+    '''
+    Same protocol as ChatConsumers, but the socket lives on the event loop.
+    Only the DB/serializer work of a handler is pushed to a thread through
+    database_sync_to_async; group sends and frame writes stay async.
+    '''
+
+    async def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            return
+        # Save username to use as a group name for this user
+        self.username = user.username
+        self.outbox = []
+        self.deferred = []
+        self.uploads = {}
+        # JSON or msgpack, from the offered subprotocols (see wire.py)
+        self.codec, subprotocol = negotiate(self.scope.get('subprotocols'))
+
+        # Join this user to a group with their username
+        await self.channel_layer.group_add(
+            self.username, self.channel_name
+        )
+
+        await self.accept(subprotocol)
+        metrics.socket_opened()
+        # The redis store is a blocking client; keep it off the loop
+        await sync_to_async(user_connected, thread_sensitive=False)(self.username)
+        # After user_connected: a message sent from here on is pushed live
+        await database_sync_to_async(self.handle_frame)('message.outbox', self.drain_outbox, None)
+        await self.flush_outbox()
+        self.timing.finish()
+
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'username'):
+            return
+        metrics.socket_closed()
+        self.codec.close()
+        await sync_to_async(user_disconnected, thread_sensitive=False)(self.username)
+        # Leave room/group
+        await self.channel_layer.group_discard(
+            self.username, self.channel_name
+        )
+        await sync_to_async(self.discard_uploads, thread_sensitive=False)()
+
+    #--------------------------
+    #     Receive Frames
+    #--------------------------
+    async def receive(self, text_data=None, bytes_data=None):
+        metrics.frame_received(text_data, bytes_data)
+        # On JSON sockets binary frames are upload chunks: plain file I/O,
+        # so keep them off the shared DB thread
+        if bytes_data is not None and not self.codec.binary:
+            await sync_to_async(self.handle_frame, thread_sensitive=False)(
+                'upload.chunk', self.receive_upload_chunk, bytes_data
+            )
+            await self.flush_outbox()
+            self.timing.finish()
+            return
+
+        data = self.decode_frame(text_data, bytes_data)
+        if data is None:
+            return
+
+        # Frames are handled one at a time per socket, so the outbox is
+        # only ever filled by the handler we are about to run.
+        source = data.get('source')
+        if source in OFF_DB_SOURCES:
+            await sync_to_async(self.handle_frame, thread_sensitive=False)(
+                source, self.dispatch_source, data
+            )
+        else:
+            await database_sync_to_async(self.handle_frame)(source, self.dispatch_source, data)
+        await self.flush_outbox()
+        self.timing.finish()
+
+    #-------------------------------------------------
+    #     Catch/All Broadcast to Client Helpers
+    #-------------------------------------------------
+    def send_group(self, group, source, data):
+        # Called from (threaded) handler code: queue it, flush_outbox sends
+        self.outbox.append((group, {
+            'type': 'broadcast_group',
+            'source': source,
+            'data': data
+        }))
+
+
+    def reply(self, source, data):
+        # group=None: send down this socket only
+        self.outbox.append((None, {'source': source, 'data': data}))
+
+
+    def defer(self, func, *args):
+        # Run after the handler's replies have been flushed
+        self.deferred.append((func, args))
+
+
+    async def flush_outbox(self):
+        outbox, self.outbox = self.outbox, []
+        start = time.perf_counter()
+        for group, response in outbox:
+            if group is None:
+                await self.send(**self.codec.encode(response))
+            else:
+                sent = time.perf_counter()
+                await self.channel_layer.group_send(group, response)
+                metrics.group_sent(time.perf_counter() - sent)
+        self.timing.add_send(time.perf_counter() - start)
+        deferred, self.deferred = self.deferred, []
+        for func, args in deferred:
+            await database_sync_to_async(func)(*args)
+
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        metrics.frame_sent(text_data, bytes_data)
+        await super().send(text_data, bytes_data, close)
+
+
+    async def broadcast_group(self, data):
+        data.pop('type')
+        if is_stale_typing(data['source'], data['data']):
+            return
+        await self.send(**self.codec.encode(data))
+
+
+def log_frame(username, data):
+    # Redacting a frame is not free; only do it when someone is listening
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('frame.receive', extra=fields(username=username, frame=redact(data)))
+
+
+def get_consumer_class():
+    '''
+    CHAT_CONSUMER_MODE selects the consumer served at /chat/:
+        - 'sync':  ChatConsumers (one executor thread per frame)
+        - 'async': AsyncChatConsumers (event loop, DB work in threads)
+    '''
+    mode = getattr(settings, 'CHAT_CONSUMER_MODE', 'sync')
+    if mode == 'async':
+        return AsyncChatConsumers
+    return ChatConsumers
+
 
 
  # if video and video_filename:
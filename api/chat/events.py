@@ -0,0 +1,104 @@
+# api/chat/events.py
+'''
+Build the events that go to both participants of a connection.
+
+The two sides of a message/connection event only differ in a couple of
+fields: `is_me` on each message and which user is the `friend`. The shared
+body is serialized once and each recipient gets a shallow copy with those
+fields overlaid, instead of running the serializers once per participant.
+
+Each builder returns [(username, data), ...], ready for send_group.
+'''
+from .fast_serializers import user_data, request_data, friend_data, message_data
+
+
+def participants(connection, user):
+    '''(user, other side) for a connection `user` belongs to.'''
+    if connection.sender_id == user.id:
+        return user, connection.receiver
+    return user, connection.sender
+
+
+def recipient_messages(bodies, is_me):
+    # Bodies were serialized from the author's point of view
+    if is_me:
+        return bodies
+    return [{**body, 'is_me': False} for body in bodies]
+
+
+#--------------------------
+#     Messages
+#--------------------------
+def message_batch_events(connection, author, messages):
+    '''
+    `messages` were all written by `author` on `connection`. Used by
+    message.send_batch (one event per participant).
+    '''
+    author, recipient = participants(connection, author)
+    bodies = [message_data(message, author) for message in messages]
+    author_data, recipient_data = user_data(author), user_data(recipient)
+    return [
+        (author.username, {
+            'messages': bodies,
+            'friend': recipient_data,
+            'connection_id': connection.id,
+        }),
+        (recipient.username, {
+            'messages': recipient_messages(bodies, False),
+            'friend': author_data,
+            'connection_id': connection.id,
+        }),
+    ]
+
+
+def conversation_batches(user, messages):
+    '''
+    Messages from any of `user`'s conversations, grouped into send_batch
+    shaped items as `user` sees them: [{'messages', 'friend', 'connection_id'}].
+    Needs connection__sender and connection__receiver selected.
+    '''
+    batches = {}
+    for message in messages:
+        connection = message.connection
+        batch = batches.get(connection.id)
+        if batch is None:
+            _, friend = participants(connection, user)
+            batch = batches[connection.id] = {
+                'messages': [],
+                'friend': user_data(friend),
+                'connection_id': connection.id,
+            }
+        batch['messages'].append(message_data(message, user))
+    return list(batches.values())
+
+
+def message_send_events(connection, author, message):
+    '''message.send for a single message, same shape as one batch item.'''
+    return [
+        (username, {
+            'message': data['messages'][0],
+            'friend': data['friend'],
+            'connection_id': data['connection_id'],
+        })
+        for username, data in message_batch_events(connection, author, [message])
+    ]
+
+
+#--------------------------
+#     Connections
+#--------------------------
+def request_accept_events(connection):
+    '''
+    request.accept (same payload for both) and friend.new (friend swapped),
+    returned as (source, username, data) triples in send order.
+    '''
+    sender_data = user_data(connection.sender)
+    receiver_data = user_data(connection.receiver)
+    request = request_data(connection, sender_data, receiver_data)
+    friend = friend_data(connection, connection.sender, friend=receiver_data)
+    return [
+        ('request.accept', connection.sender.username, request),
+        ('request.accept', connection.receiver.username, request),
+        ('friend.new', connection.sender.username, friend),
+        ('friend.new', connection.receiver.username, {**friend, 'friend': sender_data}),
+    ]
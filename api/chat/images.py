@@ -0,0 +1,141 @@
+# api/chat/images.py
+'''
+Size variants and placeholders for image messages.
+
+An image message goes out with the upload as sent and processing=True;
+the 'image' media job (jobs.py) then produces, off the request path:
+
+    - WebP variants bounded to each of WIDTHS on the longest side, plus
+      'full' (bounded to FULL_MAX), which replaces the upload on the
+      message. Orientation is applied and EXIF (GPS, camera serial...)
+      is not carried over.
+    - the full size in pixels, so clients can lay out the bubble first
+    - a LQIP placeholder: a PLACEHOLDER px WebP as a data: URI of a few
+      hundred bytes, shown blurred until a variant loads
+
+Variants at least as large as the image itself are skipped, so clients
+pick the smallest entry of message.image_variants that covers the bubble
+and fall back to 'full'. Animated images keep their upload and only get
+the size and placeholder. See `manage.py bench_images`.
+
+Avatars
+-------
+Profile pictures are small enough to handle inline in receive_thumbnail:
+avatar_variants() center-crops the upload to SMALL and LARGE px squares
+(never upscaled), also as WebP without EXIF. User.set_avatar stores them
+under avatars/<username>/<content version>-<size>.webp, so a new avatar
+is a new URL and media can be cached as immutable (see views.media_view).
+'''
+import base64
+import io
+import os
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+DEFAULTS = {
+    'WIDTHS': [320, 720],   # px, longest side, smallest first
+    'FULL_MAX': 2560,       # px; larger uploads are scaled down
+    'QUALITY': 80,          # WebP quality for the variants
+    'PLACEHOLDER': 16,      # px, longest side of the LQIP
+}
+
+
+AVATAR_DEFAULTS = {
+    'SMALL': 128,   # px square: lists, headers
+    'LARGE': 512,   # px square: profile screen
+    'QUALITY': 85,
+}
+
+
+class ImageError(ValueError):
+    pass
+
+
+def get_image_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_IMAGES', {})}
+
+
+def get_avatar_settings():
+    return {**AVATAR_DEFAULTS, **getattr(settings, 'CHAT_AVATARS', {})}
+
+
+def encode_webp(image, quality):
+    buffer = io.BytesIO()
+    # No exif= argument: nothing from the upload's metadata is written
+    image.save(buffer, 'WEBP', quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def normalize_mode(image):
+    if image.mode in ('RGB', 'RGBA'):
+        return image
+    return image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+
+def placeholder(image, size):
+    small = image.copy()
+    small.thumbnail((size, size), Image.Resampling.BILINEAR)
+    return 'data:image/webp;base64,' + base64.b64encode(encode_webp(small, 30)).decode()
+
+
+def process_image(image_path, timeout=None):
+    '''
+    Media job processor: {'width', 'height', 'placeholder', 'variants'},
+    where variants maps '320' / '720' / 'full' to (filename, bytes).
+    Pure Pillow, no database, so it runs in the job pool.
+    '''
+    config = get_image_settings()
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    with Image.open(image_path) as image:
+        animated = getattr(image, 'is_animated', False)
+        if not animated:
+            # JPEG decodes straight to a fraction of its size (DCT scaling)
+            # when the full variant is smaller than the upload
+            image.draft('RGB', (config['FULL_MAX'], config['FULL_MAX']))
+        image = normalize_mode(ImageOps.exif_transpose(image))
+
+        result = {
+            'width': image.width,
+            'height': image.height,
+            'placeholder': placeholder(image, config['PLACEHOLDER']),
+            'variants': {},
+        }
+        if animated:
+            return result
+
+        image.thumbnail((config['FULL_MAX'], config['FULL_MAX']), Image.Resampling.LANCZOS)
+        result['width'], result['height'] = image.size
+        result['variants']['full'] = (f'{stem}_full.webp', encode_webp(image, config['QUALITY']))
+
+        # Largest first, each scaled from the one before it
+        for bound in sorted(config['WIDTHS'], reverse=True):
+            if max(image.size) <= bound:
+                continue
+            image = image.copy()
+            image.thumbnail((bound, bound), Image.Resampling.LANCZOS)
+            result['variants'][str(bound)] = (f'{stem}_{bound}.webp', encode_webp(image, config['QUALITY']))
+    return result
+
+
+#--------------------------
+#     Avatars
+#--------------------------
+def avatar_variants(data):
+    '''{'small': bytes, 'large': bytes} from uploaded image bytes.'''
+    config = get_avatar_settings()
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft('RGB', (config['LARGE'], config['LARGE']))
+            image = normalize_mode(ImageOps.exif_transpose(image))
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageError(f'Not a usable image: {e}')
+
+    side = min(config['LARGE'], *image.size)
+    large = ImageOps.fit(image, (side, side), Image.Resampling.LANCZOS)
+    side = min(config['SMALL'], side)
+    small = large.resize((side, side), Image.Resampling.LANCZOS)
+    return {
+        'small': encode_webp(small, config['QUALITY']),
+        'large': encode_webp(large, config['QUALITY']),
+    }
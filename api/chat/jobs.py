@@ -0,0 +1,318 @@
+# api/chat/jobs.py
+'''
+Background media processing for image, voice and video messages.
+
+receive_message_send saves the upload, marks the message as `processing`
+and broadcasts it straight away. The heavy work (ffmpeg/ffprobe, waveforms
+in waveform.py, image variants in images.py) is queued here; when a job
+finishes the message is updated and both participants get a
+`message.media_ready` event.
+
+Backends (settings.MEDIA_JOBS['BACKEND']):
+    - 'process': bounded ProcessPoolExecutor, supervised by one thread per
+                 in-flight job that applies the per-attempt timeout/retries.
+                 A job still running at its timeout can't be cancelled (and
+                 Pillow ignores `timeout`), so the pool is replaced and its
+                 workers killed; other jobs in flight fail that attempt and
+                 are retried on the new pool.
+    - 'local':   runs the job inline in the calling thread (tests)
+'''
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import metrics
+from .images import process_image
+from .logs import fields
+from .video import process_video
+from .waveform import process_voice
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'process',
+    'WORKERS': 2,
+    'RETRIES': 2,
+    'TIMEOUT': 120,
+}
+
+PROCESSORS = {
+    'image': process_image,
+    'voice': process_voice,
+    'video': process_video,
+}
+
+
+def get_job_settings():
+    return {**DEFAULTS, **getattr(settings, 'MEDIA_JOBS', {})}
+
+
+class MediaJob:
+    def __init__(self, kind, message_id, path):
+        self.kind = kind
+        self.message_id = message_id
+        self.path = path
+        self.attempts = 0
+
+    def __str__(self):
+        return f'{self.kind} job for message {self.message_id}'
+
+
+class LocalBackend:
+    '''
+    Runs everything inline in the caller's thread. The timeout is only
+    enforced by the processors' own subprocess timeouts.
+    '''
+
+    def execute(self, func, path, timeout):
+        return func(path, timeout=timeout)
+
+    def spawn(self, supervise, job):
+        supervise(job)
+
+    def shutdown(self):
+        pass
+
+
+def kill_pool(pool):
+    # ProcessPoolExecutor has no way to stop a running call before
+    # terminate_workers() (Python 3.14)
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.kill()
+
+
+class ProcessPoolBackend:
+    def __init__(self, workers):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pool = self.new_pool()
+        # One supervisor per pool worker bounds the jobs in flight; the
+        # rest wait in the executor queue.
+        self.supervisors = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='media-jobs'
+        )
+
+    def new_pool(self):
+        # spawn: the parent runs an event loop and threads, never fork that
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+
+    def execute(self, func, path, timeout):
+        pool = self.pool
+        try:
+            future = pool.submit(func, path, timeout=timeout)
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if not future.done() and not future.cancel():
+                # Still running: it would hold its worker for good
+                log.warning('media_job.pool_recycled', extra=fields(reason='timeout'))
+                self.recycle(pool)
+            raise
+        except BrokenProcessPool:
+            # A worker died (or the pool was recycled under this job);
+            # a broken pool refuses every later submit
+            self.recycle(pool)
+            raise
+
+    def recycle(self, pool):
+        with self.lock:
+            if self.pool is not pool:
+                return  # another supervisor got there first
+            self.pool = self.new_pool()
+        kill_pool(pool)
+
+    def spawn(self, supervise, job):
+        self.supervisors.submit(supervise, job)
+
+    def shutdown(self):
+        self.supervisors.shutdown(wait=False)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class MediaJobQueue:
+    def __init__(self, backend, retries, timeout):
+        self.backend = backend
+        self.retries = retries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def enqueue(self, kind, message, path):
+        job = MediaJob(kind, message.id, path)
+        with self.lock:
+            self.pending += 1
+        self.backend.spawn(self.supervise, job)
+        return job
+
+    def depth(self):
+        return self.pending
+
+    def supervise(self, job):
+        try:
+            result, error = None, None
+            while job.attempts <= self.retries:
+                job.attempts += 1
+                try:
+                    result = self.backend.execute(
+                        PROCESSORS[job.kind], job.path, self.timeout
+                    )
+                    error = None
+                    break
+                except FutureTimeoutError:
+                    error = f'timed out after {self.timeout}s'
+                except Exception as e:
+                    error = str(e) or e.__class__.__name__
+                log.warning('media_job.attempt_failed', extra=fields(
+                    kind=job.kind, message_id=job.message_id,
+                    attempt=job.attempts, error=error
+                ))
+            apply_media_result(job, result, error)
+        except Exception:
+            log.exception('media_job.apply_failed', extra=fields(
+                kind=job.kind, message_id=job.message_id
+            ))
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+
+def apply_media_result(job, result, error=None):
+    '''
+    Store what the processor produced on the message, clear `processing`
+    and tell both participants.
+    '''
+    from .blobs import store
+    from .models import Message
+    from .fast_serializers import message_data
+
+    try:
+        message = Message.objects.select_related(
+            'connection__sender', 'connection__receiver'
+        ).get(id=job.message_id)
+    except Message.DoesNotExist:
+        # Deleted while processing
+        return
+
+    update_fields = ['processing', 'updated']
+    message.processing = False
+    if result:
+        if 'waveform' in result:
+            message.waveform = result['waveform']
+            update_fields.append('waveform')
+        if result.get('video_duration') is not None:
+            message.video_duration = result['video_duration']
+            update_fields.append('video_duration')
+        if result.get('video_width') is not None:
+            message.video_width = result['video_width']
+            message.video_height = result['video_height']
+            update_fields += ['video_width', 'video_height']
+        if result.get('thumbnail'):
+            thumb_name, thumb_bytes = result['thumbnail']
+            message.video_thumbnail.name = store(ContentFile(thumb_bytes, name=thumb_name))
+            update_fields.append('video_thumbnail')
+        if 'placeholder' in result:
+            apply_image_result(message, result)
+            update_fields += ['image', 'image_variants', 'image_width', 'image_height', 'image_placeholder']
+    message.save(update_fields=update_fields)
+
+    serialized = message_data(message)
+    data = {
+        'messageId': message.id,
+        'connection_id': message.connection_id,
+        'processing': False,
+        'waveform': serialized['waveform'],
+        'video_duration': serialized['video_duration'],
+        'video_width': serialized['video_width'],
+        'video_height': serialized['video_height'],
+        'video_thumb_url': serialized['video_thumb_url'],
+        'image': serialized['image'],
+        'image_variants': serialized['image_variants'],
+        'image_width': serialized['image_width'],
+        'image_height': serialized['image_height'],
+        'image_placeholder': serialized['image_placeholder'],
+        'error': error,
+    }
+    connection = message.connection
+    for username in (connection.sender.username, connection.receiver.username):
+        broadcast(username, 'message.media_ready', data)
+
+
+def apply_image_result(message, result):
+    # The full variant replaces the upload, which still has its EXIF; other
+    # messages sharing the upload keep it until theirs is processed too
+    from .blobs import release, store
+
+    variants = {
+        key: store(ContentFile(data, name=name))
+        for key, (name, data) in result['variants'].items()
+    }
+    if 'full' in variants:
+        release([message.image.name])
+        message.image.name = variants.pop('full')
+    message.image_variants = variants
+    message.image_width = result['width']
+    message.image_height = result['height']
+    message.image_placeholder = result['placeholder']
+
+
+def broadcast(group, source, data):
+    start = time.perf_counter()
+    async_to_sync(get_channel_layer().group_send)(group, {
+        'type': 'broadcast_group',
+        'source': source,
+        'data': data
+    })
+    metrics.group_sent(time.perf_counter() - start)
+
+
+#--------------------------
+#     Queue singleton
+#--------------------------
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_media_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            config = get_job_settings()
+            if config['BACKEND'] == 'local':
+                backend = LocalBackend()
+            else:
+                backend = ProcessPoolBackend(config['WORKERS'])
+            _queue = MediaJobQueue(backend, config['RETRIES'], config['TIMEOUT'])
+        return _queue
+
+
+@receiver(setting_changed)
+def reset_media_queue(setting, **kwargs):
+    global _queue
+    if setting == 'MEDIA_JOBS' and _queue is not None:
+        _queue.backend.shutdown()
+        _queue = None
+
+
+def media_queue_depth():
+    # For /metrics: don't start a pool just to report that it's empty
+    queue = _queue
+    return queue.depth() if queue is not None else 0
+
+
+def enqueue_media_job(kind, message, path):
+    return get_media_queue().enqueue(kind, message, path)
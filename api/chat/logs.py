@@ -0,0 +1,86 @@
+# api/chat/logs.py
+'''
+Logging for the chat app.
+
+Everything logs through `logging.getLogger('chat.<module>')` with the event
+name as the message and the details as keyword fields:
+
+    log.warning('connection.missing', extra=fields(connection_id=5))
+
+StructuredFormatter renders that as one line:
+
+    2025-01-01T12:00:00 WARNING chat.consumers connection.missing connection_id=5
+
+Frame payloads must go through redact() first: message.send carries whole
+base64 images/voice notes/videos, and sign-in frames carry tokens.
+'''
+import json
+import logging
+
+from django.conf import settings
+
+DEFAULTS = {
+    'MAX_STRING': 200,  # longer strings are truncated
+    'MAX_ITEMS': 20,    # longer lists are cut off
+}
+
+# Values never logged, only their size
+REDACT_KEYS = {
+    'password', 'token', 'access', 'refresh',
+    'base64', 'image', 'voice', 'video', 'thumbnail',
+}
+
+
+def get_log_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_LOGGING', {})}
+
+
+def fields(**kwargs):
+    '''Keyword fields for a log call: log.info('event', extra=fields(...)).'''
+    return {'fields': kwargs}
+
+
+def redact(data, config=None):
+    '''Copy of a frame payload that is safe (and cheap) to log.'''
+    config = config or get_log_settings()
+    if isinstance(data, dict):
+        return {
+            key: redact_value(value) if key in REDACT_KEYS else redact(value, config)
+            for key, value in data.items()
+        }
+    if isinstance(data, (list, tuple)):
+        items = [redact(item, config) for item in data[:config['MAX_ITEMS']]]
+        if len(data) > config['MAX_ITEMS']:
+            items.append(f'...{len(data) - config["MAX_ITEMS"]} more')
+        return items
+    if isinstance(data, str) and len(data) > config['MAX_STRING']:
+        return f'{data[:config["MAX_STRING"]]}...({len(data)} chars)'
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return f'<{len(data)} bytes>'
+    return data
+
+
+def redact_value(value):
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return f'<redacted {len(value)}>'
+    if isinstance(value, dict):
+        return {key: redact_value(item) for key, item in value.items()}
+    return '<redacted>'
+
+
+class StructuredFormatter(logging.Formatter):
+    '''`time level logger event key=value ...`, values JSON encoded.'''
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('datefmt', '%Y-%m-%dT%H:%M:%S')
+        super().__init__(*args, **kwargs)
+
+    def format(self, record):
+        line = f'{self.formatTime(record, self.datefmt)} {record.levelname} {record.name} {record.getMessage()}'
+        for key, value in getattr(record, 'fields', {}).items():
+            line += f' {key}={json.dumps(value, default=str)}'
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
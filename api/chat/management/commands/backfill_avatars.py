@@ -0,0 +1,28 @@
+# api/chat/management/commands/backfill_avatars.py
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from chat.images import ImageError, avatar_variants
+from chat.models import User
+
+
+class Command(BaseCommand):
+    help = 'Make square small/large variants under versioned names for avatars uploaded before them'
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        users = User.objects.filter(
+            Q(thumbnail_small='') | Q(thumbnail_small__isnull=True)
+        ).exclude(Q(thumbnail='') | Q(thumbnail__isnull=True))
+        for user in users.iterator():
+            try:
+                with user.thumbnail.open('rb') as fh:
+                    variants = avatar_variants(fh.read())
+            except (OSError, ImageError) as e:
+                self.stderr.write(f'{user.username}: {e}')
+                failed += 1
+                continue
+            user.set_avatar(variants)
+            done += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {done} avatars, {failed} failed'))
@@ -0,0 +1,56 @@
+# api/chat/management/commands/backfill_blobs.py
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+
+from chat.blobs import MEDIA_FIELDS, content_hash
+from chat.models import Blob, Message
+
+
+def legacy_names():
+    '''Media names on messages that aren't in the blob store yet.'''
+    names = set()
+    for field in MEDIA_FIELDS:
+        names.update(
+            Message.objects.exclude(Q(**{f'{field}__isnull': True}) | Q(**{field: ''}))
+            .exclude(**{f'{field}__startswith': 'blobs/'})
+            .values_list(field, flat=True)
+            .distinct()
+        )
+    return sorted(names)
+
+
+class Command(BaseCommand):
+    help = 'Move message media stored before chat/blobs.py into the blob store, merging duplicates'
+
+    def handle(self, *args, **options):
+        moved = merged = missing = freed = 0
+        for name in legacy_names():
+            if not default_storage.exists(name):
+                missing += 1
+                continue
+            with default_storage.open(name) as fh:
+                digest = content_hash(fh)
+                size = fh.size
+                with transaction.atomic():
+                    blob = Blob.objects.filter(sha256=digest).first()
+                    if blob is None:
+                        blob = Blob(sha256=digest, size=size)
+                        blob.file.save(name, fh, save=False)
+                        blob.save()
+                        moved += 1
+                    else:
+                        merged += 1
+                        freed += size
+                    refs = sum(
+                        Message.objects.filter(**{field: name}).update(**{field: blob.file.name})
+                        for field in MEDIA_FIELDS
+                    )
+                    Blob.objects.filter(id=blob.id).update(refs=F('refs') + refs)
+            default_storage.delete(name)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} files into the blob store, merged {merged} duplicates '
+            f'({freed / 1024 / 1024:.1f} MB freed), {missing} missing'
+        ))
@@ -0,0 +1,53 @@
+# api/chat/management/commands/backfill_conversations.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from chat.models import Connection, Message
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the last-message summary (friend.list preview/order) on every Connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        latest = Message.objects.filter(
+            connection=OuterRef('id')
+        ).order_by('-created', '-id')[:1]
+
+        # One query for the newest message id per connection, then the
+        # messages themselves in bulk
+        connections = Connection.objects.annotate(
+            latest_id=Subquery(latest.values('id'))
+        ).order_by('id')
+
+        updated = 0
+        batch = []
+        for connection in connections.iterator(chunk_size=batch_size):
+            batch.append(connection)
+            if len(batch) >= batch_size:
+                updated += self.apply(batch)
+                batch = []
+        if batch:
+            updated += self.apply(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {updated} connections'))
+
+    def apply(self, connections):
+        ids = [c.latest_id for c in connections if c.latest_id]
+        messages = Message.objects.in_bulk(ids)
+        for connection in connections:
+            message = messages.get(connection.latest_id)
+            connection.last_message = message
+            connection.last_text = message.text if message else None
+            connection.last_media = message.media_kind() if message else None
+            connection.last_activity = message.created if message else connection.updated
+        with transaction.atomic():
+            Connection.objects.bulk_update(
+                connections,
+                ['last_message', 'last_text', 'last_media', 'last_activity']
+            )
+        return len(connections)
@@ -0,0 +1,94 @@
+# api/chat/management/commands/bench_blobs.py
+import base64
+import os
+import random
+import shutil
+import tempfile
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.test.utils import override_settings
+
+from chat.bench import FrameRecorder, Stopwatch, bench_database, seed_chat
+from chat.models import Blob, Connection, Message
+
+
+class Command(BaseCommand):
+    help = 'Storage used by message media in the blob store (blobs.py) vs one file per upload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=40)
+        parser.add_argument('--sends', type=int, default=300, help='images sent with message.send')
+        parser.add_argument('--resend', type=float, default=0.3,
+                            help='share of sends that re-send an image sent before (memes, stickers)')
+        parser.add_argument('--forwards', type=int, default=150, help='media messages forwarded')
+        parser.add_argument('--size', type=int, default=64, help='KB per image')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root), bench_database():
+                self.run(options)
+        finally:
+            shutil.rmtree(media_root)
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        users = seed_chat(users=options['users'], friends=5, messages=0)
+        conversations = {
+            user.id: list(Connection.objects.filter(sender=user) | Connection.objects.filter(receiver=user))
+            for user in users
+        }
+        recorders = {user.id: FrameRecorder(user) for user in users}
+
+        sent = []   # image bytes per send
+        with Stopwatch() as sending:
+            for n in range(options['sends']):
+                if sent and rng.random() < options['resend']:
+                    content = rng.choice(sent)
+                else:
+                    content = os.urandom(options['size'] * 1024)
+                sent.append(content)
+                user = rng.choice(users)
+                recorders[user.id].receive_message_send({
+                    'connectionId': rng.choice(conversations[user.id]).id,
+                    'message': None,
+                    'image': base64.b64encode(content).decode(),
+                    'image_filename': f'photo{n}.jpg',
+                })
+
+        media = list(Message.objects.exclude(image='').values_list('id', 'connection_id', 'user_id'))
+        with Stopwatch() as forwarding:
+            for _ in range(options['forwards']):
+                message_id, connection_id, user_id = rng.choice(media)
+                recorders[user_id].receive_message_forward({
+                    'fromConnectionId': connection_id,
+                    'toConnectionId': rng.choice(conversations[user_id]).id,
+                    'messageIds': [message_id],
+                })
+
+        references = Message.objects.exclude(image='').count()
+        per_upload = sum(len(content) for content in sent)
+        # Before: one file per upload; forwards pointed at the original
+        # (so deleting either broke the other). Copying on forward instead:
+        copied = per_upload * references / len(sent)
+        stored = Blob.objects.aggregate(total=Sum('size'))['total']
+        files = sum(len(names) for _, _, names in os.walk(default_storage.path('blobs')))
+
+        self.stdout.write(
+            f"{len(sent)} sends ({options['resend']:.0%} re-sends), {options['forwards']} forwards: "
+            f"{references} messages with an image, {Blob.objects.count()} blobs, {files} files\n"
+        )
+        self.stdout.write(f"{'layout':<28} {'MB':>8} {'vs blobs':>9}")
+        for name, size in (
+            ('copy on forward', copied),
+            ('one file per upload', per_upload),
+            ('blob store', stored),
+        ):
+            self.stdout.write(f'{name:<28} {size / 1024 / 1024:>8.1f} {size / stored:>8.2f}x')
+        self.stdout.write(
+            f'\n{sending.elapsed / len(sent) * 1000:.2f} ms per send (hash + store), '
+            f"{forwarding.elapsed / max(options['forwards'], 1) * 1000:.2f} ms per forward"
+        )
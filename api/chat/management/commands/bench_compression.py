@@ -0,0 +1,102 @@
+# api/chat/management/commands/bench_compression.py
+import random
+import time
+import zlib
+
+from django.core.management.base import BaseCommand
+
+from chat.bench import FrameRecorder, bench_database, seed_chat
+from chat.events import message_send_events
+from chat.fast_serializers import dumps
+from chat.models import Connection, Message
+from chat.wire import DEFAULTS
+
+# (name, level, wbits, mem_level, context takeover)
+CONFIGS = [
+    ('level 1', 1, DEFAULTS['WBITS'], DEFAULTS['MEM_LEVEL'], True),
+    ('level 6 (default)', 6, DEFAULTS['WBITS'], DEFAULTS['MEM_LEVEL'], True),
+    ('level 9', 9, DEFAULTS['WBITS'], DEFAULTS['MEM_LEVEL'], True),
+    ('level 6, zlib window', 6, 15, 8, True),
+    ('level 6, no takeover', 6, DEFAULTS['WBITS'], DEFAULTS['MEM_LEVEL'], False),
+]
+
+
+def context_bytes(wbits, mem_level):
+    # zlib's deflate state: window + hash chains
+    return (1 << (wbits + 2)) + (1 << (mem_level + 9))
+
+
+def run_session(payloads, level, wbits, mem_level, takeover, min_size):
+    '''Total bytes on the wire and CPU seconds to compress one session.'''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -wbits, mem_level)
+    sent, cpu = 0, 0.0
+    for payload in payloads:
+        if len(payload) < min_size:
+            sent += len(payload)
+            continue
+        start = time.perf_counter()
+        if not takeover:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -wbits, mem_level)
+        data = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        cpu += time.perf_counter() - start
+        sent += len(data) - 3   # + envelope byte - sync tail
+    return sent, cpu
+
+
+class Command(BaseCommand):
+    help = 'Bytes saved vs CPU for the deflate frame envelope (wire.py) over a typical session'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--friends', type=int, default=50)
+        parser.add_argument('--pages', type=int, default=20, help='message.list pages in the session')
+        parser.add_argument('--sends', type=int, default=100, help='message.send events in the session')
+        parser.add_argument('--min-size', type=int, default=DEFAULTS['MIN_SIZE'])
+
+    def handle(self, *args, **options):
+        with bench_database():
+            payloads = self.session(options)
+
+        total = sum(len(p) for p in payloads)
+        self.stdout.write(
+            f"{len(payloads)} frames, {total / 1024:.1f} KB uncompressed, "
+            f"{sum(len(p) >= options['min_size'] for p in payloads)} over {options['min_size']} bytes\n"
+        )
+        self.stdout.write(
+            f"{'config':<22} {'KB sent':>8} {'saved':>7} {'cpu ms':>8} {'us/KB saved':>12} {'ctx KB':>7}"
+        )
+        for name, level, wbits, mem_level, takeover in CONFIGS:
+            sent, cpu = run_session(payloads, level, wbits, mem_level, takeover, options['min_size'])
+            saved = total - sent
+            self.stdout.write(
+                f'{name:<22} {sent / 1024:>8.1f} {saved / total:>7.1%} {cpu * 1000:>8.2f} '
+                f'{cpu * 1e6 / max(saved / 1024, 1e-9):>12.1f} {context_bytes(wbits, mem_level) / 1024:>7.0f}'
+            )
+
+    def session(self, options):
+        '''
+        What one app session receives: friend.list, a scroll through a few
+        conversations (some voice messages with waveforms) and a stream of
+        incoming message.send events.
+        '''
+        users = seed_chat(users=options['friends'] * 2 + 1, friends=options['friends'], messages=30)
+        user = users[0]
+        conversations = list(Connection.objects.filter(sender=user))
+        for message in Message.objects.filter(connection__in=conversations).order_by('?')[:options['pages']]:
+            message.waveform = [round(random.random(), 2) for _ in range(300)]
+            message.save()
+
+        recorder = FrameRecorder(user)
+        recorder.receive_friend_list({})
+        for n in range(options['pages']):
+            recorder.receive_message_list({
+                'connectionId': conversations[n % len(conversations)].id, 'cursor': None
+            })
+        for n in range(options['sends']):
+            conn = conversations[n % len(conversations)]
+            message = Message.objects.create(connection=conn, user=conn.receiver, text=f'hey {n}, are you around?')
+            recorder.frames += [
+                {'source': 'message.send', 'data': data}
+                for username, data in message_send_events(conn, conn.receiver, message)
+                if username == user.username
+            ]
+        return [dumps(frame).encode() for frame in recorder.frames]
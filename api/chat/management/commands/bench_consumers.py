@@ -0,0 +1,101 @@
+# api/chat/management/commands/bench_consumers.py
+import asyncio
+import json
+
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+
+from chat.bench import bench_database, seed_chat, ScopeUser, percentile, Stopwatch
+from chat.consumers import ChatConsumers, AsyncChatConsumers
+
+MODES = {
+    'sync': ChatConsumers,
+    'async': AsyncChatConsumers,
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent-socket capacity of the sync and async consumers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, nargs='+', default=[50, 200, 500])
+        parser.add_argument('--frames', type=int, default=5, help='requests per socket')
+        parser.add_argument(
+            '--source', choices=['friend.list', 'message.type'], default='friend.list',
+            help='friend.list is DB bound, message.type never touches the DB'
+        )
+        parser.add_argument('--users', type=int, default=500, help='one group per user; keep >= sockets')
+        parser.add_argument('--mode', choices=list(MODES), nargs='+', default=list(MODES))
+        parser.add_argument('--timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        with bench_database():
+            users = seed_chat(users=options['users'], friends=5, messages=5)
+            self.stdout.write(
+                f"{'mode':<6} {'sockets':>7} {'connect s':>10} {'frames/s':>10} "
+                f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}"
+            )
+            for sockets in options['sockets']:
+                for mode in options['mode']:
+                    result = asyncio.run(self.run_mode(
+                        MODES[mode], users, sockets, options['frames'],
+                        options['source'], options['timeout']
+                    ))
+                    self.stdout.write(
+                        f"{mode:<6} {sockets:>7} {result['connect']:>10.2f} "
+                        f"{result['throughput']:>10.1f} {result['p50'] * 1000:>8.1f} "
+                        f"{result['p95'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f} "
+                        f"{result['errors']:>6}"
+                    )
+
+    async def run_mode(self, consumer_class, users, sockets, frames, source, timeout):
+        app = consumer_class.as_asgi()
+        communicators = [
+            WebsocketCommunicator(ScopeUser(app, users[i % len(users)]), '/chat/')
+            for i in range(sockets)
+        ]
+        with Stopwatch() as connect:
+            results = await asyncio.gather(
+                *(c.connect(timeout=timeout) for c in communicators),
+                return_exceptions=True,
+            )
+        connected = [
+            (c, users[i % len(users)])
+            for i, (c, r) in enumerate(zip(communicators, results))
+            if not isinstance(r, BaseException) and r[0]
+        ]
+        errors = sockets - len(connected)
+
+        latencies = []
+
+        async def client(communicator, user):
+            # Typing events are addressed to the sender itself, alternating
+            # with typing.stop so the throttle forwards every frame.
+            if source == 'message.type':
+                cycle = ['message.type', 'typing.stop']
+            else:
+                cycle = [source]
+            for n in range(frames):
+                frame = json.dumps({'source': cycle[n % len(cycle)], 'username': user.username})
+                with Stopwatch() as rtt:
+                    await communicator.send_to(text_data=frame)
+                    await communicator.receive_from(timeout=timeout)
+                latencies.append(rtt.elapsed)
+
+        with Stopwatch() as run:
+            outcomes = await asyncio.gather(
+                *(client(c, u) for c, u in connected), return_exceptions=True
+            )
+        errors += sum(1 for o in outcomes if isinstance(o, BaseException))
+
+        for communicator, _ in connected:
+            await communicator.disconnect()
+
+        return {
+            'connect': connect.elapsed,
+            'throughput': len(latencies) / run.elapsed if run.elapsed else 0.0,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'errors': errors,
+        }
@@ -0,0 +1,247 @@
+# api/chat/management/commands/bench_db.py
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.apps import apps
+from django.db import OperationalError, connection, connections, transaction
+from django.db.migrations.state import ProjectState
+from django.db.models import Exists, OuterRef, Q
+
+from chat.bench import bench_database, seed_chat, percentile, timeit
+from chat.models import User, Connection, Message
+
+CONFIGS = {
+    # SQLite defaults (rollback journal, synchronous=FULL, deferred BEGIN)
+    # without the connection lookup indexes of 0014
+    'before': {
+        'journal_mode': 'DELETE',
+        'options': {},
+        'lookup_indexes': False,
+    },
+    'after': {
+        'journal_mode': 'WAL',
+        'options': settings.DATABASES['default'].get('OPTIONS', {}),
+        'lookup_indexes': True,
+    },
+}
+
+# What 0014_connection_lookup_indexes added. Only these are dropped for
+# 'before': migrating back to 0013 would also undo every later migration,
+# leaving the current models without their columns.
+LOOKUP_INDEXES = ['conn_receiver_pending_idx']
+LOOKUP_CONSTRAINTS = ['unique_connection']
+
+
+def connection_model(lookup_indexes):
+    '''
+    Connection as the schema editor sees it, with or without the 0014
+    index and constraint. On SQLite, removing a unique constraint rebuilds
+    the table from the model, so the model passed in must not have it.
+    '''
+    state = ProjectState.from_apps(apps)
+    options = state.models['chat', 'connection'].options
+    if not lookup_indexes:
+        options['indexes'] = [i for i in options['indexes'] if i.name not in LOOKUP_INDEXES]
+        options['constraints'] = [c for c in options['constraints'] if c.name not in LOOKUP_CONSTRAINTS]
+    return state.apps.get_model('chat', 'Connection')
+
+
+def lookup_names():
+    with connection.cursor() as cursor:
+        present = connection.introspection.get_constraints(cursor, Connection._meta.db_table)
+    return set(present) & set(LOOKUP_INDEXES + LOOKUP_CONSTRAINTS)
+
+
+def set_lookup_indexes(enabled):
+    if lookup_names() == (set(LOOKUP_INDEXES + LOOKUP_CONSTRAINTS) if enabled else set()):
+        return
+    model = connection_model(enabled)
+    with connection.schema_editor() as editor:
+        # Constraints first: adding one rebuilds the table with every index
+        # the model has, dropping one rebuilds it without the indexes above
+        for constraint in Connection._meta.constraints:
+            if constraint.name in LOOKUP_CONSTRAINTS:
+                if enabled:
+                    editor.add_constraint(model, constraint)
+                else:
+                    editor.remove_constraint(model, constraint)
+    present = lookup_names()
+    with connection.schema_editor() as editor:
+        for index in Connection._meta.indexes:
+            if index.name in LOOKUP_INDEXES:
+                if enabled and index.name not in present:
+                    editor.add_index(model, index)
+                elif not enabled and index.name in present:
+                    editor.remove_index(model, index)
+
+
+def is_lock_error(error):
+    # 'database is locked' / 'database table is locked'; anything else is a
+    # real failure, not contention
+    return 'locked' in str(error)
+
+
+def sql_time(queryset, repeat):
+    # The query alone: ORM model building would hide the index difference
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        return timeit(lambda: cursor.execute(sql, params).fetchall(), repeat) * 1e6
+
+
+class Command(BaseCommand):
+    help = 'Connection lookups and concurrent writers on a file SQLite DB, before/after indexes and pragmas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--friends', type=int, default=10)
+        parser.add_argument('--messages', type=int, default=5, help='seeded messages per connection')
+        parser.add_argument('--repeat', type=int, default=2000)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--sends', type=int, default=100, help='messages per writer thread')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write('bench_db measures SQLite settings; DATABASES is not SQLite')
+            return
+        path = os.path.join(tempfile.mkdtemp(), 'bench_db.sqlite3')
+        with bench_database(name=path):
+            users = seed_chat(users=options['users'], friends=options['friends'], messages=options['messages'])
+            # Pending requests for request.list, clear of the seeded friendships
+            Connection.objects.bulk_create([
+                Connection(sender=users[i], receiver=users[(i + options['friends'] + 1) % len(users)])
+                for i in range(len(users))
+            ])
+            # A popular user: friends with everyone, plus a few new requests
+            hub = User.objects.create(username='hub', first_name='hub', last_name='user')
+            Connection.objects.bulk_create([
+                Connection(sender=other, receiver=hub, accepted=n >= 5)
+                for n, other in enumerate(users)
+            ])
+            size = os.path.getsize(path) / 1e6
+            self.stdout.write(
+                f"{len(users)} users, {Connection.objects.count()} connections, "
+                f"{Message.objects.count()} messages ({size:.0f} MB)\n"
+            )
+
+            results = {}
+            for name, config in CONFIGS.items():
+                self.configure(config)
+                results[name] = self.measure(users, hub, options)
+            self.configure(CONFIGS['after'])
+
+        self.stdout.write(f"{'':<34} {'before':>10} {'after':>10}")
+        for key in results['before']:
+            before, after = results['before'][key], results['after'][key]
+            self.stdout.write(f'{key:<34} {before:>10.1f} {after:>10.1f}')
+
+    def configure(self, config):
+        set_lookup_indexes(config['lookup_indexes'])
+        connections.close_all()
+        connection.settings_dict['OPTIONS'] = dict(config['options'])
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA journal_mode={config['journal_mode']}")
+            cursor.execute('ANALYZE')
+        connections.close_all()
+
+    def measure(self, users, hub, options):
+        repeat = options['repeat']
+        user, other = users[len(users) // 2], users[len(users) // 2 + 1]
+        friend_ids = [u.id for u in users[:20]]
+        lookups = {
+            'request.list': Connection.objects.filter(receiver=user, accepted=False),
+            'request.list (popular user)': Connection.objects.filter(receiver=hub, accepted=False),
+            'request.accept (popular user)': Connection.objects.filter(
+                sender__username=other.username, receiver=hub
+            ),
+            'request.connect lookup': Connection.objects.filter(sender=hub, receiver=other),
+            'search status (20 users)': User.objects.filter(id__in=friend_ids).annotate(
+                pending_them=Exists(Connection.objects.filter(
+                    sender=hub, receiver=OuterRef('id'), accepted=False)),
+                connected=Exists(Connection.objects.filter(
+                    Q(sender=hub, receiver=OuterRef('id')) |
+                    Q(receiver=hub, sender=OuterRef('id')), accepted=True)),
+            ),
+        }
+        results = {f'{name} us': sql_time(qs, repeat) for name, qs in lookups.items()}
+        results.update(self.concurrent(users, options))
+        return results
+
+    def concurrent(self, users, options):
+        '''
+        Writer threads run message.send's transaction while reader threads
+        page through message.list, like a busy Daphne worker pool.
+        '''
+        conns = list(Connection.objects.filter(accepted=True).order_by('id')[:options['writers'] * 4])
+        write_times, reads, errors, failures = [], [0], [0], []
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def writer(index):
+            try:
+                for n in range(options['sends']):
+                    conn = conns[(index * 4 + n) % len(conns)]
+                    start = time.perf_counter()
+                    try:
+                        with transaction.atomic():
+                            message = Message.objects.create(
+                                connection=conn, user_id=conn.sender_id, text=f'bench {n}', delivered=True
+                            )
+                            conn.set_last_message(message)
+                    except OperationalError as e:
+                        if not is_lock_error(e):
+                            raise
+                        with lock:
+                            errors[0] += 1
+                        continue
+                    with lock:
+                        write_times.append(time.perf_counter() - start)
+            except Exception as e:
+                failures.append(e)
+            finally:
+                connection.close()
+
+        def reader(index):
+            try:
+                while not done.is_set():
+                    conn = conns[index % len(conns)]
+                    try:
+                        list(Message.objects.filter(connection=conn).order_by('-created', '-id')[:16])
+                    except OperationalError as e:
+                        if not is_lock_error(e):
+                            raise
+                        with lock:
+                            errors[0] += 1
+                        continue
+                    with lock:
+                        reads[0] += 1
+            except Exception as e:
+                failures.append(e)
+                done.set()
+            finally:
+                connection.close()
+
+        writers = [threading.Thread(target=writer, args=(i,)) for i in range(options['writers'])]
+        readers = [threading.Thread(target=reader, args=(i,)) for i in range(options['readers'])]
+        start = time.perf_counter()
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        for thread in readers:
+            thread.join()
+        if failures:
+            raise failures[0]
+
+        return {
+            'message.send writes/s': len(write_times) / elapsed,
+            'message.send p95 ms': percentile(write_times, 95) * 1000,
+            'message.list reads/s (concurrent)': reads[0] / elapsed,
+            'locked errors': errors[0],
+        }
@@ -0,0 +1,106 @@
+# api/chat/management/commands/bench_fanout.py
+from django.core.management.base import BaseCommand
+
+from chat.bench import bench_database, seed_chat, timeit
+from chat.events import message_batch_events, message_send_events, request_accept_events
+from chat.fast_serializers import dumps, friend_data, message_data, request_data, user_data
+from chat.models import Connection, Message
+
+
+def per_recipient_send(connection, author, message):
+    # What receive_message_send did before events.py
+    recipient = connection.receiver if connection.sender_id == author.id else connection.sender
+    return [
+        (author.username, {
+            'message': message_data(message, author),
+            'friend': user_data(recipient),
+            'connection_id': connection.id,
+        }),
+        (recipient.username, {
+            'message': message_data(message, recipient),
+            'friend': user_data(author),
+            'connection_id': connection.id,
+        }),
+    ]
+
+
+def per_recipient_batch(connection, author, messages):
+    return [
+        (participant.username, {
+            'messages': [message_data(m, participant) for m in messages],
+            'friend': user_data(friend),
+            'connection_id': connection.id,
+        })
+        for participant, friend in (
+            (connection.sender, connection.receiver),
+            (connection.receiver, connection.sender),
+        )
+    ]
+
+
+def per_recipient_accept(connection):
+    request = request_data(connection)
+    return [
+        ('request.accept', connection.sender.username, request),
+        ('request.accept', connection.receiver.username, request),
+        ('friend.new', connection.sender.username, friend_data(connection, connection.sender)),
+        ('friend.new', connection.receiver.username, friend_data(connection, connection.receiver)),
+    ]
+
+
+def deliver(events, source, devices):
+    # Every device subscribed to a participant's group encodes its own frame
+    for *_, data in events:
+        for _ in range(devices):
+            dumps({'source': source, 'data': data})
+
+
+class Command(BaseCommand):
+    help = 'CPU per event: per-recipient serialization vs serialize-once overlays (events.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=2000)
+        parser.add_argument('--batch', type=int, default=25, help='messages per forward')
+        parser.add_argument('--devices', type=int, default=3, help='sockets per user for multi-device')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        devices = options['devices']
+        with bench_database():
+            users = seed_chat(users=3, friends=1, messages=options['batch'])
+            author = users[0]
+            connection = Connection.objects.select_related('sender', 'receiver').filter(
+                sender=author
+            ).first()
+            messages = list(Message.objects.filter(connection=connection).order_by('id'))
+            message = messages[-1]
+
+            cases = [
+                (
+                    'message.send',
+                    lambda: per_recipient_send(connection, author, message),
+                    lambda: message_send_events(connection, author, message),
+                ),
+                (
+                    f'message.send_batch ({len(messages)})',
+                    lambda: per_recipient_batch(connection, author, messages),
+                    lambda: message_batch_events(connection, author, messages),
+                ),
+                (
+                    'request.accept + friend.new',
+                    lambda: per_recipient_accept(connection),
+                    lambda: request_accept_events(connection),
+                ),
+            ]
+
+            self.stdout.write(
+                f"{'event':<30} {'fanout':<16} {'before us':>10} {'after us':>10} {'saved us':>9}"
+            )
+            for name, before, after in cases:
+                for label, count in (('1:1', 1), (f'{devices} devices/user', devices)):
+                    old = timeit(lambda: deliver(before(), name, count), repeat)
+                    new = timeit(lambda: deliver(after(), name, count), repeat)
+                    self.stdout.write(
+                        f'{name:<30} {label:<16} {old * 1e6:>10.1f} {new * 1e6:>10.1f} '
+                        f'{(old - new) * 1e6:>9.1f}'
+                    )
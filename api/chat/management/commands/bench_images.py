@@ -0,0 +1,68 @@
+# api/chat/management/commands/bench_images.py
+import io
+import os
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from chat.bench import Stopwatch
+from chat.images import process_image
+
+
+def camera_photo(width, height, quality):
+    '''Phone-camera-like JPEG: gradients, fine detail and sensor noise, with EXIF.'''
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    scene = Image.radial_gradient('L').resize((width, height)).convert('RGB')
+    detail = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 1.0, 1.2), 100).convert('RGB')
+    image = Image.blend(Image.blend(scene, detail, 0.5), noise, 0.15)
+    exif = Image.Exif()
+    exif[0x010f] = 'PhoneMaker'
+    exif[0x0112] = 6
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, exif=exif)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Image job (images.py): variant sizes vs the upload and processing time per photo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=4032)
+        parser.add_argument('--height', type=int, default=3024)
+        parser.add_argument('--quality', type=int, default=92, help='JPEG quality of the upload')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--bubbles', type=int, default=20, help='image bubbles on one chat screen')
+
+    def handle(self, *args, **options):
+        workdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(workdir, 'photo.jpg')
+            with open(path, 'wb') as fh:
+                fh.write(camera_photo(options['width'], options['height'], options['quality']))
+            upload = os.path.getsize(path)
+
+            with Stopwatch() as watch:
+                for _ in range(options['repeat']):
+                    result = process_image(path)
+        finally:
+            shutil.rmtree(workdir)
+
+        self.stdout.write(
+            f"{options['width']}x{options['height']} JPEG upload, {upload / 1024:.0f} KB: "
+            f"{watch.elapsed / options['repeat'] * 1000:.0f} ms per job\n"
+        )
+        self.stdout.write(f"{'variant':<12} {'size':>11} {'KB':>8} {'vs upload':>10}")
+        for key, (name, data) in sorted(result['variants'].items(), key=lambda item: len(item[1][1])):
+            with Image.open(io.BytesIO(data)) as variant:
+                size = f'{variant.width}x{variant.height}'
+            self.stdout.write(f'{key:<12} {size:>11} {len(data) / 1024:>8.1f} {len(data) / upload:>10.1%}')
+        self.stdout.write(f"{'placeholder':<12} {'':>11} {len(result['placeholder']) / 1024:>8.2f}")
+
+        bubble = result['variants'].get('720', result['variants']['full'])[1]
+        self.stdout.write(
+            f"\nchat screen with {options['bubbles']} photos: "
+            f"{options['bubbles'] * upload / 1024 / 1024:.1f} MB of uploads vs "
+            f"{options['bubbles'] * len(bubble) / 1024 / 1024:.2f} MB of 720 variants"
+        )
@@ -0,0 +1,71 @@
+# api/chat/management/commands/bench_serializers.py
+import json
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from chat.bench import bench_database, seed_chat, timeit
+from chat.fast_serializers import dumps, orjson, friend_data, message_data, user_data
+from chat.models import Connection, Message
+from chat.serializers import FriendSerializer, MessageSerializer, UserSerializer
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark DRF serializers against chat.fast_serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=500)
+        parser.add_argument('--friends', type=int, default=50)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        with bench_database():
+            users = seed_chat(users=options['friends'] * 2 + 1, friends=options['friends'], messages=15)
+            user = users[0]
+            connection = Connection.objects.filter(sender=user).first()
+            # Materialize once so only serialization is measured
+            page = list(Message.objects.filter(connection=connection).order_by('-created', '-id')[:15])
+            friends = list(Connection.objects.filter(
+                Q(sender=user) | Q(receiver=user), accepted=True
+            ).select_related('sender', 'receiver'))
+            recipient = connection.receiver
+
+            cases = [
+                (
+                    f'message.list page ({len(page)} messages)',
+                    lambda: {
+                        'messages': MessageSerializer(page, context={'user': user}, many=True).data,
+                        'friend': UserSerializer(recipient).data,
+                    },
+                    lambda: {
+                        'messages': [message_data(m, user) for m in page],
+                        'friend': user_data(recipient),
+                    },
+                ),
+                (
+                    f'friend.list ({len(friends)} friends)',
+                    lambda: FriendSerializer(friends, context={'user': user}, many=True).data,
+                    lambda: [friend_data(c, user) for c in friends],
+                ),
+                (
+                    'message.send (1 message)',
+                    lambda: MessageSerializer(page[0], context={'user': user}).data,
+                    lambda: message_data(page[0], user),
+                ),
+            ]
+
+            self.stdout.write(f"{'payload':<34} {'DRF us':>10} {'fast us':>10} {'speedup':>8}")
+            for name, drf, fast in cases:
+                slow_time = timeit(drf, repeat)
+                fast_time = timeit(fast, repeat)
+                self.stdout.write(
+                    f'{name:<34} {slow_time * 1e6:>10.1f} {fast_time * 1e6:>10.1f} '
+                    f'{slow_time / fast_time:>7.1f}x'
+                )
+
+            payload = {'source': 'message.list', 'data': cases[0][2]()}
+            encoder = 'orjson' if orjson else 'json (orjson not installed)'
+            self.stdout.write(
+                f"\nencode message.list: json {timeit(lambda: json.dumps(payload), repeat) * 1e6:.1f}us, "
+                f"{encoder} {timeit(lambda: dumps(payload), repeat) * 1e6:.1f}us"
+            )
@@ -0,0 +1,64 @@
+# api/chat/management/commands/bench_sync.py
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from chat.bench import FrameRecorder, bench_database, seed_chat, timeit
+from chat.fast_serializers import dumps
+from chat.models import Connection, Message
+from chat.sync import sync_frames
+
+
+def frame_bytes(recorder):
+    return sum(len(dumps(frame)) for frame in recorder.frames)
+
+
+class Command(BaseCommand):
+    help = 'Reconnect cost: full friend/request/message reload vs sync.since, by history size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history', type=int, nargs='+', default=[20, 200, 1000],
+                            help='messages per conversation')
+        parser.add_argument('--friends', type=int, default=20)
+        parser.add_argument('--open-chats', type=int, default=3,
+                            help='conversations whose first page the app reloads')
+        parser.add_argument('--changes', type=int, default=10, help='messages sent while offline')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'history':>8} {'full ms':>9} {'full KB':>9} {'sync ms':>9} {'sync KB':>9}"
+        )
+        with bench_database(), override_settings(CHAT_SYNC={'OVERLAP': 0}):
+            for history in options['history']:
+                self.stdout.write(self.measure(history, options))
+
+    def measure(self, history, options):
+        users = seed_chat(
+            users=options['friends'] * 2 + 1, friends=options['friends'], messages=history,
+            prefix=f'h{history}_'
+        )
+        user = users[0]
+        conversations = list(Connection.objects.filter(sender=user).select_related('sender', 'receiver'))
+        cursor = sync_frames(user, None)[0]['cursor']
+        for n in range(options['changes']):
+            conn = conversations[n % len(conversations)]
+            Message.objects.create(connection=conn, user=conn.receiver, text=f'offline {n}')
+
+        def full():
+            recorder = FrameRecorder(user)
+            recorder.receive_request_list({})
+            recorder.receive_friend_list({})
+            for conn in conversations[:options['open_chats']]:
+                recorder.receive_message_list({'connectionId': conn.id, 'cursor': None})
+            return recorder
+
+        def sync():
+            recorder = FrameRecorder(user)
+            recorder.receive_sync_since({'cursor': cursor})
+            return recorder
+
+        repeat = options['repeat']
+        return (
+            f'{history:>8} {timeit(full, repeat) * 1000:>9.2f} {frame_bytes(full()) / 1024:>9.1f} '
+            f'{timeit(sync, repeat) * 1000:>9.2f} {frame_bytes(sync()) / 1024:>9.1f}'
+        )
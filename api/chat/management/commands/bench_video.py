@@ -0,0 +1,82 @@
+# api/chat/management/commands/bench_video.py
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.bench import percentile
+from chat.utils import find_binary
+from chat.video import process_video
+
+# (name, lavfi source, seconds)
+CLIPS = [
+    ('720p, 10 s', 'testsrc2=size=1280x720:rate=30', 10),
+    ('1080p, 30 s', 'testsrc2=size=1920x1080:rate=30', 30),
+    ('1080p, 0.3 s', 'testsrc2=size=1920x1080:rate=30', 0.3),
+]
+
+
+def two_runs(path, workdir):
+    '''What the job did before: ffprobe, then ffmpeg to a temp file, read back.'''
+    duration = subprocess.run(
+        [find_binary('ffprobe'), '-v', 'error', '-show_entries', 'format=duration',
+         '-of', 'default=noprint_wrappers=1:nokey=1', path],
+        capture_output=True, text=True, check=True
+    ).stdout.strip()
+    thumb_path = os.path.join(workdir, 'thumb.jpg')
+    subprocess.run(
+        [find_binary('ffmpeg'), '-y', '-ss', '00:00:00.500', '-i', path,
+         '-frames:v', '1', '-q:v', '3', thumb_path],
+        capture_output=True, check=True
+    )
+    with open(thumb_path, 'rb') as fh:
+        poster = fh.read()
+    os.remove(thumb_path)
+    return float(duration), poster
+
+
+class Command(BaseCommand):
+    help = 'Per-video job latency: one ffmpeg run (video.py) vs separate ffprobe + ffmpeg via a temp file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        try:
+            ffmpeg, _ = find_binary('ffmpeg'), find_binary('ffprobe')
+        except RuntimeError as e:
+            self.stderr.write(f'{e}; nothing to measure')
+            return
+
+        workdir = tempfile.mkdtemp()
+        try:
+            self.stdout.write(f"{'clip':<14} {'one run p50':>12} {'two runs p50':>13} {'saved':>7}")
+            for name, source, seconds in CLIPS:
+                path = os.path.join(workdir, 'clip.mp4')
+                subprocess.run([
+                    ffmpeg, '-v', 'error', '-y', '-f', 'lavfi', '-i', source, '-t', str(seconds),
+                    '-c:v', 'libx264', '-pix_fmt', 'yuv420p', path
+                ], check=True)
+                one = self.sample(lambda: process_video(path), options['repeat'])
+                try:
+                    two = self.sample(lambda: two_runs(path, workdir), options['repeat'])
+                except (subprocess.CalledProcessError, FileNotFoundError):
+                    two = None  # clips shorter than the seek point had no thumbnail
+                self.stdout.write(
+                    f'{name:<14} {one * 1000:>10.1f}ms ' + (
+                        f'{two * 1000:>11.1f}ms {1 - one / two:>7.0%}' if two else f"{'failed':>13}"
+                    )
+                )
+        finally:
+            shutil.rmtree(workdir)
+
+    def sample(self, func, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+        return percentile(samples, 50)
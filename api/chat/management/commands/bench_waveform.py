@@ -0,0 +1,73 @@
+# api/chat/management/commands/bench_waveform.py
+import os
+import shutil
+import tempfile
+import wave
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.bench import timeit
+from chat.waveform import compute_waveform, get_waveform_settings
+
+
+def per_sample(path):
+    '''audiowaveform's loop, one sample at a time, for comparison.'''
+    config = get_waveform_settings()
+    samples_per_pixel = config['SAMPLE_RATE'] // config['PIXELS_PER_SECOND']
+    with wave.open(str(path), 'rb') as reader:
+        samples = np.frombuffer(reader.readframes(reader.getnframes()), dtype='<i2').tolist()
+    values, low, high, count = [], 32767, -32768, 0
+    for sample in samples:
+        low, high, count = min(low, sample), max(high, sample), count + 1
+        if count == samples_per_pixel:
+            values += [int(low / 256), int(high / 256)]
+            low, high, count = 32767, -32768, 0
+    if count:
+        values += [int(low / 256), int(high / 256)]
+    return [round(value / 255, 2) for value in values]
+
+
+def voice_note(path, seconds, rate):
+    '''Speech-like test signal: a tone with a syllable-rate envelope.'''
+    t = np.arange(int(seconds * rate)) / rate
+    signal = np.sin(2 * np.pi * 180 * t) * np.abs(np.sin(2 * np.pi * 3 * t)) * 20000
+    with wave.open(path, 'wb') as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(rate)
+        writer.writeframes(signal.astype('<i2').tobytes())
+
+
+class Command(BaseCommand):
+    help = 'Voice waveforms (waveform.py): NumPy buckets vs a per-sample loop, and the ffmpeg pipe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=int, nargs='+', default=[5, 60])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rate = get_waveform_settings()['SAMPLE_RATE']
+        sample = settings.BASE_DIR / 'media' / 'messages' / '6' / '108.m4a'
+        ffmpeg = shutil.which('ffmpeg') or settings.MEDIA_BINARIES.get('ffmpeg')
+        workdir = tempfile.mkdtemp()
+        try:
+            self.stdout.write(f"{'input':<16} {'numpy ms':>9} {'loop ms':>9} {'speedup':>8} {'same':>5}")
+            for seconds in options['seconds']:
+                path = os.path.join(workdir, f'{seconds}s.wav')
+                voice_note(path, seconds, rate)
+                fast = timeit(lambda: compute_waveform(path), options['repeat'])
+                slow = timeit(lambda: per_sample(path), 1)
+                same = compute_waveform(path) == per_sample(path)
+                self.stdout.write(
+                    f'{seconds:>5} s wav      {fast * 1000:>9.2f} {slow * 1000:>9.1f} {slow / fast:>7.0f}x {str(same):>5}'
+                )
+        finally:
+            shutil.rmtree(workdir)
+
+        if ffmpeg and sample.exists():
+            decoded = timeit(lambda: compute_waveform(sample), options['repeat'])
+            self.stdout.write(f'\n{sample.name} through the ffmpeg pipe: {decoded * 1000:.1f} ms')
+        else:
+            self.stdout.write('\nffmpeg not found: compressed input (the ffmpeg pipe) not measured')
@@ -0,0 +1,65 @@
+# api/chat/management/commands/bench_wire.py
+import json
+import random
+
+import msgpack
+from django.core.management.base import BaseCommand
+
+from chat.bench import FrameRecorder, bench_database, seed_chat, timeit
+from chat.models import Connection, Message
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def formats():
+    found = [
+        ('json', lambda frame: json.dumps(frame).encode(), json.loads),
+        ('msgpack', msgpack.packb, msgpack.unpackb),
+    ]
+    if orjson is not None:
+        found.insert(1, ('orjson', orjson.dumps, orjson.loads))
+    return found
+
+
+class Command(BaseCommand):
+    help = 'Frame size and encode/decode time: JSON vs MessagePack (wire.py) for typical responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--friends', type=int, default=50)
+        parser.add_argument('--page-size', type=int, default=15)
+        parser.add_argument('--voice', type=int, default=3, help='voice messages with a waveform on the page')
+        parser.add_argument('--repeat', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with bench_database():
+            users = seed_chat(users=options['friends'] * 2 + 1, friends=options['friends'], messages=20)
+            user = users[0]
+            connection = Connection.objects.filter(sender=user).first()
+            # audiowaveform output: a few hundred values rounded to 2 places
+            for message in Message.objects.filter(connection=connection).order_by('-id')[:options['voice']]:
+                message.waveform = [round(random.random(), 2) for _ in range(300)]
+                message.save()
+
+            recorder = FrameRecorder(user)
+            recorder.receive_message_list({
+                'connectionId': connection.id, 'cursor': None, 'pageSize': options['page_size']
+            })
+            recorder.receive_friend_list({})
+            frames = {
+                f"message.list ({options['page_size']}, {options['voice']} voice)": recorder.frames[0],
+                f"friend.list ({len(recorder.frames[1]['data'])})": recorder.frames[1],
+            }
+
+        repeat = options['repeat']
+        self.stdout.write(f"{'frame':<30} {'format':<8} {'bytes':>8} {'encode us':>10} {'decode us':>10}")
+        for name, frame in frames.items():
+            for fmt, encode, decode in formats():
+                encoded = encode(frame)
+                self.stdout.write(
+                    f'{name:<30} {fmt:<8} {len(encoded):>8} '
+                    f'{timeit(lambda: encode(frame), repeat) * 1e6:>10.1f} '
+                    f'{timeit(lambda: decode(encoded), repeat) * 1e6:>10.1f}'
+                )
@@ -0,0 +1,277 @@
+# api/chat/management/commands/loadtest.py
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict, deque
+
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.bench import bench_database, seed_chat, percentile, Stopwatch
+from chat.models import Connection
+from chat.timing import handler_stats
+
+SCENARIOS = ['send', 'scroll', 'typing', 'search']
+
+# Sent with every handshake so AllowedHostsOriginValidator lets it through
+HEADERS = [(b'origin', b'http://localhost'), (b'host', b'localhost')]
+
+
+def redis_layers(address):
+    host, _, port = address.partition(':')
+    return {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [(host, int(port or 6379))]},
+        },
+    }
+
+
+def redis_presence(address):
+    host, _, port = address.partition(':')
+    return {'BACKEND': 'redis', 'REDIS_URL': f'redis://{host}:{port or 6379}/0', 'KEY': 'chat:presence:loadtest'}
+
+
+def redis_caches(address):
+    host, _, port = address.partition(':')
+    return {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': f'redis://{host}:{port or 6379}/1',
+            'KEY_PREFIX': 'loadtest',
+        },
+    }
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, source, seconds):
+        self.latencies[source].append(seconds)
+
+    def error(self, source):
+        self.errors[source] += 1
+
+
+class Client:
+    '''
+    One simulated app: an authenticated socket plus a reader task that hands
+    incoming frames to whoever is waiting for that source. Frames nobody
+    waits for (friends' messages and the like) are dropped; typing events are
+    timed on arrival.
+    '''
+
+    def __init__(self, application, user, token, friends, results, timeout):
+        self.user = user
+        self.friends = friends  # [(connection_id, username)]
+        self.results = results
+        self.timeout = timeout
+        self.communicator = WebsocketCommunicator(
+            application, f'/chat/?token={token}', headers=HEADERS
+        )
+        self.waiters = defaultdict(deque)
+        self.reader = None
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=self.timeout)
+        if not connected:
+            raise ConnectionError(f'{self.user.username} was refused')
+        self.reader = asyncio.create_task(self.read())
+
+    async def close(self):
+        if self.reader:
+            self.reader.cancel()
+        await self.communicator.disconnect()
+
+    async def read(self):
+        while True:
+            frame = json.loads(await self.communicator.receive_from(timeout=None))
+            source, data = frame['source'], frame['data']
+            if source == 'message.type' and data.get('sent'):
+                # Server stamps forwarded typing events, so delivery time is
+                # measured on the receiving side
+                self.results.record('message.type (delivery)', time.time() - data['sent'])
+            for waiter in self.waiters[source]:
+                accept, future = waiter
+                if not future.done() and accept(data):
+                    future.set_result(data)
+                    self.waiters[source].remove(waiter)
+                    break
+
+    async def request(self, source, frame, accept=lambda data: True, reply=None):
+        '''Send `frame`, wait for the matching `reply` (default: same source).'''
+        reply = reply or source
+        future = asyncio.get_running_loop().create_future()
+        waiter = (accept, future)
+        self.waiters[reply].append(waiter)
+        start = time.perf_counter()
+        try:
+            await self.communicator.send_to(text_data=json.dumps({'source': source, **frame}))
+            data = await asyncio.wait_for(future, self.timeout)
+        except Exception:
+            self.results.error(source)
+            if waiter in self.waiters[reply]:
+                self.waiters[reply].remove(waiter)
+            return None
+        self.results.record(source, time.perf_counter() - start)
+        return data
+
+    #--------------------------
+    #     Scenarios
+    #--------------------------
+    async def friend_list(self):
+        await self.request('friend.list', {})
+
+    async def send(self, burst):
+        connection_id, _ = random.choice(self.friends)
+        await asyncio.gather(*(
+            self.request(
+                'message.send',
+                {'connectionId': connection_id, 'message': f'load {n}'},
+                # Our own copy, not a friend's message arriving meanwhile
+                accept=lambda data, n=n: data['message']['is_me'] and data['message']['text'] == f'load {n}',
+            )
+            for n in range(burst)
+        ))
+
+    async def scroll(self, pages):
+        connection_id, _ = random.choice(self.friends)
+        cursor = None
+        for _ in range(pages):
+            data = await self.request(
+                'message.list', {'connectionId': connection_id, 'cursor': cursor},
+                accept=lambda data: data['connection_id'] == connection_id,
+            )
+            if not data or not data['next']:
+                break
+            cursor = data['next']
+
+    async def typing(self, keystrokes, think):
+        _, username = random.choice(self.friends)
+        for _ in range(keystrokes):
+            try:
+                await self.communicator.send_to(text_data=json.dumps(
+                    {'source': 'message.type', 'username': username}
+                ))
+            except Exception:
+                self.results.error('message.type')
+            await asyncio.sleep(think / 4)
+        await self.communicator.send_to(text_data=json.dumps(
+            {'source': 'typing.stop', 'username': username}
+        ))
+
+    async def search(self, think):
+        # Search-as-you-type: one query per keystroke of a friend's name
+        _, username = random.choice(self.friends)
+        for length in range(1, len(username) + 1):
+            await self.request('search', {'query': username[:length]})
+            await asyncio.sleep(think / 4)
+
+
+class Command(BaseCommand):
+    help = 'Drive simulated authenticated clients against core.asgi.application'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--scenario', choices=SCENARIOS, nargs='+', default=SCENARIOS)
+        parser.add_argument('--rounds', type=int, default=3, help='times each client runs the scenarios')
+        parser.add_argument('--friends', type=int, default=5)
+        parser.add_argument('--messages', type=int, default=60, help='seeded messages per connection')
+        parser.add_argument('--burst', type=int, default=5, help='message.send per burst')
+        parser.add_argument('--pages', type=int, default=3, help='message.list pages per scroll-back')
+        parser.add_argument('--keystrokes', type=int, default=20, help='message.type per typing storm')
+        parser.add_argument('--think', type=float, default=0.05, help='seconds between client actions')
+        parser.add_argument('--ramp', type=int, default=200, help='concurrent handshakes')
+        parser.add_argument(
+            '--redis', metavar='HOST:PORT',
+            help='use this Redis server for the channel layer, presence and cache instead of in-memory ones'
+        )
+        parser.add_argument('--timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        layers, presence, caches = None, None, None
+        if options['redis']:
+            layers, presence = redis_layers(options['redis']), redis_presence(options['redis'])
+            caches = redis_caches(options['redis'])
+        with bench_database(channel_layers=layers, presence=presence, caches=caches):
+            users = seed_chat(
+                users=options['clients'], friends=options['friends'], messages=options['messages']
+            )
+            friends = defaultdict(list)
+            for connection in Connection.objects.filter(accepted=True).select_related('sender', 'receiver'):
+                friends[connection.sender_id].append((connection.id, connection.receiver.username))
+                friends[connection.receiver_id].append((connection.id, connection.sender.username))
+            tokens = {user.id: str(AccessToken.for_user(user)) for user in users}
+
+            # Imported late: building the ASGI app reads the overridden settings
+            from core.asgi import application
+
+            handler_stats.reset()
+            results = Results()
+            with Stopwatch() as run:
+                asyncio.run(self.run(application, users, friends, tokens, results, options))
+            self.report(results, run.elapsed, options)
+
+    async def run(self, application, users, friends, tokens, results, options):
+        clients = [
+            Client(application, user, tokens[user.id], friends[user.id], results, options['timeout'])
+            for user in users
+        ]
+        ramp = asyncio.Semaphore(options['ramp'])
+
+        async def simulate(client):
+            async with ramp:
+                with Stopwatch() as handshake:
+                    await client.connect()
+                results.record('connect', handshake.elapsed)
+            try:
+                # Every app load starts with the friend list
+                await client.friend_list()
+                for _ in range(options['rounds']):
+                    for scenario in options['scenario']:
+                        await asyncio.sleep(random.uniform(0, options['think'] * 2))
+                        if scenario == 'send':
+                            await client.send(options['burst'])
+                        elif scenario == 'scroll':
+                            await client.scroll(options['pages'])
+                        elif scenario == 'typing':
+                            await client.typing(options['keystrokes'], options['think'])
+                        elif scenario == 'search':
+                            await client.search(options['think'])
+            finally:
+                await client.close()
+
+        outcomes = await asyncio.gather(*(simulate(c) for c in clients), return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                # Refused handshake or a client that crashed mid-scenario
+                results.error('client')
+
+    def report(self, results, elapsed, options):
+        self.stdout.write(
+            f"{options['clients']} clients, scenarios {' '.join(options['scenario'])}, "
+            f"{options['rounds']} rounds, {elapsed:.1f}s\n"
+        )
+        self.stdout.write(
+            f"{'source':<26} {'count':>7} {'per s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'errors':>6}"
+        )
+        for source in sorted(set(results.latencies) | set(results.errors)):
+            samples = results.latencies[source]
+            self.stdout.write(
+                f'{source:<26} {len(samples):>7} {len(samples) / elapsed:>8.1f} '
+                f'{percentile(samples, 50) * 1000:>8.1f} {percentile(samples, 95) * 1000:>8.1f} '
+                f'{percentile(samples, 99) * 1000:>8.1f} {results.errors[source]:>6}'
+            )
+
+        # Server side of the same run (chat/timing.py)
+        self.stdout.write(f"\n{'server p95 ms':<26} {'db':>8} {'serialize':>10} {'send':>8}")
+        for source, phases in handler_stats.snapshot().items():
+            self.stdout.write(f'{source:<26} ' + ' '.join(
+                f"{phases[phase]['p95']:>{width}.2f}"
+                for phase, width in (('db', 8), ('serialize', 10), ('send', 8))
+            ))
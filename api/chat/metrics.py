@@ -0,0 +1,172 @@
+# api/chat/metrics.py
+'''
+Process-wide counters for the /chat/metrics/ Prometheus endpoint.
+
+Increments are the hot path (several per frame), so each thread counts
+into its own shard: a plain dict reached through a threading.local, with
+no lock. The lock is only taken when a thread registers its first shard
+and when a scrape copies the shards to add them up. Counters are
+per-process, so scrape every Daphne worker.
+
+Frame sizes are UTF-8 bytes as sent on the wire. Most frames are ASCII
+JSON (media is base64), and their character count is used as is; only
+text with non-ASCII characters is encoded to be measured.
+'''
+import bisect
+import math
+import threading
+from collections import defaultdict
+
+# name -> (type, help)
+METRICS = {
+    'chat_sockets_open': ('gauge', 'Open chat WebSocket connections'),
+    'chat_frames_received_total': ('counter', 'Frames received, by source'),
+    'chat_frame_bytes_received_total': ('counter', 'Frame payload bytes received'),
+    'chat_frame_bytes_sent_total': ('counter', 'Frame payload bytes sent'),
+    'chat_frame_bytes_compressed_total': ('counter', 'Bytes of frames sent compressed, before compression'),
+    'chat_frame_bytes_saved_total': ('counter', 'Bytes saved by frame compression'),
+    'chat_group_send_seconds': ('histogram', 'Channel layer group_send latency'),
+    'chat_db_queries_total': ('counter', 'Database queries run by frame handlers, by source'),
+}
+
+# group_send latency buckets (seconds)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+class ShardedCounters:
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.shards = []
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = defaultdict(float)
+            with self.lock:
+                self.shards.append(shard)
+            return shard
+
+    def inc(self, key, value=1):
+        self.shard()[key] += value
+
+    def totals(self):
+        with self.lock:
+            # dict.copy() is atomic under the GIL, unlike iterating a live dict
+            copies = [shard.copy() for shard in self.shards]
+        totals = defaultdict(float)
+        for shard in copies:
+            for key, value in shard.items():
+                totals[key] += value
+        return totals
+
+    def reset(self):
+        with self.lock:
+            for shard in self.shards:
+                shard.clear()
+
+
+counters = ShardedCounters()
+
+
+def inc(name, value=1, labels=()):
+    # labels: ((name, value), ...) in a fixed order
+    counters.inc((name, labels), value)
+
+
+def observe(name, seconds):
+    # Buckets are stored by index, not cumulative; render() adds them up
+    shard = counters.shard()
+    shard[(name, bisect.bisect_left(BUCKETS, seconds))] += 1
+    shard[(name + '_sum', ())] += seconds
+
+
+def frame_size(text_data=None, bytes_data=None):
+    if text_data is not None:
+        # Bytes on the wire (UTF-8), not characters
+        return len(text_data) if text_data.isascii() else len(text_data.encode())
+    return len(bytes_data) if bytes_data is not None else 0
+
+
+#--------------------------
+#     Hooks
+#--------------------------
+def socket_opened():
+    inc('chat_sockets_open')
+
+
+def socket_closed():
+    inc('chat_sockets_open', -1)
+
+
+def frame_received(text_data=None, bytes_data=None):
+    inc('chat_frame_bytes_received_total', frame_size(text_data, bytes_data))
+
+
+def frame_sent(text_data=None, bytes_data=None):
+    inc('chat_frame_bytes_sent_total', frame_size(text_data, bytes_data))
+
+
+def frame_compressed(before, after):
+    shard = counters.shard()
+    shard[('chat_frame_bytes_compressed_total', ())] += before
+    shard[('chat_frame_bytes_saved_total', ())] += before - after
+
+
+def handler_finished(source, queries):
+    labels = (('source', source),)
+    shard = counters.shard()
+    shard[('chat_frames_received_total', labels)] += 1
+    if queries:
+        shard[('chat_db_queries_total', labels)] += queries
+
+
+def group_sent(seconds):
+    observe('chat_group_send_seconds', seconds)
+
+
+#--------------------------
+#     Exposition
+#--------------------------
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render(extra=()):
+    '''
+    Prometheus text format. `extra` adds (name, type, help, [(labels, value)])
+    tuples computed at scrape time.
+    '''
+    totals = counters.totals()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'histogram':
+            lines += render_histogram(name, totals)
+            continue
+        samples = sorted((labels, value) for (key, labels), value in totals.items() if key == name)
+        if not samples and kind == 'gauge':
+            samples = [((), 0)]
+        lines += [f'{name}{format_labels(labels)} {format_value(value)}' for labels, value in samples]
+    for name, kind, help_text, samples in extra:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        lines += [f'{name}{format_labels(labels)} {format_value(value)}' for labels, value in samples]
+    return '\n'.join(lines) + '\n'
+
+
+def render_histogram(name, totals):
+    lines, cumulative = [], 0
+    for index, bound in enumerate((*BUCKETS, math.inf)):
+        cumulative += totals.get((name, index), 0)
+        le = '+Inf' if bound == math.inf else repr(bound)
+        lines.append(f'{name}_bucket{{le="{le}"}} {format_value(cumulative)}')
+    lines.append(f'{name}_sum {format_value(totals.get((name + "_sum", ()), 0))}')
+    lines.append(f'{name}_count {format_value(cumulative)}')
+    return lines
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_rename_video_duration_ms_message_video_duration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='processing',
+            field=models.BooleanField(default=False),
+        ),
+    ]
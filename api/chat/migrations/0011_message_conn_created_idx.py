@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_message_processing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['connection', '-created', '-id'], name='message_conn_created_idx'),
+        ),
+    ]
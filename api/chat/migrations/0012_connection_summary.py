@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_message_conn_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='connection',
+            name='last_activity',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='connection',
+            name='last_media',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='connection',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AddField(
+            model_name='connection',
+            name='last_text',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='connection',
+            index=models.Index(condition=models.Q(('accepted', True)), fields=['sender', '-last_activity'], name='conn_sender_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='connection',
+            index=models.Index(condition=models.Q(('accepted', True)), fields=['receiver', '-last_activity'], name='conn_receiver_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_search_terms(apps, schema_editor):
+    User = apps.get_model('chat', 'User')
+    SearchTerm = apps.get_model('chat', 'SearchTerm')
+    terms = []
+    for user in User.objects.only('id', 'username', 'first_name', 'last_name').iterator():
+        for value, kind in ((user.username, 0), (user.first_name, 1), (user.last_name, 2)):
+            for token in (value or '').strip().lower().split():
+                terms.append(SearchTerm(user_id=user.id, term=token, kind=kind))
+    SearchTerm.objects.bulk_create(terms, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_connection_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=150)),
+                ('kind', models.PositiveSmallIntegerField(choices=[(0, 'username'), (1, 'first name'), (2, 'last name')])),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'kind', 'user'], name='search_term_idx')],
+            },
+        ),
+        migrations.RunPython(build_search_terms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:45
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def media_kind(message):
+    for kind in ('image', 'voice', 'video'):
+        if getattr(message, kind):
+            return kind
+    return None
+
+
+def merge_duplicate_connections(apps, schema_editor):
+    '''
+    get_or_create raced before there was a constraint: fold duplicate
+    (sender, receiver) rows into the oldest one, keeping every message.
+    '''
+    Connection = apps.get_model('chat', 'Connection')
+    Message = apps.get_model('chat', 'Message')
+    duplicates = Connection.objects.values('sender', 'receiver').annotate(
+        rows=Count('id'), keep=Min('id')
+    ).filter(rows__gt=1)
+    for group in duplicates:
+        rows = Connection.objects.filter(sender=group['sender'], receiver=group['receiver'])
+        keep = rows.get(id=group['keep'])
+        others = rows.exclude(id=keep.id)
+        Message.objects.filter(connection__in=others).update(connection=keep)
+        accepted = keep.accepted or others.filter(accepted=True).exists()
+        others.delete()
+
+        latest = Message.objects.filter(connection=keep).order_by('-created', '-id').first()
+        Connection.objects.filter(id=keep.id).update(
+            accepted=accepted,
+            last_message=latest,
+            last_text=latest.text if latest else None,
+            last_media=media_kind(latest) if latest else None,
+            last_activity=latest.created if latest else keep.last_activity,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_search_term'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_connections, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='connection',
+            index=models.Index(condition=models.Q(('accepted', False)), fields=['receiver'], name='conn_receiver_pending_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='connection',
+            constraint=models.UniqueConstraint(fields=('sender', 'receiver'), name='unique_connection'),
+        ),
+    ]
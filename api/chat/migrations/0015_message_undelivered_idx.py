@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_connection_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('delivered', False)), fields=['connection'], name='message_undelivered_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations, models
+from django.db.models import F
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_updated(apps, schema_editor):
+    # Existing rows last changed no later than they were created
+    apps.get_model('chat', 'Message').objects.update(updated=F('created'))
+    apps.get_model('chat', 'User').objects.update(updated=F('date_joined'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_message_undelivered_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_updated, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['connection', 'updated'], name='message_conn_updated_idx'),
+        ),
+        migrations.CreateModel(
+            name='MessageTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.BigIntegerField()),
+                ('deleted', models.DateTimeField(default=django.utils.timezone.now)),
+                ('connection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to='chat.connection')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['connection', 'deleted'], name='tombstone_conn_deleted_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:08
+
+import chat.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_sync_since'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(unique=True, upload_to=chat.models.upload_blob)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refs', models.IntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='image_placeholder',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='image_variants',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:13
+
+import chat.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='thumbnail_small',
+            field=models.ImageField(blank=True, null=True, upload_to=chat.models.upload_thumbnail),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0019_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='video_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='video_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,16 +1,18 @@
 # api/chat/models.py
+import hashlib
+import os
 
 from django.contrib.auth.models import AbstractUser
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.db import models
-from django.db.models import JSONField
+from django.db.models import JSONField, Q
+from django.utils import timezone
 
 # Create your models here.
 def upload_thumbnail(instance, filename):
-    path = f'thumbnails/{instance.username}'
-    extension = filename.split('.')[-1]
-    if extension:
-        path = path + '.' + extension
-    return path
+    # avatars/<username>/<version>-<size>.webp, named by User.set_avatar
+    return f'avatars/{instance.username}/{os.path.basename(filename)}'
 
 def upload_message_media(instance, filename):
     ext = filename.split('.')[-1]
@@ -38,11 +40,65 @@ def upload_message_media(instance, filename):
         # Fallback: generic
         return f'messages/{instance.connection.id}/{instance.id}.{ext}'
 
+def upload_blob(instance, filename):
+    # blobs/<first two hex digits>/<sha256>.<ext> (see chat/blobs.py)
+    ext = os.path.splitext(filename)[1].lower()
+    return f'blobs/{instance.sha256[:2]}/{instance.sha256}{ext}'
+
 
 class User(AbstractUser):
+    # Square avatar variants (chat/images.py). Avatars from before them
+    # live at thumbnails/<username>.<ext> with no small variant.
     thumbnail = models.ImageField(upload_to=upload_thumbnail, null=True, blank=True)
+    thumbnail_small = models.ImageField(upload_to=upload_thumbnail, null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)  # profile changes for sync.since
+
+    def set_avatar(self, variants):
+        '''
+        Store avatar_variants() output under names versioned by content
+        and delete the previous files.
+        '''
+        version = hashlib.sha256(variants['large']).hexdigest()[:16]
+        names = {'large': f'{version}-large.webp', 'small': f'{version}-small.webp'}
+        if self.thumbnail.name == upload_thumbnail(self, names['large']):
+            return  # the same picture again
+        old = [field.name for field in (self.thumbnail, self.thumbnail_small) if field]
+        self.thumbnail.save(names['large'], ContentFile(variants['large']), save=False)
+        self.thumbnail_small.save(names['small'], ContentFile(variants['small']), save=False)
+        self.save(update_fields=['thumbnail', 'thumbnail_small', 'updated'])
+        for name in old:
+            default_storage.delete(name)
     
 
+class SearchTerm(models.Model):
+    '''
+    Normalized (lowercase) name tokens for user search. Prefix lookups are
+    index range scans on `term`; kept in sync by signals.py.
+    '''
+    USERNAME, FIRST_NAME, LAST_NAME = 0, 1, 2
+    KIND_CHOICES = [
+        (USERNAME, 'username'),
+        (FIRST_NAME, 'first name'),
+        (LAST_NAME, 'last name'),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        related_name='search_terms',
+        on_delete=models.CASCADE
+    )
+    term = models.CharField(max_length=150)
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'kind', 'user'], name='search_term_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.term} -> {self.user_id}'
+
+
 class Connection(models.Model):
     sender = models.ForeignKey(
         User, 
@@ -57,10 +113,86 @@ class Connection(models.Model):
     accepted = models.BooleanField(default=False)
     updated = models.DateTimeField(auto_now=True)
     created = models.DateTimeField(auto_now_add=True)
+
+    # Conversation summary for friend.list, maintained by the message
+    # handlers (see set_last_message / refresh_summary) and backfilled by
+    # `manage.py backfill_conversations`.
+    last_message = models.ForeignKey(
+        'Message',
+        related_name='+',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL
+    )
+    last_text = models.TextField(blank=True, null=True)
+    last_media = models.CharField(max_length=10, blank=True, null=True)
+    last_activity = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # friend.list: WHERE (sender = ? OR receiver = ?) AND accepted ORDER BY last_activity DESC
+            models.Index(
+                fields=['sender', '-last_activity'],
+                condition=Q(accepted=True),
+                name='conn_sender_activity_idx'
+            ),
+            models.Index(
+                fields=['receiver', '-last_activity'],
+                condition=Q(accepted=True),
+                name='conn_receiver_activity_idx'
+            ),
+            # request.list: WHERE NOT accepted AND receiver = ?. Partial, like
+            # the two above: SQLite can't seek on a NOT "accepted" term
+            models.Index(
+                fields=['receiver'],
+                condition=Q(accepted=False),
+                name='conn_receiver_pending_idx'
+            ),
+        ]
+        constraints = [
+            # One request per direction. Its index also serves the
+            # (sender, receiver) lookups in request.accept/connect and search.
+            models.UniqueConstraint(
+                fields=['sender', 'receiver'],
+                name='unique_connection'
+            ),
+        ]
     
     def __str__(self):
         return self.sender.username + ' -> ' + self.receiver.username
 
+    def set_last_message(self, message):
+        '''
+        Point the summary at `message` unless a newer one is already there.
+        A conditional UPDATE, so concurrent senders can't move it backwards.
+        '''
+        fields = {
+            'last_message': message,
+            'last_text': message.text,
+            'last_media': message.media_kind(),
+            'last_activity': message.created,
+        }
+        Connection.objects.filter(
+            Q(last_message__isnull=True) | Q(last_activity__lte=message.created),
+            id=self.id
+        ).update(**fields)
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def refresh_summary(self):
+        '''Recompute the summary from the newest remaining message.'''
+        latest = self.messages.order_by('-created', '-id').first()
+        self.last_message = latest
+        self.last_text = latest.text if latest else None
+        self.last_media = latest.media_kind() if latest else None
+        self.last_activity = latest.created if latest else self.updated
+        Connection.objects.filter(id=self.id).update(
+            last_message=self.last_message,
+            last_text=self.last_text,
+            last_media=self.last_media,
+            last_activity=self.last_activity
+        )
+
 
 class Message(models.Model):
     connection = models.ForeignKey(
@@ -75,28 +207,107 @@ class Message(models.Model):
     )
     text = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to=upload_message_media, blank=True, null=True)
+    # Set by the image media job (chat/images.py): smaller WebP variants
+    # ({'320': name, '720': name}; `image` becomes the full one), the full
+    # size and a LQIP data: URI
+    image_variants = JSONField(blank=True, null=True)
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_placeholder = models.TextField(blank=True, null=True)
     voice = models.FileField(upload_to=upload_message_media, blank=True, null=True)
     waveform = JSONField(blank=True, null=True)  # ← Use JSONField for SQLite
     video = models.FileField(upload_to=upload_message_media, null=True, blank=True)
     video_thumbnail = models.ImageField(upload_to=upload_message_media, null=True, blank=True)
     # video_duration_ms = models.PositiveIntegerField(null=True, blank=True)
     video_duration = models.PositiveIntegerField(null=True, blank=True)  # store integer seconds
+    # Display size, from the video job's probe (chat/video.py)
+    video_width = models.PositiveIntegerField(null=True, blank=True)
+    video_height = models.PositiveIntegerField(null=True, blank=True)
     delivered = models.BooleanField(default=False)
     seen = models.BooleanField(default=False)
+    processing = models.BooleanField(default=False)  # media job still running (chat/jobs.py)
     created = models.DateTimeField(auto_now_add=True)
+    # Any change sync.since must replay. Set by hand in queryset .update()s
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # message.list keyset paging: WHERE connection = ? ORDER BY created DESC, id DESC
+            models.Index(fields=['connection', '-created', '-id'], name='message_conn_created_idx'),
+            # The offline outbox (chat/outbox.py): only unacked rows are indexed
+            models.Index(
+                fields=['connection'],
+                condition=Q(delivered=False),
+                name='message_undelivered_idx'
+            ),
+            # sync.since: WHERE connection IN (...) AND updated >= ?
+            models.Index(fields=['connection', 'updated'], name='message_conn_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}: {self.text or 'Media Message'}"
 
-    def delete(self, *args, **kwargs):
-        # Clean up associated files when a message is deleted
+    def media_kind(self):
         if self.image:
-            self.image.delete(save=False)
+            return 'image'
         if self.voice:
-            self.voice.delete(save=False)
+            return 'voice'
         if self.video:
-            self.video.delete(save=False)
-        if self.video_thumbnail:
-            self.video_thumbnail.delete(save=False)
-        super().delete(*args, **kwargs)
+            return 'video'
+        return None
+
+    def media_names(self):
+        '''Storage names of this message's files, image variants included.'''
+        names = [
+            field.name
+            for field in (self.image, self.voice, self.video, self.video_thumbnail)
+            if field
+        ]
+        names += (self.image_variants or {}).values()
+        return names
+
+    def delete(self, *args, **kwargs):
+        # Forwards share files, so only the last reference deletes one
+        from .blobs import release
+
+        names = self.media_names()
+        result = super().delete(*args, **kwargs)
+        release(names)
+        return result
+
+
+class Blob(models.Model):
+    '''
+    One stored media file, shared by every message field with the same
+    content (chat/blobs.py). `refs` counts those fields.
+    '''
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=upload_blob, unique=True)
+    size = models.PositiveBigIntegerField()
+    refs = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.file.name} ({self.refs} refs)'
+
 
+class MessageTombstone(models.Model):
+    '''
+    A deleted message, kept so sync.since can tell reconnecting clients to
+    drop it. Pruned after CHAT_SYNC['TOMBSTONE_TTL'] (chat/sync.py).
+    '''
+    connection = models.ForeignKey(
+        Connection,
+        related_name='tombstones',
+        on_delete=models.CASCADE
+    )
+    message_id = models.BigIntegerField()
+    deleted = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['connection', 'deleted'], name='tombstone_conn_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.connection_id}: {self.message_id}'
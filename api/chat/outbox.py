@@ -0,0 +1,89 @@
+# api/chat/outbox.py
+'''
+Delivery acknowledgements and the offline outbox.
+
+A message is created with delivered=False. It becomes delivered when the
+recipient's app acks it:
+
+    client -> {'source': 'message.delivered', 'messageIds': [151, 152]}
+    server -> author: {'source': 'message.delivered',
+                       'data': {'connection_id': 6, 'messageIds': [151, 152]}}
+
+Everything still undelivered for a user is that user's outbox. It needs
+no separate store: a partial index covers the undelivered rows. When a
+socket connects it gets the outbox in one push, grouped per conversation
+like message.send_batch, and acks it like any other message:
+
+    server -> {'source': 'message.outbox',
+               'data': {'batches': [{'messages', 'friend', 'connection_id'}, ...],
+                        'more': False}}
+
+`more` means the outbox held more than OUTBOX_LIMIT messages and the app
+should fall back to message.list for the rest.
+'''
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .events import conversation_batches
+from .models import Message
+from .presence import online_usernames
+
+# Largest ack a client may send in one frame
+ACK_LIMIT = 500
+
+
+def get_outbox_limit():
+    return getattr(settings, 'OUTBOX_LIMIT', 500)
+
+
+def undelivered_to(user):
+    '''Messages other people sent to `user` that no device of theirs has acked.'''
+    return Message.objects.filter(
+        Q(connection__sender=user) | Q(connection__receiver=user),
+        delivered=False
+    ).exclude(user=user)
+
+
+def skip_offline(events, recipient):
+    '''
+    Drop the recipient's copies of [(username, data)] events when they have
+    no open socket; the messages wait in their outbox instead. The author's
+    copies always go (their other devices).
+    '''
+    if online_usernames([recipient]):
+        return events
+    return [(username, data) for username, data in events if username != recipient]
+
+
+def outbox_data(user, limit=None):
+    limit = limit or get_outbox_limit()
+    messages = list(undelivered_to(user).select_related(
+        'connection__sender', 'connection__receiver'
+    ).order_by('id')[:limit + 1])
+    more = len(messages) > limit
+    return {'batches': conversation_batches(user, messages[:limit]), 'more': more}
+
+
+def mark_delivered(user, message_ids):
+    '''
+    Mark the acked messages delivered. Only messages sent to `user` count.
+    Returns {(author username, connection id): [message ids]} for the ones
+    that changed.
+    '''
+    ids = [i for i in message_ids[:ACK_LIMIT] if isinstance(i, int)]
+    rows = list(undelivered_to(user).filter(id__in=ids).values_list(
+        'id', 'connection_id', 'user__username'
+    ))
+    if not rows:
+        return {}
+    Message.objects.filter(id__in=[row[0] for row in rows]).update(
+        delivered=True, updated=timezone.now()
+    )
+
+    acked = defaultdict(list)
+    for message_id, connection_id, author in rows:
+        acked[author, connection_id].append(message_id)
+    return acked
@@ -0,0 +1,67 @@
+# api/chat/pagination.py
+'''
+Paging for message.list.
+
+Two modes share the same response shape ('messages' + 'next'):
+    - page:   {'page': 2}        -> next is the next page index (legacy)
+    - cursor: {'cursor': None}   -> next is an opaque cursor string, pass it
+                                    back as 'cursor' to scroll further back
+
+Both fetch page_size + 1 rows and use the extra row to decide `next`, so
+no COUNT(*) is needed. Cursor mode is keyset pagination on
+(created, id) descending, backed by the message_conn_created_idx index,
+so its cost does not grow with how far back the user has scrolled.
+'''
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 15
+
+
+class CursorError(ValueError):
+    pass
+
+
+def get_page_size(requested):
+    maximum = getattr(settings, 'MESSAGE_PAGE_SIZE_MAX', 50)
+    if not isinstance(requested, int) or requested <= 0:
+        return DEFAULT_PAGE_SIZE
+    return min(requested, maximum)
+
+
+def encode_cursor(message):
+    return f'{message.created.isoformat()}|{message.id}'
+
+
+def decode_cursor(cursor):
+    try:
+        created, message_id = cursor.rsplit('|', 1)
+        return datetime.fromisoformat(created), int(message_id)
+    except (AttributeError, ValueError):
+        raise CursorError(f'Invalid cursor {cursor!r}')
+
+
+def paginate_messages(queryset, page_size, page=None, cursor=None, cursor_mode=False):
+    '''
+    Returns (messages, next) for one page of newest-first messages.
+    '''
+    queryset = queryset.order_by('-created', '-id')
+
+    if cursor_mode:
+        if cursor:
+            created, message_id = decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(created__lt=created) | Q(created=created, id__lt=message_id)
+            )
+        rows = list(queryset[:page_size + 1])
+        messages = rows[:page_size]
+        next_page = encode_cursor(messages[-1]) if len(rows) > page_size else None
+        return messages, next_page
+
+    page = page or 0
+    rows = list(queryset[page * page_size:(page + 1) * page_size + 1])
+    messages = rows[:page_size]
+    next_page = page + 1 if len(rows) > page_size else None
+    return messages, next_page
@@ -0,0 +1,229 @@
+# api/chat/presence.py
+'''
+Online presence.
+
+Each user is online while they have at least one open socket. The store
+keeps a socket refcount per username, so a second device connecting or
+one of two devices dropping changes nothing. Only 0 -> 1 and 1 -> 0
+transitions are reported to the notifier.
+
+Stores (settings.CHAT_PRESENCE['BACKEND']):
+    - 'memory': per-process dict (tests, single worker)
+    - 'redis':  one hash shared by every worker. A worker that dies
+                without running disconnect leaves its sockets counted, so
+                clear KEY when redeploying.
+
+The notifier debounces transitions for DEBOUNCE seconds and compares each
+user against the state before the window opened. A phone that drops and
+reconnects inside the window produces no event. The changes that remain
+go out as one `presence` event per online friend:
+
+    {'source': 'presence', 'data': {'users': [{'username', 'online'}, ...]}}
+'''
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection as db_connection
+from django.db.models import Q
+from django.dispatch import receiver
+
+from .logs import fields
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'memory',
+    'REDIS_URL': 'redis://127.0.0.1:6379/0',
+    'KEY': 'chat:presence',
+    'DEBOUNCE': 2.0,    # seconds; 0 sends every change straight away
+}
+
+
+def get_presence_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_PRESENCE', {})}
+
+
+#--------------------------
+#     Stores
+#--------------------------
+class MemoryPresenceStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def incr(self, username):
+        with self.lock:
+            count = self.counts.get(username, 0) + 1
+            self.counts[username] = count
+            return count
+
+    def decr(self, username):
+        with self.lock:
+            count = self.counts.get(username, 0) - 1
+            if count <= 0:
+                self.counts.pop(username, None)
+                return 0
+            self.counts[username] = count
+            return count
+
+    def online(self, usernames):
+        with self.lock:
+            return {username for username in usernames if username in self.counts}
+
+
+# Decrement and drop the field at zero in one step, so a connect racing
+# the HDEL can't be lost
+REDIS_DECR = '''
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if count <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return 0
+end
+return count
+'''
+
+
+class RedisPresenceStore:
+    def __init__(self, url, key):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.key = key
+        self.decr_script = self.redis.register_script(REDIS_DECR)
+
+    def incr(self, username):
+        return self.redis.hincrby(self.key, username, 1)
+
+    def decr(self, username):
+        return self.decr_script(keys=[self.key], args=[username])
+
+    def online(self, usernames):
+        usernames = list(usernames)
+        if not usernames:
+            return set()
+        counts = self.redis.hmget(self.key, usernames)
+        return {username for username, count in zip(usernames, counts) if count is not None}
+
+
+#--------------------------
+#     Fan-out
+#--------------------------
+class PresenceNotifier:
+    def __init__(self, store, debounce, send):
+        self.store = store
+        self.debounce = debounce
+        self.send = send
+        self.lock = threading.Lock()
+        self.pending = {}   # username -> online before this window
+        self.timer = None
+
+    def changed(self, username, was_online):
+        with self.lock:
+            self.pending.setdefault(username, was_online)
+            if self.debounce > 0 and self.timer is None:
+                self.timer = threading.Timer(self.debounce, self.flush_in_thread)
+                self.timer.daemon = True
+                self.timer.start()
+        if self.debounce <= 0:
+            # Callers run on sync_to_async pool threads; don't leave their
+            # DB connection open
+            self.flush_in_thread()
+
+    def flush_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            log.exception('presence.flush_failed')
+        finally:
+            db_connection.close()
+
+    def flush(self):
+        from .models import Connection
+
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.timer = None
+        if not pending:
+            return
+
+        # Compare against the store, not the last transition: it is
+        # shared by every worker
+        online = self.store.online(pending)
+        changes = {
+            username: username in online
+            for username, was_online in pending.items()
+            if (username in online) != was_online
+        }
+        if not changes:
+            return
+
+        friendships = Connection.objects.filter(
+            Q(sender__username__in=changes) | Q(receiver__username__in=changes),
+            accepted=True
+        ).values_list('sender__username', 'receiver__username')
+        batches = defaultdict(list)
+        for sender_name, receiver_name in friendships:
+            if sender_name in changes:
+                batches[receiver_name].append(sender_name)
+            if receiver_name in changes:
+                batches[sender_name].append(receiver_name)
+
+        recipients = self.store.online(batches)
+        for recipient in recipients:
+            self.send(recipient, 'presence', {
+                'users': [
+                    {'username': username, 'online': changes[username]}
+                    for username in batches[recipient]
+                ]
+            })
+        log.debug('presence.flush', extra=fields(changes=len(changes), recipients=len(recipients)))
+
+
+#--------------------------
+#     Singleton
+#--------------------------
+_presence = None
+_presence_lock = threading.Lock()
+
+
+def get_presence():
+    '''(store, notifier) for this process.'''
+    global _presence
+    with _presence_lock:
+        if _presence is None:
+            from .jobs import broadcast
+
+            config = get_presence_settings()
+            if config['BACKEND'] == 'redis':
+                store = RedisPresenceStore(config['REDIS_URL'], config['KEY'])
+            else:
+                store = MemoryPresenceStore()
+            _presence = (store, PresenceNotifier(store, config['DEBOUNCE'], broadcast))
+        return _presence
+
+
+@receiver(setting_changed)
+def reset_presence(setting, **kwargs):
+    global _presence
+    if setting == 'CHAT_PRESENCE':
+        _presence = None
+
+
+def user_connected(username):
+    store, notifier = get_presence()
+    if store.incr(username) == 1:
+        notifier.changed(username, False)
+
+
+def user_disconnected(username):
+    store, notifier = get_presence()
+    if store.decr(username) == 0:
+        notifier.changed(username, True)
+
+
+def online_usernames(usernames):
+    store, _ = get_presence()
+    return store.online(usernames)
@@ -0,0 +1,71 @@
+# api/chat/protocol.py
+'''
+Frame schemas for the socket protocol.
+
+Each client source is registered in consumers.HANDLERS with the handler
+method that serves it and a schema for its frame: field name -> Field.
+dispatch_source checks the frame against the schema before the handler
+runs, so handlers can index fields without defending against the wrong
+types. Fields not in the schema are ignored (clients send extras, e.g.
+video_url on message.send).
+
+A frame that doesn't match gets one reply on the same socket:
+
+    {'source': 'frame.error', 'data': {'source': 'message.list',
+                                       'error': 'connectionId: expected int'}}
+'''
+
+
+class Field:
+    def __init__(self, kind, required=True, nullable=False, items=None):
+        self.kind = kind            # type or tuple of types
+        self.required = required
+        self.nullable = nullable
+        self.items = items          # element type for lists
+
+    def check(self, value):
+        '''None if `value` is acceptable, else what was expected.'''
+        if value is None:
+            return None if self.nullable else 'must not be null'
+        if not self.accepts(self.kind, value):
+            return f'expected {type_name(self.kind)}'
+        if self.items is not None and not all(self.accepts(self.items, item) for item in value):
+            return f'expected a list of {type_name(self.items)}'
+        return None
+
+    @staticmethod
+    def accepts(kind, value):
+        # bool is an int subclass; true is never a valid id
+        if isinstance(value, bool) and kind is not bool:
+            return False
+        return isinstance(value, kind)
+
+
+def optional(kind, **kwargs):
+    # May be missing or null
+    return Field(kind, required=False, nullable=True, **kwargs)
+
+
+def type_name(kind):
+    if isinstance(kind, tuple):
+        return ' or '.join(k.__name__ for k in kind)
+    return kind.__name__
+
+
+class Handler:
+    def __init__(self, method, schema=None):
+        self.method = method
+        self.schema = schema or {}
+
+
+def validate(schema, frame):
+    '''First problem with `frame` as a string, or None.'''
+    for name, field in schema.items():
+        if name not in frame:
+            if field.required:
+                return f'{name}: required'
+            continue
+        problem = field.check(frame[name])
+        if problem:
+            return f'{name}: {problem}'
+    return None
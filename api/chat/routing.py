@@ -5,5 +5,5 @@ from django.urls import path
 from . import consumers
 
 websocket_urlpatterns = [
-    path('chat/', consumers.ChatConsumers.as_asgi())
-]
\ No newline at end of file
+    path('chat/', consumers.get_consumer_class().as_asgi())
+]
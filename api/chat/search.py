@@ -0,0 +1,84 @@
+# api/chat/search.py
+'''
+User search for the `search` source.
+
+Every user has one SearchTerm row per lowercase name token. A prefix query
+is then a single range scan on the term index, ranked and capped at
+SEARCH_RESULT_LIMIT, so neither the scan nor the payload grows with the
+user table. The ranked id list for a query is the same for everybody, so
+it is cached for SEARCH_CACHE_TTL seconds to absorb search-as-you-type;
+per-viewer connection status is computed afterwards for that page only.
+'''
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, IntegerField, Max, Min, Value, When
+
+from .models import SearchTerm
+
+# Sorts after every real character, so [q, q + END) is "starts with q"
+END = '\U0010ffff'
+
+
+def normalize(query):
+    return (query or '').strip().lower()
+
+
+def get_limit():
+    return getattr(settings, 'SEARCH_RESULT_LIMIT', 20)
+
+
+def terms_for(user):
+    return [
+        (token, kind)
+        for value, kind in (
+            (user.username, SearchTerm.USERNAME),
+            (user.first_name, SearchTerm.FIRST_NAME),
+            (user.last_name, SearchTerm.LAST_NAME),
+        )
+        for token in normalize(value).split()
+    ]
+
+
+def sync_search_terms(user):
+    SearchTerm.objects.filter(user=user).delete()
+    SearchTerm.objects.bulk_create([
+        SearchTerm(user=user, term=term, kind=kind)
+        for term, kind in terms_for(user)
+    ])
+
+
+def ranked_user_ids(query, limit):
+    '''
+    Ids of users with a name token starting with `query`: exact username
+    first, then username prefixes, first names, last names; ties by id.
+    '''
+    rows = SearchTerm.objects.filter(
+        term__gte=query,
+        term__lt=query + END
+    ).values(
+        'user_id'
+    ).annotate(
+        exact=Max(Case(
+            When(term=query, kind=SearchTerm.USERNAME, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField()
+        )),
+        rank=Min('kind')
+    ).order_by(
+        '-exact', 'rank', 'user_id'
+    )[:limit]
+    return [row['user_id'] for row in rows]
+
+
+def search_user_ids(query, exclude_id):
+    query = normalize(query)
+    if not query:
+        return []
+    limit = get_limit()
+    key = f'search:{limit}:{query}'
+    # One spare row so excluding the viewer still leaves a full page
+    ids = cache.get(key)
+    if ids is None:
+        ids = ranked_user_ids(query, limit + 1)
+        cache.set(key, ids, timeout=getattr(settings, 'SEARCH_CACHE_TTL', 10))
+    return [i for i in ids if i != exclude_id][:limit]
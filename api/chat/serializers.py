@@ -1,10 +1,23 @@
 # api/chat/serializers.py
+import logging
+
 from rest_framework import serializers
 from rest_framework.reverse import reverse
 from django.conf import settings
+from django.core.files.storage import default_storage
 
+from .logs import fields
 from .models import User, Connection, Message
 
+log = logging.getLogger(__name__)
+
+# friend.list preview for a last message without text
+MEDIA_PREVIEWS = {
+    'image': 'Photo',
+    'voice': 'Voice message',
+    'video': 'Video',
+}
+
 class SignUpSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -48,7 +61,8 @@ class UserSerializer(serializers.ModelSerializer):
         fields = [
             'username',
             'name',            
-            'thumbnail'
+            'thumbnail',
+            'thumbnail_small',
         ]
     
     def get_name(self, obj):
@@ -67,6 +81,7 @@ class SearchSerializer(UserSerializer):
             'username',
             'name',
             'thumbnail',
+            'thumbnail_small',
             'status'
         ]
         
@@ -97,6 +112,7 @@ class RequestSerializer(serializers.ModelSerializer):
 class FriendSerializer(serializers.ModelSerializer):
     friend = serializers.SerializerMethodField()
     preview = serializers.SerializerMethodField()
+    preview_media = serializers.CharField(source='last_media', read_only=True)
     updated = serializers.SerializerMethodField()
     
     class Meta:
@@ -105,6 +121,7 @@ class FriendSerializer(serializers.ModelSerializer):
             'id',
             'friend',
             'preview',
+            'preview_media',
             'updated'
         ]
         
@@ -116,24 +133,23 @@ class FriendSerializer(serializers.ModelSerializer):
         elif self.context['user'] == obj.receiver:
             return UserSerializer(obj.sender).data
         else:
-            print('Error: No user found in friendSerializer!')
+            log.error('friend_data.not_a_participant', extra=fields(connection_id=obj.id))
             
     def get_preview(self, obj):
-        if not hasattr (obj, 'latest_text') or obj.latest_text is None:        
-            return 'New connection!'
-        return obj.latest_text
+        if obj.last_text:
+            return obj.last_text
+        if obj.last_media:
+            return MEDIA_PREVIEWS[obj.last_media]
+        return 'New connection!'
     
     def get_updated(self, obj):
-        if not hasattr (obj, 'latest_created'):
-            date = obj.updated            
-        else:
-            date = obj.latest_created or obj.updated
-        return date.isoformat()        
+        return obj.last_activity.isoformat()
 
 
 class MessageSerializer(serializers.ModelSerializer):
     is_me = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
     voice = serializers.SerializerMethodField()
     waveform = serializers.JSONField(read_only=True)
     video_url = serializers.SerializerMethodField()
@@ -149,13 +165,20 @@ class MessageSerializer(serializers.ModelSerializer):
             'is_me',
             'text', 
             'image', 
+            'image_variants',
+            'image_width',
+            'image_height',
+            'image_placeholder',
             'voice',
             'waveform', 
             'video_url', 
             'video_thumb_url', 
             'video_duration',
+            'video_width',
+            'video_height',
             'delivered',
             'seen',
+            'processing',
             'created'
         ]
         
@@ -168,6 +191,17 @@ class MessageSerializer(serializers.ModelSerializer):
             return f"{settings.SITE_URL}{obj.image.url}"
         return None
 
+    def get_image_variants(self, obj):
+        # '320' / '720' / 'full' -> URL; None until the image job has run
+        if obj.image_variants is None or not obj.image:
+            return None
+        variants = {
+            key: f"{settings.SITE_URL}{default_storage.url(name)}"
+            for key, name in obj.image_variants.items()
+        }
+        variants['full'] = f"{settings.SITE_URL}{obj.image.url}"
+        return variants
+
     def get_voice(self, obj):
         if obj.voice:
             return f"{settings.SITE_URL}{obj.voice.url}"
@@ -188,28 +222,6 @@ class MessageSerializer(serializers.ModelSerializer):
             return None
         return int(obj.video_duration)  # already stored as integer seconds
 
-   
-    def serialize_message(msg, user=None):
-        """
-        Quick helper to serialize a Message instance into a dict.
-        Mirrors MessageSerializer but without needing DRF context.
-        """
-        return {
-            "id": msg.id,
-            "connection_id": msg.connection.id,
-            "is_me": (user == msg.user) if user else False,
-            "text": msg.text,
-            "image": f"{settings.SITE_URL}{msg.image.url}" if msg.image else None,
-            "voice": f"{settings.SITE_URL}{msg.voice.url}" if msg.voice else None,
-            "waveform": msg.waveform,
-            "video_url": f"{settings.SITE_URL}{msg.video.url}" if msg.video else None,
-            "video_thumb_url": f"{settings.SITE_URL}{msg.video_thumbnail.url}" if msg.video_thumbnail else None,            
-            "video_duration": int(msg.video_duration) if msg.video_duration else None,
-            "delivered": msg.delivered,
-            "seen": msg.seen,
-            "created": msg.created.isoformat(),
-        }
-
 
 
 
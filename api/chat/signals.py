@@ -1,11 +1,31 @@
 # api/chat/signals.py
+import logging
+
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from .models import Message
-from .utils import generate_waveform
+from django.utils import timezone
+from .models import Message, User
+from .jobs import enqueue_media_job
+from .logs import fields
+from .search import sync_search_terms
+
+log = logging.getLogger(__name__)
 
 @receiver(post_save, sender=Message)
 def handle_voice_waveform(sender, instance, created, **kwargs):
-    if created and instance.voice:
-        print(f"Signal triggered for Message ID {instance.id}")
-        generate_waveform(instance)
\ No newline at end of file
+    if created and instance.voice and not instance.waveform:
+        log.debug('voice.queued', extra=fields(message_id=instance.id))
+        # Bump `updated` so sync.since picks up the processing flag
+        Message.objects.filter(id=instance.id).update(processing=True, updated=timezone.now())
+        # A job pool worker must not run before the row is visible to it
+        path = instance.voice.path
+        transaction.on_commit(lambda: enqueue_media_job('voice', instance, path))
+
+
+@receiver(post_save, sender=User)
+def handle_search_terms(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only touch last_login; skip saves that can't change a name
+    if update_fields and not {'username', 'first_name', 'last_name'} & set(update_fields):
+        return
+    sync_search_terms(instance)
\ No newline at end of file
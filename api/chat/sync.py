@@ -0,0 +1,144 @@
+# api/chat/sync.py
+'''
+Delta sync for reconnecting clients.
+
+Instead of reloading friend.list, request.list and message.list after
+every network change, the app keeps the cursor from its last sync and asks
+for what changed since then:
+
+    client -> {'source': 'sync.since', 'cursor': '2026-10-18T12:00:00+00:00'}
+
+The reply is one or more 'sync.since' frames. The first carries the
+small, friend-bounded sections; each frame carries up to BATCH_SIZE
+changed messages grouped per conversation; the last has done=True and the
+cursor to keep:
+
+    {'connections': [friend.list items], 'requests': [request.list items],
+     'users': [profiles that changed], 'deleted': [{'messageId', 'connection_id'}],
+     'batches': [{'messages', 'friend', 'connection_id'}],
+     'done': True, 'cursor': '...', 'reset': False}
+
+"Changed messages" covers new ones and seen/delivered/media updates; the
+client merges them by id. Every table is read from `since - OVERLAP` so a
+write that committed just after the previous sync read isn't missed;
+replays of the overlap are idempotent.
+
+reset=True (with a fresh cursor) means there is no cheap delta: no or bad
+cursor, a cursor older than the tombstones we keep, or more than
+MAX_MESSAGES changes. The app then falls back to the full reload.
+'''
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .events import conversation_batches
+from .fast_serializers import user_data, request_data, friend_data
+from .models import User, Connection, Message, MessageTombstone
+from .presence import online_usernames
+
+DEFAULTS = {
+    'BATCH_SIZE': 200,              # messages per frame
+    'MAX_MESSAGES': 2000,           # more changes than this -> reset
+    'OVERLAP': 2,                   # seconds re-read before the cursor
+    'TOMBSTONE_TTL': 7 * 24 * 3600, # seconds deletions are remembered
+}
+
+
+def get_sync_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_SYNC', {})}
+
+
+def encode_cursor(moment):
+    return moment.isoformat()
+
+
+def decode_cursor(cursor):
+    '''Aware datetime, or None if the cursor is missing or malformed.'''
+    if not isinstance(cursor, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(cursor)
+    except ValueError:
+        return None
+    if timezone.is_naive(moment):
+        return None
+    return moment
+
+
+def record_deletion(message):
+    '''Leave a tombstone for sync.since and drop ones nobody can ask for.'''
+    config = get_sync_settings()
+    now = timezone.now()
+    MessageTombstone.objects.create(connection_id=message.connection_id, message_id=message.id, deleted=now)
+    MessageTombstone.objects.filter(deleted__lt=now - timedelta(seconds=config['TOMBSTONE_TTL'])).delete()
+
+
+def sync_frames(user, cursor):
+    '''The list of 'sync.since' payloads answering `cursor`.'''
+    config = get_sync_settings()
+    now = timezone.now()
+    new_cursor = encode_cursor(now)
+    reset = [{'reset': True, 'done': True, 'cursor': new_cursor}]
+
+    since = decode_cursor(cursor)
+    if since is None or since < now - timedelta(seconds=config['TOMBSTONE_TTL']):
+        return reset
+    since -= timedelta(seconds=config['OVERLAP'])
+
+    # Every accepted conversation's id: ints only, bounded by friend count
+    mine = Q(sender=user) | Q(receiver=user)
+    friendships = list(Connection.objects.filter(mine, accepted=True).values_list(
+        'id', 'sender_id', 'receiver_id'
+    ))
+    connection_ids = [row[0] for row in friendships]
+
+    messages = list(Message.objects.filter(
+        connection_id__in=connection_ids,
+        updated__gte=since
+    ).select_related(
+        'connection__sender', 'connection__receiver'
+    ).order_by('updated', 'id')[:config['MAX_MESSAGES'] + 1])
+    if len(messages) > config['MAX_MESSAGES']:
+        return reset
+
+    connections = Connection.objects.filter(
+        mine,
+        Q(updated__gte=since) | Q(last_activity__gte=since),
+        accepted=True
+    ).select_related('sender', 'receiver').order_by('-last_activity')
+    requests = Connection.objects.filter(
+        receiver=user,
+        accepted=False,
+        updated__gte=since
+    ).select_related('sender', 'receiver')
+    friend_ids = {sender for _, sender, _ in friendships} | {receiver for _, _, receiver in friendships}
+    friend_ids.add(user.id)
+    users = User.objects.filter(id__in=friend_ids, updated__gte=since)
+    deleted = MessageTombstone.objects.filter(
+        connection_id__in=connection_ids,
+        deleted__gte=since
+    ).values_list('message_id', 'connection_id')
+
+    changed_friends = [friend_data(connection, user) for connection in connections]
+    online = online_usernames(item['friend']['username'] for item in changed_friends)
+    for item in changed_friends:
+        item['online'] = item['friend']['username'] in online
+
+    size = config['BATCH_SIZE']
+    frames = [
+        {'batches': conversation_batches(user, messages[start:start + size]), 'done': False}
+        for start in range(0, len(messages), size)
+    ] or [{'batches': [], 'done': False}]
+    frames[0].update({
+        'connections': changed_friends,
+        'requests': [request_data(connection) for connection in requests],
+        'users': [user_data(changed) for changed in users],
+        'deleted': [
+            {'messageId': message_id, 'connection_id': connection_id}
+            for message_id, connection_id in deleted
+        ],
+    })
+    frames[-1].update({'done': True, 'cursor': new_cursor, 'reset': False})
+    return frames
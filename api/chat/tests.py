@@ -1,3 +1,1269 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import zlib
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Exists, OuterRef, Q
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from . import fast_serializers, jobs, metrics
+from .blobs import store
+from .bench import IN_MEMORY_CACHES, IN_MEMORY_CHANNEL_LAYERS, ScopeUser
+from .consumers import AsyncChatConsumers, ChatConsumers, ChatHandlers, get_consumer_class
+from .images import process_image
+from .management.commands import loadtest
+from .logs import redact
+from .presence import MemoryPresenceStore, PresenceNotifier, reset_presence, user_connected
+from .timing import handler_stats
+from .typing import clear_typing, is_stale, start_typing, stop_typing
+from .uploads import ChunkedUpload, build_chunk_frame
+from .views import media_view
+from .video import parse_probe, process_video
+from .waveform import compute_waveform, peaks
+from .wire import negotiate
+from .models import Blob, User, Connection, Message
+from .serializers import (
+    UserSerializer,
+    SearchSerializer,
+    RequestSerializer,
+    FriendSerializer,
+    MessageSerializer
+)
+
+
+class RecordingHandlers(ChatHandlers):
+    '''
+    Drives the protocol handlers without a socket or channel layer;
+    everything sent with send_group is recorded instead.
+    '''
+
+    def __init__(self, user):
+        self.scope = {'user': user}
+        self.username = user.username
+        self.uploads = {}
+        self.sent = []
+
+    def send_group(self, group, source, data):
+        self.sent.append((group, source, data))
+
+    def reply(self, source, data):
+        self.sent.append((None, source, data))
+
+    def defer(self, func, *args):
+        func(*args)
+
+
+@override_settings(CHAT_PRESENCE={'BACKEND': 'memory', 'DEBOUNCE': 0}, CACHES=IN_MEMORY_CACHES)
+class ChatTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_presence('CHAT_PRESENCE')
+        self.alice = User.objects.create(username='alice', first_name='alice', last_name='a')
+        self.bob = User.objects.create(username='bob', first_name='bob', last_name='b')
+        self.carol = User.objects.create(username='carol', first_name='carol', last_name='c')
+        self.alice_bob = Connection.objects.create(sender=self.alice, receiver=self.bob, accepted=True)
+        self.alice_carol = Connection.objects.create(sender=self.alice, receiver=self.carol, accepted=True)
+
+
+class ConsumerModeTests(TestCase):
+    def test_mode_selects_the_consumer(self):
+        with self.settings(CHAT_CONSUMER_MODE='async'):
+            self.assertIs(get_consumer_class(), AsyncChatConsumers)
+        with self.settings(CHAT_CONSUMER_MODE='sync'):
+            self.assertIs(get_consumer_class(), ChatConsumers)
+        with self.settings():
+            del settings.CHAT_CONSUMER_MODE
+            self.assertIs(get_consumer_class(), ChatConsumers)
+
+
+@override_settings(
+    MEDIA_JOBS={'BACKEND': 'local', 'RETRIES': 2, 'TIMEOUT': 5},
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+)
+class MediaJobTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        # No voice file: that would queue the real job (signals.py)
+        self.message = Message.objects.create(connection=self.alice_bob, user=self.alice, processing=True)
+        self.layer = get_channel_layer()
+        for username in ('alice', 'bob'):
+            async_to_sync(self.layer.group_add)(username, f'test.{username}')
+        self.attempts = []
+
+    def run_job(self, *outcomes):
+        def processor(path, timeout=None):
+            self.attempts.append((path, timeout))
+            outcome = outcomes[len(self.attempts) - 1]
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        with mock.patch.dict(jobs.PROCESSORS, {'voice': processor}):
+            job = jobs.enqueue_media_job('voice', self.message, '/media/voice.m4a')
+        self.message.refresh_from_db()
+        events = [async_to_sync(self.layer.receive)(f'test.{username}') for username in ('alice', 'bob')]
+        self.assertEqual(jobs.media_queue_depth(), 0)
+        return job, events
+
+    def test_retried_until_it_succeeds(self):
+        job, events = self.run_job(RuntimeError('ffmpeg failed'), {'waveform': [-0.1, 0.1]})
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(self.attempts, [('/media/voice.m4a', 5)] * 2)
+        self.assertFalse(self.message.processing)
+        self.assertEqual(self.message.waveform, [-0.1, 0.1])
+        for event in events:
+            self.assertEqual(event['source'], 'message.media_ready')
+            self.assertEqual(event['data']['waveform'], [-0.1, 0.1])
+            self.assertIsNone(event['data']['error'])
+
+    def test_gives_up_after_retries_and_clears_processing(self):
+        job, events = self.run_job(*[FutureTimeoutError()] * 3)
+        self.assertEqual(job.attempts, 3)
+        self.assertFalse(self.message.processing)
+        self.assertIsNone(self.message.waveform)
+        for event in events:
+            self.assertFalse(event['data']['processing'])
+            self.assertEqual(event['data']['error'], 'timed out after 5s')
+
+
+class UploadTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.handlers = RecordingHandlers(self.alice)
+        self.addCleanup(self.handlers.discard_uploads)
+
+    def start(self, size):
+        self.handlers.receive_upload_start({'filename': 'clip.mp4', 'size': size})
+        return self.handlers.sent.pop()[2]['uploadId']
+
+    def test_chunks_are_acked_with_the_next_offset(self):
+        upload_id = self.start(6)
+        self.handlers.receive_upload_chunk(build_chunk_frame(upload_id, 0, b'abc'))
+        self.handlers.receive_upload_chunk(build_chunk_frame(upload_id, 3, b'def'))
+        self.assertEqual([data for _, _, data in self.handlers.sent], [
+            {'uploadId': upload_id, 'offset': 3, 'complete': False},
+            {'uploadId': upload_id, 'offset': 6, 'complete': True},
+        ])
+        with open(self.handlers.uploads[upload_id].path, 'rb') as fh:
+            self.assertEqual(fh.read(), b'abcdef')
+
+    def test_malformed_frames_get_an_error(self):
+        upload_id = self.start(6)
+        frames = [
+            b'',
+            bytes([2]) + b'\xff\xfe' + bytes(8) + b'abc',   # upload id not ascii
+            build_chunk_frame(upload_id, 0, b'')[:-3],       # header cut short
+            build_chunk_frame(upload_id, 4, b'abc'),         # out of step
+        ]
+        for frame in frames:
+            self.handlers.receive_upload_chunk(frame)
+        self.assertEqual([(source, data['error']) for _, source, data in self.handlers.sent], [
+            ('upload.error', 'Empty frame'),
+            ('upload.error', 'Bad upload id'),
+            ('upload.error', 'Truncated chunk header'),
+            ('upload.error', 'Expected offset 0, got 4'),
+        ])
+        self.assertEqual(self.handlers.sent[-1][2]['offset'], 0)
+
+
+class MessageListTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handlers = RecordingHandlers(self.alice)
+        Message.objects.bulk_create([
+            Message(connection=self.alice_bob, user=self.alice, text=f'message {n}') for n in range(5)
+        ])
+        Message.objects.create(connection=self.alice_carol, user=self.alice, text='elsewhere')
+        self.ids = list(
+            Message.objects.filter(connection=self.alice_bob).order_by('-id').values_list('id', flat=True)
+        )
+
+    def page(self, **data):
+        self.handlers.receive_message_list({'connectionId': self.alice_bob.id, 'pageSize': 2, **data})
+        return self.handlers.sent.pop()
+
+    def scroll(self):
+        pages, cursor = [], None
+        while True:
+            _, source, data = self.page(cursor=cursor)
+            self.assertEqual(source, 'message.list')
+            pages.append([message['id'] for message in data['messages']])
+            cursor = data['next']
+            if cursor is None:
+                return pages
+
+    def test_cursor_pages_newest_first_to_the_end(self):
+        _, _, first = self.page(cursor=None)
+        self.assertEqual([message['id'] for message in first['messages']], self.ids[:2])
+        self.assertEqual(first['connection_id'], self.alice_bob.id)
+        self.assertEqual(self.scroll(), [self.ids[:2], self.ids[2:4], self.ids[4:]])
+
+    def test_equal_timestamps_are_split_by_id(self):
+        Message.objects.filter(connection=self.alice_bob).update(created=timezone.now())
+        self.assertEqual(self.scroll(), [self.ids[:2], self.ids[2:4], self.ids[4:]])
+
+    def test_last_page_has_no_next(self):
+        _, _, data = self.page(cursor=None, pageSize=5)
+        self.assertEqual(len(data['messages']), 5)
+        self.assertIsNone(data['next'])
+
+    def test_bad_cursor_gets_an_error(self):
+        group, source, data = self.page(cursor='not a cursor')
+        self.assertEqual((group, source), (None, 'frame.error'))
+        self.assertEqual(data['source'], 'message.list')
+        self.assertIn('Invalid cursor', data['error'])
+
+
+class ConversationSummaryTests(ChatTestCase):
+    def send(self, connection, text):
+        RecordingHandlers(self.alice).receive_message_send({'connectionId': connection.id, 'message': text})
+        return Message.objects.filter(connection=connection).latest('id')
+
+    def previews(self):
+        handlers = RecordingHandlers(self.alice)
+        handlers.receive_friend_list({})
+        (_, source, friends), = handlers.sent
+        return [(friend['id'], friend['preview'], friend['preview_media']) for friend in friends]
+
+    def test_deleting_the_newest_message_falls_back_to_the_previous_one(self):
+        self.send(self.alice_bob, 'first')
+        self.send(self.alice_carol, 'to carol')
+        newest = self.send(self.alice_bob, 'second')
+        self.assertEqual(self.previews()[0], (self.alice_bob.id, 'second', None))
+
+        handlers = RecordingHandlers(self.alice)
+        handlers.receive_message_delete({'connectionId': self.alice_bob.id, 'messageId': newest.id})
+        self.assertEqual(self.previews(), [
+            (self.alice_carol.id, 'to carol', None),
+            (self.alice_bob.id, 'first', None),
+        ])
+
+        only = Message.objects.get(connection=self.alice_bob)
+        handlers.receive_message_delete({'connectionId': self.alice_bob.id, 'messageId': only.id})
+        self.assertIn((self.alice_bob.id, 'New connection!', None), self.previews())
+
+    def test_backfill_rebuilds_every_summary(self):
+        # bulk_create and update() skip the handlers, like rows from before
+        # the summary existed
+        now = timezone.now()
+        Message.objects.bulk_create([
+            Message(connection=self.alice_bob, user=self.bob, text='older'),
+            Message(connection=self.alice_bob, user=self.alice, image='messages/photo.jpg'),
+            Message(connection=self.alice_carol, user=self.carol, text='hi alice'),
+        ])
+        Message.objects.filter(text='older').update(created=now - timedelta(minutes=2))
+        Message.objects.filter(connection=self.alice_bob, text=None).update(created=now - timedelta(minutes=1))
+        Message.objects.filter(text='hi alice').update(created=now)
+        Connection.objects.filter(id=self.alice_carol.id).update(last_text='stale')
+        empty = Connection.objects.create(sender=self.bob, receiver=self.carol, accepted=True)
+
+        call_command('backfill_conversations', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(self.previews(), [
+            (self.alice_carol.id, 'hi alice', None),
+            (self.alice_bob.id, fast_serializers.MEDIA_PREVIEWS['image'], 'image'),
+        ])
+        empty.refresh_from_db()
+        self.assertEqual((empty.last_message, empty.last_text, empty.last_activity), (None, None, empty.updated))
+
+
+class SeenUpToTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        make = Message.objects.create
+        self.first = make(connection=self.alice_bob, user=self.alice, text='1')
+        self.second = make(connection=self.alice_bob, user=self.alice, text='2')
+        self.reply = make(connection=self.alice_bob, user=self.bob, text='from bob')
+        self.to_carol = make(connection=self.alice_carol, user=self.alice, text='to carol')
+        self.later = make(connection=self.alice_bob, user=self.alice, text='3')
+        self.bob_handlers = RecordingHandlers(self.bob)
+
+    def seen(self, connection, up_to):
+        self.bob_handlers.receive_message_seen({'connectionId': connection.id, 'upToId': up_to.id})
+
+    def seen_ids(self):
+        return set(Message.objects.filter(seen=True).values_list('id', flat=True))
+
+    def test_marks_the_other_sides_messages_up_to_the_id(self):
+        self.seen(self.alice_bob, self.second)
+        self.assertEqual(self.seen_ids(), {self.first.id, self.second.id})
+        self.assertTrue(Message.objects.get(id=self.first.id).delivered)
+        event = {'connection_id': self.alice_bob.id, 'seen_up_to': self.second.id, 'username': 'bob'}
+        self.assertEqual(self.bob_handlers.sent, [
+            ('alice', 'message.seen_up_to', event),
+            ('bob', 'message.seen_up_to', event),
+        ])
+
+    def test_ids_from_other_conversations_are_ignored(self):
+        # upToId from alice_carol only bounds alice_bob's own messages
+        self.seen(self.alice_bob, self.to_carol)
+        self.assertEqual(self.seen_ids(), {self.first.id, self.second.id})
+        # Not bob's conversation: nothing changes, nothing is sent
+        self.bob_handlers.sent.clear()
+        self.seen(self.alice_carol, self.later)
+        self.assertEqual(self.seen_ids(), {self.first.id, self.second.id})
+        self.assertEqual(self.bob_handlers.sent, [])
+
+
+@override_settings(CHAT_TYPING={'WINDOW': 2.5, 'EXPIRY': 6})
+class TypingTests(ChatTestCase):
+    def test_one_event_per_window(self):
+        event = start_typing('alice', 'bob')
+        self.assertEqual((event['username'], event['typing'], event['expires']), ('alice', True, 6))
+        self.assertIsNone(start_typing('alice', 'bob'))
+        # Per pair: another recipient, or the other direction, isn't throttled
+        self.assertIsNotNone(start_typing('alice', 'carol'))
+        self.assertIsNotNone(start_typing('bob', 'alice'))
+        # Sending a message ends typing, so the next keystroke shows again
+        clear_typing('alice', 'bob')
+        self.assertIsNotNone(start_typing('alice', 'bob'))
+
+    def test_stop_only_while_showing(self):
+        self.assertIsNone(stop_typing('alice', 'bob'))
+        start_typing('alice', 'bob')
+        self.assertEqual(stop_typing('alice', 'bob'), {'username': 'alice', 'typing': False})
+        self.assertIsNone(stop_typing('alice', 'bob'))
+        self.assertIsNotNone(start_typing('alice', 'bob'))
+
+    def test_queued_typing_events_go_stale(self):
+        event = start_typing('alice', 'bob')
+        self.assertFalse(is_stale('message.type', event))
+        with mock.patch('chat.typing.time.time', return_value=event['sent'] + 3):
+            self.assertTrue(is_stale('message.type', event))
+            self.assertFalse(is_stale('message.send', event))
+            self.assertFalse(is_stale('message.type', {'username': 'alice', 'typing': False}))
+
+
+class MessageForwardTests(ChatTestCase):
+    def forward(self, ids):
+        handlers = RecordingHandlers(self.alice)
+        handlers.receive_message_forward({
+            'fromConnectionId': self.alice_bob.id,
+            'toConnectionId': self.alice_carol.id,
+            'messageIds': ids,
+        })
+        return handlers.sent
+
+    def make_messages(self, count):
+        return [
+            Message.objects.create(connection=self.alice_bob, user=self.bob, text=f'hi {n}')
+            for n in range(count)
+        ]
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        # target connection, source messages, savepoint, insert,
+        # summary update, release savepoint
+        one = self.make_messages(1)
+        with self.assertNumQueries(6):
+            self.forward([m.id for m in one])
+
+        many = self.make_messages(25)
+        with self.assertNumQueries(6):
+            self.forward([m.id for m in many])
+
+    def test_copies_in_request_order_with_one_event_per_participant(self):
+        user_connected('carol')
+        first, second, third = self.make_messages(3)
+        sent = self.forward([third.id, first.id, 999999, second.id])
+
+        copies = list(Message.objects.filter(connection=self.alice_carol).order_by('id'))
+        self.assertEqual([m.text for m in copies], ['hi 2', 'hi 0', 'hi 1'])
+        self.assertTrue(all(m.user == self.alice for m in copies))
+
+        self.assertEqual([(group, source) for group, source, _ in sent], [
+            ('alice', 'message.send_batch'),
+            ('carol', 'message.send_batch'),
+        ])
+        alice_event, carol_event = sent[0][2], sent[1][2]
+        self.assertEqual([m['id'] for m in alice_event['messages']], [m.id for m in copies])
+        self.assertTrue(all(m['is_me'] for m in alice_event['messages']))
+        self.assertFalse(any(m['is_me'] for m in carol_event['messages']))
+        self.assertEqual(alice_event['friend']['username'], 'carol')
+        self.assertEqual(carol_event['friend']['username'], 'alice')
+
+        self.alice_carol.refresh_from_db()
+        self.assertEqual(self.alice_carol.last_message_id, copies[-1].id)
+
+
+class SearchTests(ChatTestCase):
+    def search(self, query, user=None):
+        handlers = RecordingHandlers(user or self.alice)
+        handlers.receive_search({'query': query})
+        (group, source, data), = handlers.sent
+        return data
+
+    def test_prefix_match_on_any_name_ranked_and_excluding_self(self):
+        User.objects.create(username='bobby', first_name='robert', last_name='smith')
+        User.objects.create(username='zed', first_name='bo', last_name='jones')
+        results = self.search('BO')
+        self.assertEqual([r['username'] for r in results], ['bob', 'bobby', 'zed'])
+        self.assertEqual(results[0]['status'], 'connected')
+        self.assertEqual(results[1]['status'], 'no-connection')
+
+        self.assertEqual([r['username'] for r in self.search('bob')], ['bob', 'bobby'])
+        self.assertEqual(self.search('alice'), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_results_are_capped(self):
+        for n in range(30):
+            User.objects.create(username=f'dave{n}', first_name='dave', last_name='d')
+        with self.settings(SEARCH_RESULT_LIMIT=5):
+            self.assertEqual(len(self.search('dave')), 5)
+
+
+
+class FastSerializerParityTests(ChatTestCase):
+    '''
+    fast_serializers must encode to exactly the same bytes as the DRF
+    serializers it replaces on the socket.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def assertSameBytes(self, drf, fast):
+        self.assertEqual(json.dumps(drf), json.dumps(fast))
+
+    def test_users(self):
+        self.alice.thumbnail.save('alice.png', ContentFile(b'png'), save=False)
+        self.alice.thumbnail_small.save('alice-small.png', ContentFile(b'png'), save=True)
+        for user in (self.alice, self.bob):
+            self.assertSameBytes(UserSerializer(user).data, fast_serializers.user_data(user))
+
+    def test_search(self):
+        Connection.objects.create(sender=self.bob, receiver=self.carol)
+        users = User.objects.annotate(
+            pending_them=Exists(Connection.objects.filter(
+                sender=self.bob, receiver=OuterRef('id'), accepted=False)),
+            pending_me=Exists(Connection.objects.filter(
+                sender=OuterRef('id'), receiver=self.bob, accepted=False)),
+            connected=Exists(Connection.objects.filter(
+                Q(sender=self.bob, receiver=OuterRef('id')) |
+                Q(receiver=self.bob, sender=OuterRef('id')), accepted=True)),
+        ).order_by('id')
+        self.assertSameBytes(
+            SearchSerializer(users, many=True).data,
+            [fast_serializers.search_data(user) for user in users]
+        )
+
+    def test_connections(self):
+        Message.objects.create(connection=self.alice_bob, user=self.bob, text='hello')
+        self.alice_bob.set_last_message(Message.objects.create(
+            connection=self.alice_bob, user=self.bob, image=ContentFile(b'jpg', name='a.jpg')
+        ))
+        for connection in (self.alice_bob, self.alice_carol):
+            self.assertSameBytes(
+                RequestSerializer(connection).data,
+                fast_serializers.request_data(connection)
+            )
+            for user in (connection.sender, connection.receiver):
+                self.assertSameBytes(
+                    FriendSerializer(connection, context={'user': user}).data,
+                    fast_serializers.friend_data(connection, user)
+                )
+
+    def test_messages(self):
+        plain = Message.objects.create(connection=self.alice_bob, user=self.alice, text='hi')
+        media = Message.objects.create(
+            connection=self.alice_bob, user=self.bob, waveform=[0.1, 0.5],
+            video_duration=12, video_width=1080, video_height=1920, processing=True, seen=True
+        )
+        media.image.save('pic.jpg', ContentFile(b'jpg'), save=False)
+        media.voice.save('note.m4a', ContentFile(b'm4a'), save=False)
+        media.video.save('clip.mp4', ContentFile(b'mp4'), save=False)
+        media.video_thumbnail.save('thumb.jpg', ContentFile(b'jpg'), save=False)
+        media.image_variants = {'320': 'blobs/aa/small.webp'}
+        media.image_width, media.image_height = 1280, 960
+        media.image_placeholder = 'data:image/webp;base64,AAAA'
+        media.save()
+
+        for message in Message.objects.filter(id__in=[plain.id, media.id]):
+            for user in (self.alice, self.bob, None):
+                self.assertSameBytes(
+                    MessageSerializer(message, context={'user': user}).data,
+                    fast_serializers.message_data(message, user)
+                )
+
+
+class EventTests(ChatTestCase):
+    '''
+    Per-recipient views built by events.py must match serializing the
+    event separately for each participant.
+    '''
+
+    def test_message_send_views(self):
+        user_connected('alice')
+        handlers = RecordingHandlers(self.bob)
+        handlers.receive_message_send({'connectionId': self.alice_bob.id, 'message': 'hey'})
+        message = Message.objects.get(connection=self.alice_bob)
+
+        self.assertEqual(handlers.sent, [
+            ('bob', 'message.send', {
+                'message': fast_serializers.message_data(message, self.bob),
+                'friend': fast_serializers.user_data(self.alice),
+                'connection_id': self.alice_bob.id,
+            }),
+            ('alice', 'message.send', {
+                'message': fast_serializers.message_data(message, self.alice),
+                'friend': fast_serializers.user_data(self.bob),
+                'connection_id': self.alice_bob.id,
+            }),
+        ])
+
+    def test_request_accept_views(self):
+        pending = Connection.objects.create(sender=self.bob, receiver=self.carol)
+        handlers = RecordingHandlers(self.carol)
+        handlers.receive_request_accept({'username': 'bob'})
+        pending.refresh_from_db()
+
+        request = fast_serializers.request_data(pending)
+        self.assertEqual(handlers.sent, [
+            ('bob', 'request.accept', request),
+            ('carol', 'request.accept', request),
+            ('bob', 'friend.new', fast_serializers.friend_data(pending, self.bob)),
+            ('carol', 'friend.new', fast_serializers.friend_data(pending, self.carol)),
+        ])
+
+
+class InstrumentationTests(ChatTestCase):
+    def test_redact_hides_media_and_truncates(self):
+        frame = {
+            'source': 'message.send',
+            'connectionId': 3,
+            'message': 'x' * 500,
+            'video': 'A' * 10000,
+            'video_filename': 'clip.mp4',
+            'messageIds': list(range(50)),
+        }
+        logged = redact(frame)
+        self.assertEqual(logged['video'], '<redacted 10000>')
+        self.assertEqual(logged['video_filename'], 'clip.mp4')
+        self.assertEqual(logged['connectionId'], 3)
+        self.assertTrue(logged['message'].endswith('(500 chars)'))
+        self.assertLess(len(logged['message']), 250)
+        self.assertEqual(len(logged['messageIds']), 21)
+
+    @override_settings(CHAT_TIMING={'LOG_INTERVAL': 0})
+    def test_frames_are_timed_per_source_and_phase(self):
+        handler_stats.reset()
+        handlers = RecordingHandlers(self.alice)
+        handlers.handle_frame('friend.list', handlers.dispatch_source, {'source': 'friend.list'})
+        handlers.timing.finish()
+        handlers.handle_frame('nope', handlers.dispatch_source, {'source': 'nope'})
+        handlers.timing.finish()
+
+        stats = handler_stats.snapshot()
+        self.assertEqual(set(stats), {'friend.list', 'unknown'})
+        self.assertEqual(set(stats['friend.list']), {'db', 'serialize', 'send'})
+        self.assertEqual(stats['friend.list']['db']['count'], 1)
+        self.assertGreater(stats['friend.list']['db']['max'], 0)
+        self.assertEqual(stats['unknown']['db']['max'], 0)
+
+
+class MetricsTests(ChatTestCase):
+    @override_settings(CHAT_TIMING={'LOG_INTERVAL': 0})
+    def test_scrape(self):
+        metrics.counters.reset()
+        handlers = RecordingHandlers(self.alice)
+        for _ in range(2):
+            handlers.handle_frame('friend.list', handlers.dispatch_source, {'source': 'friend.list'})
+            handlers.timing.finish()
+        metrics.frame_received('{"source": "friend.list"}')
+        metrics.frame_received('é')
+        metrics.group_sent(0.003)
+        metrics.socket_opened()
+
+        response = self.client.get('/chat/metrics/')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('chat_sockets_open 1\n', body)
+        self.assertIn('chat_frames_received_total{source="friend.list"} 2\n', body)
+        self.assertIn('chat_db_queries_total{source="friend.list"} 2\n', body)
+        self.assertIn('chat_frame_bytes_received_total 27\n', body)
+        self.assertIn('# TYPE chat_handler_latency_seconds summary\n', body)
+        self.assertIn('chat_handler_latency_seconds{source="friend.list",phase="db",quantile="0.5"}', body)
+        self.assertIn('chat_group_send_seconds_bucket{le="0.0025"} 0\n', body)
+        self.assertIn('chat_group_send_seconds_bucket{le="0.005"} 1\n', body)
+        self.assertIn('chat_group_send_seconds_count 1\n', body)
+        self.assertIn('chat_media_queue_depth 0\n', body)
+
+    @override_settings(METRICS_ALLOWED_IPS=[])
+    def test_scrape_is_restricted(self):
+        self.assertEqual(self.client.get('/chat/metrics/').status_code, 403)
+
+
+class LoadtestArgumentTests(TestCase):
+    def parse(self, *args):
+        return loadtest.Command().create_parser('manage.py', 'loadtest').parse_args(args)
+
+    def test_defaults_and_scenarios(self):
+        options = self.parse()
+        self.assertEqual(options.scenario, loadtest.SCENARIOS)
+        self.assertEqual((options.clients, options.rounds, options.redis), (1000, 3, None))
+        options = self.parse('--clients', '50', '--scenario', 'send', 'search', '--think', '0')
+        self.assertEqual((options.clients, options.scenario, options.think), (50, ['send', 'search'], 0.0))
+
+    def test_bad_arguments_are_refused_before_seeding(self):
+        for args in (['--scenario', 'dance'], ['--clients', 'many']):
+            with self.assertRaises(CommandError):
+                call_command('loadtest', *args)
+        self.assertFalse(User.objects.exists())
+
+    def test_redis_address(self):
+        layers = loadtest.redis_layers('cache.local:6380')
+        self.assertEqual(layers['default']['CONFIG']['hosts'], [('cache.local', 6380)])
+        self.assertEqual(loadtest.redis_presence('cache.local')['REDIS_URL'], 'redis://cache.local:6379/0')
+        self.assertEqual(loadtest.redis_caches('cache.local')['default']['LOCATION'], 'redis://cache.local:6379/1')
+
+
+class MergeDuplicateConnectionsMigrationTests(TransactionTestCase):
+    '''0014 folds duplicate (sender, receiver) rows into the oldest one.'''
+
+    before = [('chat', '0013_search_term')]
+    after = [('chat', '0014_connection_lookup_indexes')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_messages_move_to_the_oldest_connection(self):
+        apps = self.executor.loader.project_state(self.before).apps
+        User = apps.get_model('chat', 'User')
+        Connection = apps.get_model('chat', 'Connection')
+        Message = apps.get_model('chat', 'Message')
+        alice = User.objects.create(username='alice')
+        bob = User.objects.create(username='bob')
+        oldest = Connection.objects.create(sender=alice, receiver=bob)
+        accepted = Connection.objects.create(sender=alice, receiver=bob, accepted=True)
+        third = Connection.objects.create(sender=alice, receiver=bob)
+        reverse = Connection.objects.create(sender=bob, receiver=alice, accepted=True)
+        now = timezone.now()
+        messages = {}
+        sent = [(accepted, 'hi'), (oldest, 'hello'), (third, 'latest'), (reverse, 'other')]
+        for minutes, (conn, text) in enumerate(sent):
+            messages[text] = Message.objects.create(connection=conn, user=alice, text=text).id
+            Message.objects.filter(id=messages[text]).update(created=now + timedelta(minutes=minutes))
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        Connection = apps.get_model('chat', 'Connection')
+        Message = apps.get_model('chat', 'Message')
+
+        merged = Connection.objects.get(sender=alice.id, receiver=bob.id)
+        self.assertEqual(merged.id, oldest.id)
+        self.assertTrue(merged.accepted)
+        self.assertEqual(
+            set(Message.objects.filter(connection=merged).values_list('text', flat=True)),
+            {'hi', 'hello', 'latest'}
+        )
+        self.assertEqual((merged.last_message_id, merged.last_text), (messages['latest'], 'latest'))
+        # The other direction is a different connection and is left alone
+        self.assertEqual(Connection.objects.get(id=reverse.id).sender_id, bob.id)
+        self.assertEqual(Message.objects.get(id=messages['other']).connection_id, reverse.id)
+        self.assertEqual(Connection.objects.count(), 2)
+
+
+class PresenceTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = MemoryPresenceStore()
+        self.sent = []
+        self.notifier = PresenceNotifier(
+            self.store, debounce=0, send=lambda *event: self.sent.append(event)
+        )
+
+    def connect(self, username):
+        if self.store.incr(username) == 1:
+            self.notifier.changed(username, False)
+
+    def disconnect(self, username):
+        if self.store.decr(username) == 0:
+            self.notifier.changed(username, True)
+
+    def test_refcounted_per_socket_and_sent_to_online_friends(self):
+        self.connect('bob')     # carol is offline, so bob's friend alice only
+        self.connect('alice')
+        self.assertEqual(self.sent, [
+            ('bob', 'presence', {'users': [{'username': 'alice', 'online': True}]}),
+        ])
+
+        self.sent.clear()
+        self.connect('alice')   # second device
+        self.disconnect('alice')
+        self.assertEqual(self.sent, [])
+        self.disconnect('alice')
+        self.assertEqual(self.sent, [
+            ('bob', 'presence', {'users': [{'username': 'alice', 'online': False}]}),
+        ])
+
+    def test_debounced_flaps_cancel_and_changes_batch(self):
+        self.connect('alice')
+        self.connect('carol')
+        self.notifier.debounce = 60     # flush by hand
+        self.disconnect('alice')
+        self.connect('alice')       # reconnect inside the window
+        self.connect('bob')
+        self.disconnect('carol')
+        self.notifier.timer.cancel()
+        self.notifier.flush()
+
+        self.assertEqual(self.sent[-1:], [
+            ('alice', 'presence', {'users': [
+                {'username': 'bob', 'online': True},
+                {'username': 'carol', 'online': False},
+            ]}),
+        ])
+
+    def test_friend_list_has_presence_snapshot(self):
+        from .presence import user_connected
+
+        user_connected('carol')
+        handlers = RecordingHandlers(self.alice)
+        handlers.receive_friend_list({})
+        (_, _, friends), = handlers.sent
+        self.assertEqual(
+            {item['friend']['username']: item['online'] for item in friends},
+            {'bob': False, 'carol': True}
+        )
+
+
+class DeliveryTests(ChatTestCase):
+    def send(self, user, connection, text):
+        handlers = RecordingHandlers(user)
+        handlers.receive_message_send({'connectionId': connection.id, 'message': text})
+        return handlers.sent
+
+    def test_offline_recipient_gets_one_outbox_push(self):
+        sent = self.send(self.alice, self.alice_bob, 'one')
+        self.send(self.alice, self.alice_bob, 'two')
+        self.send(self.carol, self.alice_carol, 'three')
+        # bob is offline: only alice's own copy went out
+        self.assertEqual([group for group, _, _ in sent], ['alice'])
+        self.assertFalse(Message.objects.filter(delivered=True).exists())
+
+        handlers = RecordingHandlers(self.bob)
+        handlers.drain_outbox(None)
+        (group, source, outbox), = handlers.sent
+        self.assertEqual((group, source, outbox['more']), (None, 'message.outbox', False))
+        batch, = outbox['batches']
+        self.assertEqual(batch['connection_id'], self.alice_bob.id)
+        self.assertEqual(batch['friend']['username'], 'alice')
+        self.assertEqual([m['text'] for m in batch['messages']], ['one', 'two'])
+        self.assertFalse(any(m['is_me'] for m in batch['messages']))
+
+        with self.settings(OUTBOX_LIMIT=1):
+            handlers = RecordingHandlers(self.bob)
+            handlers.drain_outbox(None)
+            (_, _, outbox), = handlers.sent
+            self.assertEqual([m['text'] for m in outbox['batches'][0]['messages']], ['one'])
+            self.assertTrue(outbox['more'])
+
+    def test_acks_mark_delivered_and_notify_author(self):
+        self.send(self.alice, self.alice_bob, 'one')
+        self.send(self.alice, self.alice_bob, 'two')
+        self.send(self.bob, self.alice_bob, 'mine')
+        ids = list(Message.objects.order_by('id').values_list('id', flat=True))
+
+        handlers = RecordingHandlers(self.bob)
+        handlers.receive_message_delivered({'messageIds': ids + ['x']})
+        self.assertEqual(handlers.sent, [
+            ('alice', 'message.delivered', {'connection_id': self.alice_bob.id, 'messageIds': ids[:2]}),
+        ])
+        # bob can't ack his own message, and acks are not repeated
+        self.assertEqual(
+            list(Message.objects.order_by('id').values_list('delivered', flat=True)),
+            [True, True, False]
+        )
+        handlers.sent.clear()
+        handlers.receive_message_delivered({'messageIds': ids})
+        self.assertEqual(handlers.sent, [])
+
+        handlers = RecordingHandlers(self.bob)
+        handlers.drain_outbox(None)
+        self.assertEqual(handlers.sent, [])
+
+
+@override_settings(CHAT_SYNC={'OVERLAP': 0, 'BATCH_SIZE': 2, 'MAX_MESSAGES': 5})
+class SyncTests(ChatTestCase):
+    def sync(self, user, cursor):
+        handlers = RecordingHandlers(user)
+        handlers.receive_sync_since({'cursor': cursor})
+        self.assertTrue(all(group is None and source == 'sync.since' for group, source, _ in handlers.sent))
+        return [frame for _, _, frame in handlers.sent]
+
+    def test_no_or_bad_cursor_resets(self):
+        for cursor in (None, 'yesterday', '2000-01-01T00:00:00+00:00'):
+            frame, = self.sync(self.bob, cursor)
+            self.assertTrue(frame['reset'])
+            self.assertTrue(frame['done'])
+
+    def test_only_changes_since_cursor(self):
+        old = Message.objects.create(connection=self.alice_bob, user=self.alice, text='old')
+        gone = Message.objects.create(connection=self.alice_bob, user=self.alice, text='gone')
+        Message.objects.create(connection=self.alice_carol, user=self.alice, text='not mine')
+        frame, = self.sync(self.bob, None)
+        cursor = frame['cursor']
+
+        RecordingHandlers(self.bob).receive_message_seen({'messageId': old.id})
+        RecordingHandlers(self.alice).receive_message_delete(
+            {'connectionId': self.alice_bob.id, 'messageId': gone.id}
+        )
+        RecordingHandlers(self.alice).receive_message_send({'connectionId': self.alice_bob.id, 'message': 'new'})
+        Connection.objects.create(sender=self.carol, receiver=self.bob)
+        self.alice.first_name = 'alicia'
+        self.alice.save()
+
+        with self.assertNumQueries(6):
+            frame, = self.sync(self.bob, cursor)
+        self.assertEqual((frame['reset'], frame['done']), (False, True))
+        batch, = frame['batches']
+        self.assertEqual(
+            [(m['text'], m['seen']) for m in batch['messages']],
+            [('old', True), ('new', False)]
+        )
+        self.assertEqual(frame['deleted'], [{'messageId': gone.id, 'connection_id': self.alice_bob.id}])
+        self.assertEqual([r['sender']['username'] for r in frame['requests']], ['carol'])
+        self.assertEqual([c['friend']['username'] for c in frame['connections']], ['alice'])
+        self.assertEqual([u['name'] for u in frame['users']], ['Alicia A'])
+
+        frame, = self.sync(self.bob, frame['cursor'])
+        self.assertEqual((frame['batches'], frame['deleted'], frame['connections']), ([], [], []))
+
+    def test_batched_then_reset_past_the_cap(self):
+        frame, = self.sync(self.bob, None)
+        for n in range(3):
+            Message.objects.create(connection=self.alice_bob, user=self.alice, text=f'{n}')
+        frames = self.sync(self.bob, frame['cursor'])
+        self.assertEqual([f['done'] for f in frames], [False, True])
+        self.assertEqual([len(f['batches'][0]['messages']) for f in frames], [2, 1])
+        self.assertIn('connections', frames[0])
+
+        for n in range(3):
+            Message.objects.create(connection=self.alice_bob, user=self.alice, text=f'{n}')
+        frame, = self.sync(self.bob, frame['cursor'])
+        self.assertTrue(frame['reset'])
+
+
+class ProtocolTests(ChatTestCase):
+    def dispatch(self, frame):
+        handlers = RecordingHandlers(self.alice)
+        handlers.dispatch_source(frame)
+        return handlers.sent
+
+    def test_frames_are_checked_against_the_handler_schema(self):
+        cases = [
+            ({'source': 'message.list', 'connectionId': '6'}, 'connectionId: expected int'),
+            ({'source': 'message.list', 'connectionId': True}, 'connectionId: expected int'),
+            ({'source': 'message.list'}, 'connectionId: required'),
+            ({'source': 'message.type', 'username': None}, 'username: must not be null'),
+            ({'source': 'message.delivered', 'messageIds': [1, 'x']}, 'messageIds: expected a list of int'),
+        ]
+        for frame, error in cases:
+            self.assertEqual(self.dispatch(frame), [
+                (None, 'frame.error', {'source': frame['source'], 'error': error}),
+            ])
+        self.assertEqual(self.dispatch({'source': 'no.such.source'}), [])
+
+    def test_valid_frames_reach_their_handler(self):
+        (_, source, data), = self.dispatch({
+            'source': 'message.list', 'connectionId': self.alice_bob.id, 'page': None, 'extra': 1
+        })
+        self.assertEqual((source, data['connection_id']), ('message.list', self.alice_bob.id))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class WireFormatTests(ChatTestCase):
+    async def connect(self, subprotocols):
+        # The sync consumer runs on the test's thread, so it shares its
+        # database connection (the async one queries from worker threads)
+        from .consumers import ChatConsumers
+
+        application = ScopeUser(ChatConsumers.as_asgi(), self.alice)
+        communicator = WebsocketCommunicator(application, '/chat/', subprotocols=subprotocols)
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, subprotocol
+
+    async def test_msgpack_negotiated_both_ways(self):
+        communicator, subprotocol = await self.connect(['chat.msgpack', 'chat.json'])
+        self.assertEqual(subprotocol, 'chat.msgpack')
+        await communicator.send_to(bytes_data=msgpack.packb({'source': 'request.list'}))
+        frame = msgpack.unpackb(await communicator.receive_from())
+        self.assertEqual(frame, {'source': 'request.list', 'data': []})
+
+        # Text is not a frame on a msgpack socket; the socket stays usable
+        await communicator.send_to(text_data='{"source": "request.list"}')
+        await communicator.send_to(bytes_data=msgpack.packb(
+            {'source': 'upload.chunk', 'uploadId': 'x', 'offset': 0, 'data': b'1'}
+        ))
+        frame = msgpack.unpackb(await communicator.receive_from())
+        self.assertEqual(frame['data']['error'], 'Unknown upload x')
+        await communicator.disconnect()
+
+    async def test_json_without_subprotocol(self):
+        communicator, subprotocol = await self.connect([])
+        self.assertIsNone(subprotocol)
+        await communicator.send_to(text_data=json.dumps({'source': 'request.list'}))
+        self.assertEqual(json.loads(await communicator.receive_from()), {'source': 'request.list', 'data': []})
+        await communicator.disconnect()
+
+
+@override_settings(CHAT_COMPRESSION={'MIN_SIZE': 200, 'MAX_CONTEXTS': 1})
+class CompressionTests(TestCase):
+    def test_large_frames_deflated_with_context_takeover(self):
+        codec, subprotocol = negotiate(['chat.json+deflate', 'chat.json'])
+        self.addCleanup(codec.close)
+        self.assertEqual(subprotocol, 'chat.json+deflate')
+
+        small = {'source': 'message.type', 'data': {'username': 'bob'}}
+        self.assertEqual(codec.encode(small), {'text_data': fast_serializers.dumps(small)})
+
+        inflater = zlib.decompressobj(-12)
+        frame = {'source': 'friend.list', 'data': [{'id': n, 'friend': {'username': f'user{n}'}} for n in range(20)]}
+        sizes = []
+        for _ in range(2):
+            envelope = codec.encode(frame)['bytes_data']
+            self.assertEqual(envelope[:1], b'\x01')
+            self.assertEqual(json.loads(inflater.decompress(envelope[1:] + b'\x00\x00\xff\xff')), frame)
+            sizes.append(len(envelope))
+        # The second copy compresses against the first
+        self.assertLess(sizes[1], sizes[0] / 4)
+
+    def test_contexts_are_capped_per_process(self):
+        codec, _ = negotiate(['chat.msgpack+deflate'])
+        self.assertEqual(negotiate(['chat.json+deflate', 'chat.json'])[1], 'chat.json')
+        codec.close()
+        codec.close()
+        codec, subprotocol = negotiate(['chat.json+deflate', 'chat.json'])
+        self.assertEqual(subprotocol, 'chat.json+deflate')
+        codec.close()
+
+
+class BlobStoreTests(ChatTestCase):
+    '''Message media is stored once per content and freed with its last reference.'''
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def send_image(self, content, user=None):
+        handlers = RecordingHandlers(user or self.alice)
+        handlers.defer = lambda func, *args: None   # no image jobs: the upload stays
+        handlers.receive_message_send({
+            'connectionId': self.alice_bob.id,
+            'message': None,
+            'image': base64.b64encode(content).decode(),
+            'image_filename': 'photo.JPG',
+        })
+        return Message.objects.filter(connection=self.alice_bob).latest('id')
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.send_image(b'same bytes')
+        second = self.send_image(b'same bytes', user=self.bob)
+        other = self.send_image(b'other bytes')
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertTrue(first.image.name.startswith('blobs/') and first.image.name.endswith('.jpg'))
+        blob = Blob.objects.get(file=first.image.name)
+        self.assertEqual((blob.refs, blob.size), (2, len(b'same bytes')))
+        self.assertEqual(Blob.objects.count(), 2)
+
+    def test_deleting_a_forwarded_copy_keeps_the_original(self):
+        original = self.send_image(b'jpg')
+        RecordingHandlers(self.alice).receive_message_forward({
+            'fromConnectionId': self.alice_bob.id,
+            'toConnectionId': self.alice_carol.id,
+            'messageIds': [original.id, original.id],
+        })
+        copies = list(Message.objects.filter(connection=self.alice_carol))
+        self.assertEqual(Blob.objects.get().refs, 3)
+
+        for copy in copies:
+            copy.delete()
+        self.assertEqual(Blob.objects.get().refs, 1)
+        self.assertTrue(default_storage.exists(original.image.name))
+
+        # Files go once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            original.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(original.image.name))
+
+    def test_duplicate_chunked_upload_is_dropped(self):
+        self.send_image(b'chunked')
+        upload = ChunkedUpload('photo.jpg', 7)
+        upload.write(0, memoryview(b'chunked'))
+
+        name = store(upload.as_file())
+        self.assertEqual(Blob.objects.get(file=name).refs, 2)
+        self.assertFalse(os.path.exists(upload.path))
+
+    def test_voice_job_waits_for_commit(self):
+        with mock.patch('chat.signals.enqueue_media_job') as enqueue:
+            with self.captureOnCommitCallbacks() as callbacks:
+                message = Message.objects.create(
+                    connection=self.alice_bob, user=self.alice, voice=ContentFile(b'ogg', name='note.ogg')
+                )
+                enqueue.assert_not_called()
+            for callback in callbacks:
+                callback()
+        enqueue.assert_called_once_with('voice', message, message.voice.path)
+        stored = Message.objects.get(id=message.id)
+        self.assertTrue(stored.processing)
+        self.assertGreater(stored.updated, message.updated)
+
+    def test_files_from_before_the_store_are_kept_while_referenced(self):
+        first = Message.objects.create(
+            connection=self.alice_bob, user=self.alice, image=ContentFile(b'old', name='old.jpg')
+        )
+        second = Message.objects.create(connection=self.alice_bob, user=self.alice, image=first.image.name)
+        self.assertTrue(first.image.name.startswith('messages/'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(second.image.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(second.image.name))
+
+
+def photo(width, height, orientation=None):
+    '''A JPEG with camera EXIF: GPS, and an orientation tag when given.'''
+    exif = Image.Exif()
+    exif[0x010f] = 'PhoneMaker'
+    exif[0x8825] = {1: 'N', 2: (51.0, 30.0, 0.0)}
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+@override_settings(
+    MEDIA_JOBS={'BACKEND': 'local'},
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    CHAT_IMAGES={'WIDTHS': [320, 720], 'FULL_MAX': 1000, 'QUALITY': 80, 'PLACEHOLDER': 16},
+)
+class ImagePipelineTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def test_variants_are_oriented_and_stripped(self):
+        path = os.path.join(self.media_root, 'upload.jpg')
+        with open(path, 'wb') as fh:
+            fh.write(photo(1600, 1200, orientation=6))   # rotated 90 degrees
+
+        result = process_image(path)
+        self.assertEqual((result['width'], result['height']), (750, 1000))
+        self.assertEqual(sorted(result['variants']), ['320', '720', 'full'])
+        for key, (name, data) in result['variants'].items():
+            with Image.open(io.BytesIO(data)) as variant:
+                self.assertEqual(variant.format, 'WEBP')
+                self.assertNotIn('exif', variant.info)
+                self.assertEqual(max(variant.size), 1000 if key == 'full' else int(key))
+                self.assertLess(variant.width, variant.height)
+        self.assertTrue(result['placeholder'].startswith('data:image/webp;base64,'))
+        self.assertLess(len(result['placeholder']), 400)
+
+    def test_small_images_skip_larger_variants(self):
+        path = os.path.join(self.media_root, 'small.jpg')
+        with open(path, 'wb') as fh:
+            fh.write(photo(500, 400))
+        self.assertEqual(sorted(process_image(path)['variants']), ['320', 'full'])
+
+    def test_message_send_serves_variants_after_the_job(self):
+        handlers = RecordingHandlers(self.alice)
+        handlers.receive_message_send({
+            'connectionId': self.alice_bob.id,
+            'message': None,
+            'image': base64.b64encode(photo(1600, 1200)).decode(),
+            'image_filename': 'photo.jpg',
+        })
+        sent = handlers.sent[0][2]['message']
+        self.assertTrue(sent['processing'])
+        self.assertIsNone(sent['image_variants'])
+
+        message = Message.objects.get(connection=self.alice_bob)
+        self.assertFalse(message.processing)
+        self.assertTrue(message.image.name.endswith('.webp'))
+        self.assertEqual((message.image_width, message.image_height), (1000, 750))
+        data = fast_serializers.message_data(message, self.alice)
+        self.assertEqual(sorted(data['image_variants']), ['320', '720', 'full'])
+        self.assertEqual(data['image_variants']['full'], data['image'])
+        # The upload (with its EXIF) is released; variants are referenced once
+        self.assertEqual(
+            sorted(Blob.objects.values_list('refs', flat=True)), [1, 1, 1]
+        )
+        self.assertEqual(set(Blob.objects.values_list('file', flat=True)), set(message.media_names()))
+
+
+class AvatarTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self, content):
+        handlers = RecordingHandlers(self.alice)
+        handlers.receive_thumbnail({'base64': base64.b64encode(content).decode(), 'filename': 'me.jpg'})
+        self.alice.refresh_from_db()
+        return handlers.sent
+
+    def test_resized_to_squares_under_versioned_names(self):
+        sent = self.upload(photo(900, 600, orientation=6))
+        for field, side in ((self.alice.thumbnail, 512), (self.alice.thumbnail_small, 128)):
+            self.assertRegex(field.name, r'^avatars/alice/[0-9a-f]{16}-(large|small)\.webp$')
+            with Image.open(field.path) as image:
+                self.assertEqual(image.size, (side, side))
+                self.assertNotIn('exif', image.info)
+        self.assertEqual(sent, [('alice', 'thumbnail', fast_serializers.user_data(self.alice))])
+        self.assertTrue(sent[0][2]['thumbnail_small'].endswith('-small.webp'))
+
+    def test_new_avatar_replaces_old_files(self):
+        self.upload(photo(300, 300))
+        first = self.alice.thumbnail.path
+        self.upload(photo(300, 300))    # same picture: same names
+        self.assertEqual(self.alice.thumbnail.path, first)
+
+        self.upload(photo(640, 480))
+        self.assertNotEqual(self.alice.thumbnail.path, first)
+        self.assertFalse(os.path.exists(first))
+        # Smaller than LARGE: not upscaled
+        self.assertEqual(self.alice.thumbnail.width, 480)
+
+    def test_not_an_image(self):
+        sent = self.upload(b'not an image')
+        self.assertEqual(sent[0][:2], (None, 'frame.error'))
+        self.assertFalse(self.alice.thumbnail)
+
+    def test_versioned_media_is_cached_for_good(self):
+        os.makedirs(os.path.join(self.media_root, 'thumbnails'))
+        for name in ('avatars', 'blobs'):
+            os.makedirs(os.path.join(self.media_root, name, 'x'))
+        for path in ('avatars/x/1-small.webp', 'blobs/x/ab.jpg', 'thumbnails/alice.png'):
+            with open(os.path.join(self.media_root, path), 'wb') as fh:
+                fh.write(b'data')
+        request = RequestFactory().get('/media/')
+        self.assertIn('immutable', media_view(request, 'avatars/x/1-small.webp')['Cache-Control'])
+        self.assertIn('immutable', media_view(request, 'blobs/x/ab.jpg')['Cache-Control'])
+        self.assertEqual(media_view(request, 'thumbnails/alice.png')['Cache-Control'], 'no-cache')
+
+
+class WaveformTests(TestCase):
+    '''waveform.py must reproduce the audiowaveform values stored before it.'''
+    sample = settings.BASE_DIR / 'media' / 'messages' / '6' / '108'
+
+    def test_matches_audiowaveform(self):
+        with open(self.sample.with_suffix('.json')) as fh:
+            expected = json.load(fh)
+        self.assertEqual(expected['samples_per_pixel'], 4410)
+        self.assertEqual(
+            compute_waveform(self.sample.with_suffix('.wav')),
+            [round(value / 255, 2) for value in expected['data']]
+        )
+
+    def test_chunking_does_not_change_buckets(self):
+        samples = np.random.default_rng(1).integers(-32768, 32767, 10_000, dtype=np.int16)
+        ragged = [samples[:7], samples[7:3000], samples[3000:3001], samples[3001:]]
+        whole = peaks([samples], 441)
+        for got, want in zip(peaks(ragged, 441), whole):
+            np.testing.assert_array_equal(got, want)
+        self.assertEqual(len(whole[0]), 23)    # 22 full buckets + the rest
+
+    @skipUnless(shutil.which('ffmpeg'), 'ffmpeg not installed')
+    def test_compressed_audio_is_piped_through_ffmpeg(self):
+        waveform = compute_waveform(self.sample.with_suffix('.m4a'))
+        reference = compute_waveform(self.sample.with_suffix('.wav'))
+        self.assertEqual(len(waveform), len(reference))
+
+
+PHONE_CLIP_STDERR = """\
+Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'clip.mp4':
+  Metadata:
+    major_brand     : isom
+  Duration: 00:01:02.48, start: 0.000000, bitrate: 2318 kb/s
+  Stream #0:0[0x1](und): Video: h264 (High) (avc1 / 0x31637661), yuv420p(tv, bt709, progressive), 1920x1080 [SAR 1:1 DAR 16:9], 2190 kb/s, 29.97 fps, 29.97 tbr, 90k tbn (default)
+      Side data:
+        displaymatrix: rotation of -90.00 degrees
+  Stream #0:1[0x2](und): Audio: aac (LC) (mp4a / 0x6134706D), 44100 Hz, mono, fltp, 96 kb/s (default)
+Stream mapping:
+  Stream #0:0 -> #0:0 (h264 (native) -> mjpeg (native))
+Output #0, image2pipe, to 'pipe:':
+  Stream #0:0(und): Video: mjpeg, yuvj420p(pc, progressive), 320x240, q=2-31, 200 kb/s
+"""
+
+
+class VideoProbeTests(TestCase):
+    def test_parses_the_input_section(self):
+        self.assertEqual(parse_probe(PHONE_CLIP_STDERR), {
+            'duration': 62.48, 'width': 1080, 'height': 1920, 'codec': 'h264',
+        })
+
+    def test_audio_only_and_garbage(self):
+        audio = PHONE_CLIP_STDERR.replace('Video: h264', 'Data: bin_data')
+        self.assertEqual(parse_probe(audio)['width'], None)
+        self.assertEqual(parse_probe('clip.mp4: Invalid data found when processing input'), {
+            'duration': None, 'width': None, 'height': None, 'codec': None,
+        })
+
+    @skipUnless(shutil.which('ffmpeg'), 'ffmpeg not installed')
+    def test_one_run_gives_metadata_and_poster(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        path = os.path.join(workdir, 'clip.mp4')
+        subprocess.run([
+            shutil.which('ffmpeg'), '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=size=320x240:rate=10',
+            '-t', '2', path
+        ], check=True)
+        result = process_video(path)
+        self.assertEqual(result['video_duration'], 2)
+        self.assertEqual((result['video_width'], result['video_height']), (320, 240))
+        self.assertEqual(result['thumbnail'][1][:2], b'\xff\xd8')
@@ -0,0 +1,154 @@
+# api/chat/timing.py
+'''
+Per-handler latency, split by phase, over a rolling window.
+
+Every frame is timed as one FrameTiming:
+    - db:        time inside SQL queries (connection.execute_wrapper)
+    - serialize: the rest of the handler, i.e. building payloads
+    - send:      channel layer group_send calls for the frame's events
+
+Samples land in one RollingHistogram per (source, phase) that keeps the
+last WINDOW observations. handler_stats.snapshot() gives bucket counts and
+percentiles; a summary is logged every LOG_INTERVAL seconds.
+'''
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from . import metrics
+from .logs import fields
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WINDOW': 1000,        # samples kept per source and phase
+    'LOG_INTERVAL': 60,    # seconds between summary log lines, 0 = never
+}
+
+# Upper bounds in milliseconds; the last bucket is everything slower
+BUCKETS_MS = (0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+PHASES = ('db', 'serialize', 'send')
+
+
+def get_timing_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_TIMING', {})}
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class RollingHistogram:
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.total = 0
+
+    def observe(self, ms):
+        self.samples.append(ms)
+        self.total += 1
+
+    def snapshot(self):
+        ordered = sorted(self.samples)
+        buckets = [0] * (len(BUCKETS_MS) + 1)
+        for ms in ordered:
+            buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        return {
+            'count': self.total,
+            'window': len(ordered),
+            'buckets': dict(zip([*map(str, BUCKETS_MS), 'inf'], buckets)),
+            'p50': percentile(ordered, 0.50),
+            'p95': percentile(ordered, 0.95),
+            'p99': percentile(ordered, 0.99),
+            'max': ordered[-1] if ordered else None,
+        }
+
+
+class HandlerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.last_log = time.monotonic()
+
+    def observe(self, source, phase, ms):
+        with self.lock:
+            histogram = self.histograms.get((source, phase))
+            if histogram is None:
+                histogram = RollingHistogram(get_timing_settings()['WINDOW'])
+                self.histograms[source, phase] = histogram
+            histogram.observe(ms)
+
+    def snapshot(self):
+        with self.lock:
+            items = list(self.histograms.items())
+        stats = {}
+        for (source, phase), histogram in sorted(items):
+            stats.setdefault(source, {})[phase] = histogram.snapshot()
+        return stats
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def maybe_log(self):
+        interval = get_timing_settings()['LOG_INTERVAL']
+        now = time.monotonic()
+        if not interval or now - self.last_log < interval:
+            return
+        self.last_log = now
+        for source, phases in self.snapshot().items():
+            log.info('handler.latency', extra=fields(source=source, **{
+                phase: {'n': s['window'], 'p50': s['p50'], 'p95': s['p95'], 'p99': s['p99']}
+                for phase, s in phases.items()
+            }))
+
+
+handler_stats = HandlerStats()
+
+
+class FrameTiming:
+    '''
+    Times one frame. Use as the execute_wrapper around the handler and
+    report channel layer send time with add_send(); finish() records it.
+    '''
+
+    def __init__(self, source):
+        self.source = source
+        self.started = time.perf_counter()
+        self.handler = None     # set when the handler returns
+        self.db = 0.0
+        self.queries = 0
+        self.send = 0.0
+        self.send_in_handler = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+    def handler_done(self):
+        self.handler = time.perf_counter() - self.started
+
+    def add_send(self, seconds):
+        self.send += seconds
+        if self.handler is None:
+            # The sync consumer sends from inside the handler
+            self.send_in_handler += seconds
+
+    def finish(self):
+        if self.handler is None:
+            self.handler_done()
+        serialize = max(0.0, self.handler - self.db - self.send_in_handler)
+        for phase, seconds in zip(PHASES, (self.db, serialize, self.send)):
+            handler_stats.observe(self.source, phase, seconds * 1000)
+        metrics.handler_finished(self.source, self.queries)
+        handler_stats.maybe_log()
@@ -0,0 +1,81 @@
+# api/chat/typing.py
+'''
+Typing indicators, coalesced on the server.
+
+Clients send message.type on every keystroke. Per (sender, recipient) pair
+at most one typing event is forwarded per WINDOW seconds, and each carries
+`expires` so the recipient clears it on its own if no stop arrives.
+typing.stop is only forwarded while an indicator is actually showing.
+
+State lives in the Django cache (cache.add is atomic) and expires by
+itself. settings.CACHES points at Redis so every Daphne worker shares the
+throttle; with a per-process cache such as LocMemCache each worker would
+throttle only its own sockets.
+'''
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+DEFAULTS = {
+    'WINDOW': 2.5,  # seconds between forwarded typing events per pair
+    'EXPIRY': 6,    # seconds an indicator stays on without a refresh
+}
+
+
+def get_typing_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_TYPING', {})}
+
+
+def throttle_key(sender, recipient):
+    return f'typing:throttle:{sender}:{recipient}'
+
+
+def active_key(sender, recipient):
+    return f'typing:active:{sender}:{recipient}'
+
+
+def start_typing(sender, recipient):
+    '''
+    Returns the event to forward, or None when one was forwarded less than
+    WINDOW seconds ago.
+    '''
+    config = get_typing_settings()
+    if not cache.add(throttle_key(sender, recipient), 1, timeout=config['WINDOW']):
+        return None
+    cache.set(active_key(sender, recipient), 1, timeout=config['EXPIRY'])
+    return {
+        'username': sender,
+        'typing': True,
+        'expires': config['EXPIRY'],
+        'sent': time.time()
+    }
+
+
+def stop_typing(sender, recipient):
+    '''
+    Returns the stop event, or None when the recipient isn't showing an
+    indicator (never started, or already expired).
+    '''
+    cache.delete(throttle_key(sender, recipient))
+    if not cache.delete(active_key(sender, recipient)):
+        return None
+    return {
+        'username': sender,
+        'typing': False
+    }
+
+
+def clear_typing(sender, recipient):
+    '''A sent message ends typing implicitly; the client clears its own UI.'''
+    cache.delete_many([throttle_key(sender, recipient), active_key(sender, recipient)])
+
+
+def is_stale(source, data):
+    '''
+    Typing events that sat in a socket's queue longer than WINDOW mean the
+    consumer is behind; drop them so chat messages get through first.
+    '''
+    if source != 'message.type' or 'sent' not in data:
+        return False
+    return time.time() - data['sent'] > get_typing_settings()['WINDOW']
@@ -0,0 +1,132 @@
+# api/chat/uploads.py
+'''
+Chunked media uploads over binary WebSocket frames.
+
+    1. client -> {'source': 'upload.start', 'filename': 'clip.mp4', 'size': 1234567}
+       server -> {'source': 'upload.start', 'data': {'uploadId', 'filename', 'offset', 'chunk_size'}}
+    2. client -> binary frames, one per chunk:
+           1 byte     length N of the upload id
+           N bytes    upload id (ascii)
+           8 bytes    offset of this chunk, unsigned big-endian
+           rest       chunk payload (at most chunk_size bytes)
+       server -> {'source': 'upload.chunk', 'data': {'uploadId', 'offset', 'complete'}}
+       `offset` in the ack is the next byte the server expects, so a client
+       that gets out of step can resume from there.
+    3. client -> message.send with image_upload / voice_upload / video_upload
+       set to the upload id instead of the base64 payload.
+
+Chunks are appended straight to a part file under MEDIA_ROOT/uploads, so
+memory per upload is bounded by one chunk, and hashed as it arrives. On
+message.send the part file is moved (not copied) into the blob store, or
+dropped if that content is stored already (see blobs.py).
+'''
+import hashlib
+import os
+import struct
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+
+DEFAULTS = {
+    'MAX_SIZE': 100 * 1024 * 1024,
+    'CHUNK_SIZE': 256 * 1024,
+    'MAX_PENDING': 4,   # unfinished uploads per socket
+}
+
+OFFSET = struct.Struct('>Q')
+
+
+class UploadError(Exception):
+    pass
+
+
+def get_upload_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_UPLOADS', {})}
+
+
+def upload_dir():
+    path = os.path.join(settings.MEDIA_ROOT, 'uploads')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def parse_chunk_frame(bytes_data):
+    '''Split a binary frame into (upload_id, offset, payload).'''
+    if len(bytes_data) < 1:
+        raise UploadError('Empty frame')
+    id_length = bytes_data[0]
+    header_length = 1 + id_length + OFFSET.size
+    if len(bytes_data) < header_length:
+        raise UploadError('Truncated chunk header')
+    try:
+        upload_id = bytes_data[1:1 + id_length].decode('ascii')
+    except UnicodeDecodeError:
+        raise UploadError('Bad upload id')
+    offset, = OFFSET.unpack_from(bytes_data, 1 + id_length)
+    payload = memoryview(bytes_data)[header_length:]
+    return upload_id, offset, payload
+
+
+def build_chunk_frame(upload_id, offset, payload):
+    '''Client side of parse_chunk_frame (used by tests and the load harness).'''
+    upload_id = upload_id.encode('ascii')
+    return bytes([len(upload_id)]) + upload_id + OFFSET.pack(offset) + bytes(payload)
+
+
+class UploadFile(File):
+    '''
+    A finished upload. temporary_file_path() lets FileSystemStorage move
+    the part file into place instead of copying it.
+    '''
+
+    def __init__(self, file, name=None, sha256=None):
+        super().__init__(file, name)
+        self.sha256 = sha256    # content hash, computed while receiving
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class ChunkedUpload:
+    def __init__(self, filename, size):
+        config = get_upload_settings()
+        if not filename:
+            raise UploadError('Missing filename')
+        if not isinstance(size, int) or size <= 0 or size > config['MAX_SIZE']:
+            raise UploadError(f'Invalid upload size {size}')
+        self.upload_id = uuid.uuid4().hex
+        self.filename = os.path.basename(filename)
+        self.size = size
+        self.chunk_size = config['CHUNK_SIZE']
+        self.received = 0
+        self.hash = hashlib.sha256()
+        self.path = os.path.join(upload_dir(), f'{self.upload_id}.part')
+        self.file = open(self.path, 'wb')
+
+    @property
+    def complete(self):
+        return self.received == self.size
+
+    def write(self, offset, payload):
+        if offset != self.received:
+            raise UploadError(f'Expected offset {self.received}, got {offset}')
+        if len(payload) > self.chunk_size:
+            raise UploadError(f'Chunk larger than {self.chunk_size} bytes')
+        if self.received + len(payload) > self.size:
+            raise UploadError('Upload larger than announced size')
+        self.file.write(payload)
+        self.hash.update(payload)
+        self.received += len(payload)
+        if self.complete:
+            self.file.close()
+
+    def as_file(self):
+        if not self.complete:
+            raise UploadError(f'Upload {self.upload_id} is incomplete')
+        return UploadFile(open(self.path, 'rb'), name=self.filename, sha256=self.hash.hexdigest())
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
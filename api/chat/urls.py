@@ -1,9 +1,10 @@
 # api/chat/urls.py
 from django.urls import path
 
-from .views import SignInView, SignUpView
+from .views import SignInView, SignUpView, metrics_view
 
 urlpatterns = [
     path('signin/', SignInView.as_view()),
-    path('signup/', SignUpView.as_view())
+    path('signup/', SignUpView.as_view()),
+    path('metrics/', metrics_view),
 ]
@@ -0,0 +1,96 @@
+# api/chat/video.py
+'''
+Video metadata and poster frame in one ffmpeg run.
+
+    ffmpeg -hide_banner -nostdin -ss 0.5 -i clip.mp4 -frames:v 1 -f image2pipe -c:v mjpeg -q:v 3 -
+
+ffmpeg describes its input on stderr before it encodes anything, so the
+same process that pipes the poster JPEG to stdout also reports:
+
+    Duration: 00:00:12.48, start: 0.000000, bitrate: 2318 kb/s
+      Stream #0:0[0x1](und): Video: h264 (High) (avc1 / 0x31637661), yuv420p(tv, bt709), 1920x1080 [SAR 1:1 DAR 16:9], ...
+          displaymatrix: rotation of -90.00 degrees
+
+Only the input section (before 'Output #0') is parsed. Dimensions are as
+displayed: phones record landscape frames with a rotation, which ffmpeg
+also applies to the poster. Clips shorter than the seek point produce no
+frame at 0.5 s; those get a second run from the first frame. See
+`manage.py bench_video` for the latency against separate ffprobe and
+ffmpeg runs through a temp file.
+'''
+import logging
+import os
+import re
+import subprocess
+
+from .logs import fields
+from .utils import find_binary
+
+log = logging.getLogger(__name__)
+
+POSTER_AT = 0.5     # seconds into the clip
+
+DURATION = re.compile(r'Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+VIDEO_STREAM = re.compile(r'Stream #\d+:\d+.*?: Video: (\w+).*?, (\d{2,5})x(\d{2,5})')
+ROTATION = re.compile(r'rotation of (-?\d+(?:\.\d+)?) degrees')
+
+
+def parse_probe(stderr):
+    '''{'duration' (float seconds), 'width', 'height', 'codec'} from ffmpeg's stderr; None where missing.'''
+    info = stderr.split('Output #0', 1)[0]
+    probe = {'duration': None, 'width': None, 'height': None, 'codec': None}
+
+    match = DURATION.search(info)
+    if match:
+        hours, minutes, seconds = match.groups()
+        probe['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    match = VIDEO_STREAM.search(info)
+    if match:
+        probe['codec'] = match.group(1)
+        probe['width'], probe['height'] = int(match.group(2)), int(match.group(3))
+        rotation = ROTATION.search(info, match.end())
+        if rotation and round(abs(float(rotation.group(1)))) % 180 == 90:
+            probe['width'], probe['height'] = probe['height'], probe['width']
+    return probe
+
+
+def run_ffmpeg(path, seek, timeout=None):
+    args = [find_binary('ffmpeg'), '-hide_banner', '-nostdin']
+    if seek:
+        args += ['-ss', str(seek)]
+    args += ['-i', str(path), '-frames:v', '1', '-f', 'image2pipe', '-c:v', 'mjpeg', '-q:v', '3', '-']
+    result = subprocess.run(args, capture_output=True, timeout=timeout)
+    return result.stdout, result.stderr.decode(errors='replace')
+
+
+def probe_video(path, timeout=None):
+    '''parse_probe() of `path` plus 'poster': JPEG bytes of a frame, or None.'''
+    poster, stderr = run_ffmpeg(path, POSTER_AT, timeout=timeout)
+    probe = parse_probe(stderr)
+    if not poster and probe['duration'] is not None and probe['duration'] <= POSTER_AT:
+        poster, _ = run_ffmpeg(path, None, timeout=timeout)
+    probe['poster'] = poster or None
+    probe['error'] = None if poster else stderr[-500:]
+    return probe
+
+
+#--------------------------------------------------
+#     Media job processor (run in the job pool)
+#--------------------------------------------------
+def process_video(video_path, timeout=None):
+    probe = probe_video(video_path, timeout=timeout)
+    if probe['duration'] is None and probe['poster'] is None:
+        raise RuntimeError(f"No metadata extracted for {video_path}: {probe['error']}")
+    log.debug('video.probed', extra=fields(
+        path=video_path, codec=probe['codec'], duration=probe['duration'],
+        width=probe['width'], height=probe['height'], poster=bool(probe['poster'])
+    ))
+
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    return {
+        'video_duration': None if probe['duration'] is None else round(probe['duration']),
+        'video_width': probe['width'],
+        'video_height': probe['height'],
+        'thumbnail': (f'{stem}_poster.jpg', probe['poster']) if probe['poster'] else None,
+    }
@@ -1,17 +1,28 @@
 # api/chat/views.py
+import logging
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
+from django.views.static import serve
 from django.contrib.auth import authenticate
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from . import metrics
+from .jobs import media_queue_depth
+from .logs import fields
 from .serializers import UserSerializer, SignUpSerializer
+from .timing import handler_stats
+
+log = logging.getLogger(__name__)
 
 # Create your views here.
 def get_auth_for_user(user):
     tokens = RefreshToken.for_user(user)
-    print('Tokens are:', type(tokens),  tokens)
+    log.info('auth.tokens_issued', extra=fields(username=user.username))
     
     return {
         'user': UserSerializer(user).data,
@@ -27,7 +38,7 @@ class SignInView(APIView):
     permission_classes = [AllowAny]
     
     def post(self, request):
-        print("Request Origin:", request.META.get("HTTP_ORIGIN"))  # ← Add this line here
+        log.debug('auth.signin', extra=fields(origin=request.META.get('HTTP_ORIGIN')))
 
         username = request.data.get('username')
         password = request.data.get('password')
@@ -55,4 +66,48 @@ class SignUpView(APIView):
         
         user_data = get_auth_for_user(user)
         
-        return Response(user_data)
\ No newline at end of file
+        return Response(user_data)
+
+
+def metrics_view(request):
+    '''Prometheus scrape target for this process (see metrics.py).'''
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+
+    latency = [
+        ((('source', source), ('phase', phase), ('quantile', quantile)), stats[key] / 1000)
+        for source, phases in handler_stats.snapshot().items()
+        for phase, stats in phases.items()
+        for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99'))
+        if stats[key] is not None
+    ]
+    body = metrics.render(extra=[
+        ('chat_media_queue_depth', 'gauge', 'Media jobs queued or running',
+         [((), media_queue_depth())]),
+        ('chat_handler_latency_seconds', 'summary',
+         'Handler phase latency quantiles over the rolling window (timing.py)', latency),
+    ])
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Files whose name changes with their content: content-addressed message
+# media (blobs.py) and versioned avatars (User.set_avatar)
+IMMUTABLE_MEDIA = ('blobs/', 'avatars/')
+
+
+def media_cache_control(path):
+    if path.startswith(IMMUTABLE_MEDIA):
+        return f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable'
+    # Older fixed names (thumbnails/<username>.png) change in place:
+    # clients revalidate, and get a 304 while the file is the same
+    return 'no-cache'
+
+
+def media_view(request, path):
+    '''
+    MEDIA_URL when Django serves it (DEBUG). A web server in front of
+    media should send the same Cache-Control headers.
+    '''
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    response['Cache-Control'] = media_cache_control(path)
+    return response
@@ -0,0 +1,148 @@
+# api/chat/waveform.py
+'''
+Voice message waveforms, computed in-process with NumPy.
+
+Produces exactly what the old pipeline did (ffmpeg to a 44.1 kHz mono WAV,
+then `audiowaveform --pixels-per-second 10 --bits 8`, rescaled):
+
+    - buckets of SAMPLE_RATE / PIXELS_PER_SECOND samples, the last one
+      partial
+    - min and max of each bucket in 16-bit PCM, cut to 8 bits by dividing
+      by 256 and truncating toward zero (audiowaveform's integer division)
+    - interleaved [min0, max0, min1, max1, ...], each / 255 rounded to 2
+      places, so values are in [-0.5, 0.5]
+
+Input is read in chunks and never written to disk:
+
+    - 16-bit PCM WAV at SAMPLE_RATE is decoded with the wave module
+      (stereo is averaged down, like audiowaveform does)
+    - anything else (the app's m4a, opus, mp3...) is decoded by one ffmpeg
+      process piping mono s16le to stdout
+
+Buckets are a reshape plus min/max over whole chunks, not a Python loop
+per sample. See `manage.py bench_waveform`.
+'''
+import subprocess
+import threading
+import wave
+
+import numpy as np
+from django.conf import settings
+
+from .utils import find_binary
+
+DEFAULTS = {
+    'PIXELS_PER_SECOND': 10,    # buckets per second of audio
+    'SAMPLE_RATE': 44100,       # Hz that audio is decoded at
+}
+
+CHUNK_BUCKETS = 256     # buckets decoded per read
+
+
+def get_waveform_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_WAVEFORM', {})}
+
+
+def peaks(chunks, samples_per_pixel):
+    '''(mins, maxs) per bucket from an iterable of int16 sample arrays.'''
+    mins, maxs = [], []
+    carry = np.empty(0, dtype=np.int16)
+    for chunk in chunks:
+        data = np.concatenate((carry, chunk)) if carry.size else chunk
+        whole = len(data) // samples_per_pixel * samples_per_pixel
+        if whole:
+            buckets = data[:whole].reshape(-1, samples_per_pixel)
+            mins.append(buckets.min(axis=1))
+            maxs.append(buckets.max(axis=1))
+        carry = data[whole:]
+    if carry.size:
+        mins.append(carry.min(keepdims=True))
+        maxs.append(carry.max(keepdims=True))
+    if not mins:
+        return np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int16)
+    return np.concatenate(mins), np.concatenate(maxs)
+
+
+def scale(mins, maxs):
+    '''Interleaved 8-bit min/max as the rounded fractions clients draw.'''
+    values = np.empty(len(mins) * 2, dtype=np.int32)
+    values[0::2] = mins
+    values[1::2] = maxs
+    values = np.sign(values) * (np.abs(values) >> 8)   # / 256, toward zero
+    return np.round(values / 255, 2).tolist()
+
+
+def wav_chunks(path, sample_rate, chunk_samples):
+    '''
+    int16 chunks of a PCM WAV the native decoder handles, or None if it
+    needs ffmpeg (compressed, not 16-bit or another sample rate).
+    '''
+    try:
+        reader = wave.open(str(path), 'rb')
+    except (wave.Error, EOFError):
+        return None
+    if reader.getsampwidth() != 2 or reader.getframerate() != sample_rate:
+        reader.close()
+        return None
+
+    def read():
+        with reader:
+            channels = reader.getnchannels()
+            while True:
+                frames = reader.readframes(chunk_samples)
+                if not frames:
+                    return
+                samples = np.frombuffer(frames, dtype='<i2')
+                if channels > 1:
+                    samples = (samples.reshape(-1, channels).sum(axis=1, dtype=np.int32) / channels).astype(np.int16)
+                yield samples
+    return read()
+
+
+def ffmpeg_chunks(path, sample_rate, chunk_samples, timeout=None):
+    '''int16 chunks of any audio ffmpeg can decode, downmixed to mono.'''
+    process = subprocess.Popen(
+        [find_binary('ffmpeg'), '-v', 'error', '-nostdin', '-i', str(path),
+         '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(sample_rate), '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    # The job's timeout covers the whole decode, not one read
+    timer = threading.Timer(timeout, process.kill) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        while True:
+            data = process.stdout.read(chunk_samples * 2)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) // 2 * 2], dtype='<i2')
+        stderr = process.stderr.read().decode(errors='replace')
+        if process.wait() != 0:
+            raise RuntimeError(f'ffmpeg failed ({process.returncode}): {stderr[-500:]}')
+    finally:
+        if timer:
+            timer.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def compute_waveform(path, timeout=None):
+    '''The waveform of an audio file, as stored on Message.waveform.'''
+    config = get_waveform_settings()
+    samples_per_pixel = config['SAMPLE_RATE'] // config['PIXELS_PER_SECOND']
+    chunk_samples = samples_per_pixel * CHUNK_BUCKETS
+    chunks = wav_chunks(path, config['SAMPLE_RATE'], chunk_samples)
+    if chunks is None:
+        chunks = ffmpeg_chunks(path, config['SAMPLE_RATE'], chunk_samples, timeout=timeout)
+    return scale(*peaks(chunks, samples_per_pixel))
+
+
+def process_voice(voice_path, timeout=None):
+    '''Media job processor for voice messages (see jobs.py).'''
+    waveform = compute_waveform(voice_path, timeout=timeout)
+    if not waveform:
+        raise RuntimeError(f'No audio decoded from {voice_path}')
+    return {'waveform': waveform}
@@ -0,0 +1,198 @@
+# api/chat/wire.py
+'''
+Wire formats, negotiated per socket with the WebSocket subprotocol.
+
+    - 'chat.json' (or no subprotocol): JSON text frames. Upload chunks
+      are raw binary frames (see uploads.py).
+    - 'chat.msgpack': every frame, both ways, is a binary MessagePack map
+      with the same keys as the JSON frame. Upload chunks are ordinary
+      frames: {'source': 'upload.chunk', 'uploadId', 'offset', 'data': <bin>}.
+
+The server picks the first subprotocol the client offers that it supports.
+'chat.msgpack' is only offered when msgpack is installed.
+
+Channel layer events stay dicts, so a message fanned out to one user's
+JSON phone and msgpack tablet is encoded once per socket, in that socket's
+format. See `manage.py bench_wire` for size and speed against JSON.
+
+Compression
+-----------
+Daphne doesn't negotiate permessage-deflate, so compression is an
+envelope of our own with the same design. Offering '<format>+deflate'
+(e.g. 'chat.json+deflate') turns it on for server -> client frames:
+
+    - frames under MIN_SIZE bytes go out exactly as without it
+    - larger frames go out as a binary frame: b'\x01' + raw deflate data,
+      flushed with Z_SYNC_FLUSH and with the trailing 00 00 ff ff removed
+
+The first byte never starts a msgpack map and JSON never arrives in a
+binary frame, so the client can always tell an envelope apart. Each
+socket keeps one compressor for its lifetime (context takeover): repeated
+keys and usernames compress against earlier frames. The client inflates
+with one raw-deflate context per socket, appending 00 00 ff ff to each
+envelope.
+
+A compressor holds about 2^(WBITS+2) + 2^(MEM_LEVEL+9) bytes (32 KB with
+the defaults, vs 256 KB for zlib's). At most MAX_CONTEXTS sockets per
+process get one; past that, '+deflate' offers are skipped and the socket
+is served by the next subprotocol the client offers. Client frames are
+never compressed: they're small, and media is compressed already. See
+`manage.py bench_compression`.
+'''
+import json
+import threading
+import zlib
+
+from django.conf import settings
+
+from . import metrics
+
+from .fast_serializers import dumps
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional wire format
+    msgpack = None
+
+
+class FrameError(ValueError):
+    pass
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MIN_SIZE': 256,        # bytes; smaller frames are sent as they are
+    'LEVEL': 6,
+    'WBITS': 12,            # 4 KB window
+    'MEM_LEVEL': 5,
+    'MAX_CONTEXTS': 2000,   # compressing sockets per process
+}
+
+ENVELOPE = b'\x01'
+SYNC_TAIL = b'\x00\x00\xff\xff'
+
+
+def get_compression_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_COMPRESSION', {})}
+
+
+class JSONCodec:
+    subprotocol = 'chat.json'
+    binary = False
+
+    def close(self):
+        pass
+
+    def decode(self, text_data=None, bytes_data=None):
+        if text_data is None:
+            raise FrameError('Expected a text frame')
+        try:
+            frame = orjson.loads(text_data) if orjson is not None else json.loads(text_data)
+        except ValueError as e:
+            raise FrameError(f'Bad JSON: {e}')
+        if not isinstance(frame, dict):
+            raise FrameError('Frame is not an object')
+        return frame
+
+    def encode(self, frame):
+        return {'text_data': dumps(frame)}
+
+
+class MsgpackCodec:
+    subprotocol = 'chat.msgpack'
+    binary = True
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            raise FrameError('Expected a binary frame')
+        try:
+            frame = msgpack.unpackb(bytes_data, raw=False)
+        except Exception as e:  # truncated data, bad types, unhashable keys...
+            raise FrameError(f'Bad MessagePack: {e}')
+        if not isinstance(frame, dict):
+            raise FrameError('Frame is not a map')
+        return frame
+
+    def encode(self, frame):
+        return {'bytes_data': msgpack.packb(frame)}
+
+    def close(self):
+        pass
+
+
+class Contexts:
+    '''Counts live compressors against MAX_CONTEXTS.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def acquire(self, limit):
+        with self.lock:
+            if self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.count -= 1
+
+
+contexts = Contexts()
+
+
+class DeflateCodec:
+    '''Wraps a format codec with the compression envelope. One per socket.'''
+
+    def __init__(self, codec, config):
+        self.codec = codec
+        self.subprotocol = f'{codec.subprotocol}+deflate'
+        self.binary = codec.binary
+        self.min_size = config['MIN_SIZE']
+        self.compressor = zlib.compressobj(
+            config['LEVEL'], zlib.DEFLATED, -config['WBITS'], config['MEM_LEVEL']
+        )
+
+    def decode(self, text_data=None, bytes_data=None):
+        return self.codec.decode(text_data, bytes_data)
+
+    def encode(self, frame):
+        encoded = self.codec.encode(frame)
+        payload = encoded.get('text_data')
+        payload = payload.encode() if payload is not None else encoded['bytes_data']
+        if len(payload) < self.min_size:
+            return encoded
+        data = self.compressor.compress(payload) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        metrics.frame_compressed(len(payload), len(data) - len(SYNC_TAIL) + len(ENVELOPE))
+        return {'bytes_data': ENVELOPE + data[:-len(SYNC_TAIL)]}
+
+    def close(self):
+        if self.compressor is not None:
+            self.compressor = None
+            contexts.release()
+
+
+JSON = JSONCodec()
+CODECS = {JSON.subprotocol: JSON}
+if msgpack is not None:
+    CODECS[MsgpackCodec.subprotocol] = MsgpackCodec()
+
+
+def negotiate(subprotocols):
+    '''(codec, subprotocol to accept with) for the client's offer.'''
+    config = get_compression_settings()
+    for name in subprotocols or ():
+        if name in CODECS:
+            return CODECS[name], name
+        base, _, extension = name.partition('+')
+        if (extension == 'deflate' and base in CODECS and config['ENABLED']
+                and contexts.acquire(config['MAX_CONTEXTS'])):
+            return DeflateCodec(CODECS[base], config), name
+    # Old clients offer nothing: JSON, and no subprotocol in the handshake
+    return JSON, None
@@ -61,6 +61,145 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Shared by every worker, like the channel layer: typing throttles
+# (chat/typing.py) and search results (chat/search.py). The default
+# LocMemCache would keep a separate copy per Daphne process.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/1",
+    },
+}
+
+# 'async' serves AsyncChatConsumers, 'sync' the thread-per-frame ChatConsumers
+CHAT_CONSUMER_MODE = 'async'
+
+# Background media processing (chat/jobs.py)
+MEDIA_JOBS = {
+    'BACKEND': 'process',   # 'process' pool, or 'local' to run inline (tests)
+    'WORKERS': 2,           # pool size = max media jobs in flight
+    'RETRIES': 2,           # extra attempts after a failure or timeout
+    'TIMEOUT': 120,         # seconds per attempt
+}
+
+# Image message variants and placeholders, made by the media jobs (chat/images.py)
+CHAT_IMAGES = {
+    'WIDTHS': [320, 720],   # px, longest side of each WebP variant
+    'FULL_MAX': 2560,       # px; the 'full' variant that replaces the upload
+    'QUALITY': 80,
+    'PLACEHOLDER': 16,      # px, longest side of the LQIP data: URI
+}
+
+# Square avatar variants made at upload (chat/images.py)
+CHAT_AVATARS = {
+    'SMALL': 128,   # px: friend list, headers
+    'LARGE': 512,   # px: profile screen
+    'QUALITY': 85,
+}
+
+# Cache lifetime for media whose URL changes with its content (blobs/,
+# avatars/); see chat/views.py media_view
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 3600
+
+# Voice message waveforms (chat/waveform.py)
+CHAT_WAVEFORM = {
+    'PIXELS_PER_SECOND': 10,    # min/max pairs per second of audio
+    'SAMPLE_RATE': 44100,       # Hz audio is decoded at
+}
+
+# ffmpeg / ffprobe executables; None = the first found on PATH
+MEDIA_BINARIES = {
+    'ffmpeg': None,
+    'ffprobe': None,
+}
+
+# Typing indicator coalescing (chat/typing.py)
+CHAT_TYPING = {
+    'WINDOW': 2.5,  # at most one message.type per sender/recipient per window
+    'EXPIRY': 6,    # seconds an indicator lasts without a refresh
+}
+
+# Online presence (chat/presence.py). The store has to be shared by every
+# worker, like the channel layer.
+CHAT_PRESENCE = {
+    'BACKEND': 'redis',
+    'REDIS_URL': 'redis://127.0.0.1:6379/0',
+    'DEBOUNCE': 2.0,    # seconds a change waits, so reconnects cancel out
+}
+
+# Largest pageSize a client may request for message.list (chat/pagination.py)
+MESSAGE_PAGE_SIZE_MAX = 50
+
+# Undelivered messages pushed to a socket when it connects (chat/outbox.py)
+OUTBOX_LIMIT = 500
+
+# sync.since delta sync for reconnecting clients (chat/sync.py)
+CHAT_SYNC = {
+    'BATCH_SIZE': 200,              # messages per frame
+    'MAX_MESSAGES': 2000,           # more changes than this -> client reloads
+    'OVERLAP': 2,                   # seconds re-read before the cursor
+    'TOMBSTONE_TTL': 7 * 24 * 3600, # seconds deleted messages are remembered
+}
+
+# Compressed frames for clients offering '<format>+deflate' (chat/wire.py)
+CHAT_COMPRESSION = {
+    'MIN_SIZE': 256,        # bytes; smaller frames go out uncompressed
+    'LEVEL': 6,
+    'WBITS': 12,            # window and memory level: ~32 KB per socket
+    'MEM_LEVEL': 5,
+    'MAX_CONTEXTS': 2000,   # compressing sockets per process
+}
+
+# User search (chat/search.py)
+SEARCH_RESULT_LIMIT = 20    # max users per search response
+SEARCH_CACHE_TTL = 10       # seconds a query's ranked ids are cached
+
+# Chunked binary uploads over the socket (chat/uploads.py)
+CHAT_UPLOADS = {
+    'MAX_SIZE': 100 * 1024 * 1024,  # bytes per upload
+    'CHUNK_SIZE': 256 * 1024,       # max payload per binary frame
+    'MAX_PENDING': 4,               # unfinished uploads per socket
+}
+
+# Logging (chat/logs.py). Set the 'chat' level to DEBUG to log every
+# received frame, redacted and truncated per CHAT_LOGGING.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            '()': 'chat.logs.StructuredFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
+    },
+    'loggers': {
+        'chat': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+CHAT_LOGGING = {
+    'MAX_STRING': 200,  # logged strings are truncated past this
+    'MAX_ITEMS': 20,    # logged lists are cut off past this
+}
+
+# Per-handler latency histograms (chat/timing.py)
+CHAT_TIMING = {
+    'WINDOW': 1000,       # samples kept per source and phase
+    'LOG_INTERVAL': 60,   # seconds between 'handler.latency' summaries, 0 = off
+}
+
+# Addresses allowed to scrape /chat/metrics/ (chat/metrics.py)
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
 # CORS_ALLOW_ALL_ORIGINS = True
 
 # CORS
@@ -126,6 +265,21 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL: readers no longer block on a writer (or the other way
+            # round). synchronous=NORMAL is durable across app crashes with
+            # WAL, and only fsyncs at checkpoints. See `manage.py bench_db`.
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA busy_timeout=5000;'
+                'PRAGMA cache_size=-20000;'     # KiB, per connection
+                'PRAGMA temp_store=MEMORY;'
+            ),
+            # Take the write lock at BEGIN, so two writers queue on
+            # busy_timeout instead of failing a read->write upgrade
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
@@ -11,7 +11,7 @@ export default function FriendTitle({ friend }) {
 
   return (
     <View style={{ flexDirection: "row", alignItems: "center" }}>
-      <Thumbnail url={friend?.thumbnail} size={30} />
+      <Thumbnail url={friend?.thumbnail_small ?? friend?.thumbnail} size={30} />
       <Text
         style={{
           color: currentTheme.colors.textPrimary,
@@ -46,10 +46,36 @@ function responseMessageList(set, get, data) {
 }
 
 
+// Delivery acks: ids of received messages, sent in one
+// 'message.delivered' frame shortly after they arrive
+const ACK_DELAY = 200
+let pendingAcks = []
+let ackTimer = null
+
+function queueDeliveredAck(get, message) {
+    if (message.is_me || message.delivered) return
+    pendingAcks.push(message.id)
+    if (ackTimer) return
+    ackTimer = setTimeout(() => {
+        const socket = get().socket
+        if (socket && socket.readyState === WebSocket.OPEN && pendingAcks.length) {
+            socket.send(JSON.stringify({
+                source: 'message.delivered',
+                messageIds: pendingAcks
+            }))
+            pendingAcks = []
+        }
+        ackTimer = null
+    }, ACK_DELAY)
+}
+
+
 // Latest responseMessageSend
 function responseMessageSend(set, get, data) {
     if (!data?.message || !data?.friend) return;
 
+    queueDeliveredAck(get, data.message);
+
     const username = data.friend.username;
     const activeId = get().messagesConnectionId;
 
@@ -86,6 +112,9 @@ function responseMessageSend(set, get, data) {
     if (activeId && message.connection_id && activeId !== message.connection_id) return;
     if (username !== get().messagesUsername) return;
 
+    // Already shown (outbox push racing a live send)
+    if (get().messagesList.some(m => m.id === message.id)) return;
+
     // ✅ Append instead of prepend
     const messagesList = [...get().messagesList, message];
 
@@ -95,10 +124,104 @@ function responseMessageSend(set, get, data) {
     }));
 }
 
+// Forwarded messages arrive as one batch for the whole selection
+function responseMessageSendBatch(set, get, data) {
+    if (!Array.isArray(data?.messages)) return;
+    data.messages.forEach(message => {
+        responseMessageSend(set, get, {
+            message,
+            friend: data.friend,
+            connection_id: data.connection_id
+        });
+    });
+}
+
+// Everything that arrived while offline, one batch per conversation
+function responseMessageOutbox(set, get, data) {
+    if (!Array.isArray(data?.batches)) return;
+    data.batches.forEach(batch => responseMessageSendBatch(set, get, batch));
+}
+
+// Changes since the last sync, replacing the full reload on reconnect.
+// Arrives in bounded frames; the cursor is kept from the last one.
+function responseSyncSince(set, get, data) {
+    const socket = get().socket
+    if (data.reset) {
+        // No cheap delta: reload everything
+        socket.send(JSON.stringify({ source: 'request.list' }))
+        socket.send(JSON.stringify({ source: 'friend.list' }))
+        if (get().messagesConnectionId) {
+            get().messageList(get().messagesConnectionId)
+        }
+        set(() => ({ syncCursor: data.cursor }))
+        return
+    }
+
+    if (data.connections?.length) {
+        const changed = new Map(data.connections.map(item => [item.id, item]))
+        const current = Array.isArray(get().friendList) ? get().friendList : []
+        const kept = current.filter(item => !changed.has(item.id))
+        const friendList = [...changed.values(), ...kept].sort(
+            (a, b) => new Date(b.updated) - new Date(a.updated)
+        )
+        set(() => ({ friendList }))
+    }
+
+    if (data.requests?.length) {
+        const current = Array.isArray(get().requestList) ? get().requestList : []
+        const ids = new Set(data.requests.map(request => request.id))
+        set(() => ({
+            requestList: [...data.requests, ...current.filter(request => !ids.has(request.id))]
+        }))
+    }
+
+    if (data.users?.length) {
+        const users = new Map(data.users.map(user => [user.username, user]))
+        const me = users.get(get().user.username)
+        set((state) => ({
+            user: me ? { ...state.user, ...me } : state.user,
+            friendList: Array.isArray(state.friendList)
+                ? state.friendList.map(item => users.has(item.friend.username)
+                    ? { ...item, friend: users.get(item.friend.username) }
+                    : item)
+                : state.friendList
+        }))
+    }
+
+    if (data.deleted?.length) {
+        const ids = new Set(data.deleted.map(item => item.messageId))
+        set((state) => ({
+            messagesList: state.messagesList.filter(m => !ids.has(m.id))
+        }))
+    }
+
+    (data.batches || []).forEach(batch => {
+        batch.messages.forEach(message => queueDeliveredAck(get, message))
+        if (batch.connection_id !== get().messagesConnectionId) return
+        // New messages are appended, changed ones (seen, media) replaced
+        const changed = new Map(batch.messages.map(m => [m.id, m]))
+        set((state) => {
+            const messagesList = state.messagesList.map(m => {
+                const update = changed.get(m.id)
+                changed.delete(m.id)
+                return update ? { ...m, ...update } : m
+            })
+            return { messagesList: [...messagesList, ...changed.values()] }
+        })
+    })
+
+    if (data.done) {
+        set(() => ({ syncCursor: data.cursor }))
+    }
+}
+
+// Typing indicator: shown until the server's `expires` (seconds) runs
+// out, cleared straight away by a stop (typing: false)
 function responseMessageType(set, get, data) {
     if (data.username !== get().messagesUsername) return
+    const expires = (data.expires ?? 10) * 1000
     set((state) => ({
-        messagesTyping: new Date()
+        messagesTyping: data.typing === false ? null : new Date(Date.now() + expires)
     }))
 }
 
@@ -208,6 +331,52 @@ function responseMessageSeen(set, get, data) {
   });
 }
 
+// Batched read receipt: everything up to upToId that `username` received
+// (my messages if the friend read them, theirs if I did on another device)
+function responseMessageSeenUpTo(set, get, data) {
+  if (data.connection_id !== get().messagesConnectionId) return;
+  const mine = data.username !== get().user.username;
+  set(state => ({
+    messagesList: state.messagesList.map(msg =>
+      msg.id <= data.seen_up_to && msg.is_me === mine ? { ...msg, seen: true } : msg
+    )
+  }));
+}
+
+// The friend's app received my messages
+function responseMessageDelivered(set, get, data) {
+  const ids = new Set(data.messageIds || []);
+  set(state => ({
+    messagesList: state.messagesList.map(msg =>
+      ids.has(msg.id) ? { ...msg, delivered: true } : msg
+    )
+  }));
+}
+
+// Image variants / waveform / video metadata from the media jobs
+function responseMessageMediaReady(set, get, data) {
+  const { messageId, connection_id, error, ...media } = data;
+  set(state => ({
+    messagesList: state.messagesList.map(msg =>
+      msg.id === messageId ? { ...msg, ...media } : msg
+    )
+  }));
+}
+
+// Friends coming online / going offline, batched by the server
+function responsePresence(set, get, data) {
+  const online = new Map((data.users || []).map(u => [u.username, u.online]));
+  set(state => ({
+    friendList: Array.isArray(state.friendList)
+      ? state.friendList.map(item =>
+          online.has(item.friend.username)
+            ? { ...item, online: online.get(item.friend.username) }
+            : item
+        )
+      : state.friendList
+  }));
+}
+
 function responseMessageDeleted(set, get, data) {
   set(state => ({
     messagesList: state.messagesList.filter(m => m.id !== data.messageId)
@@ -305,7 +474,8 @@ const useGlobal = create((set, get) => ({
         secure.wipe()
         set((state) => ({
             authenticated: false,
-            user: {}
+            user: {},
+            syncCursor: null
         }))
     },
 
@@ -315,6 +485,7 @@ const useGlobal = create((set, get) => ({
     socket: null,
     socketReady: false,
     socketConnecting: false,
+    syncCursor: null,
 
     socketConnect: async () => {
         // Prevent duplicate connects
@@ -356,18 +527,13 @@ const useGlobal = create((set, get) => ({
             //console.log('[WebSocket] Connected');
 
             set((state) => ({ socketReady: true, socketConnecting: false }));
-            
-            socket.send(JSON.stringify({
-                source: 'request.list'
-            }))
 
+            // Only what changed while we were away; with no cursor yet
+            // the server answers reset and we load everything
             socket.send(JSON.stringify({
-                source: 'friend.list'
+                source: 'sync.since',
+                cursor: get().syncCursor
             }))
-
-            socket.send(JSON.stringify({ 
-                source: 'message.list'                 
-            }));
         }
 
         socket.onmessage = (event) => {
@@ -382,6 +548,7 @@ const useGlobal = create((set, get) => ({
                 'friend.new': responseFriendNew,
                 'message.list': responseMessageList,
                 'message.send': responseMessageSend,
+                'message.send_batch': responseMessageSendBatch,
                 'message.type': responseMessageType,
                 'request.accept': responseRequestAccept,
                 'request.connect': responseRequestConnect,
@@ -389,7 +556,13 @@ const useGlobal = create((set, get) => ({
                 'search': responseSearch,
                 'thumbnail': responseThumbnail,
                 'message.seen': responseMessageSeen,
+                'message.seen_up_to': responseMessageSeenUpTo,
                 'message.deleted': responseMessageDeleted,
+                'message.delivered': responseMessageDelivered,
+                'message.media_ready': responseMessageMediaReady,
+                'message.outbox': responseMessageOutbox,
+                'sync.since': responseSyncSince,
+                'presence': responsePresence,
             }
 
             const resp= responses[parsed.source]
@@ -28,6 +28,7 @@ const light = {
     onPrimary: '#202020',
     actionBlue: '#1E90FF',
     actionRed: '#FF3B30',
+    online: '#34C759',
   },
 };
 
@@ -48,6 +49,7 @@ const dark = {
     onPrimary: '#FFFFFF',          // ✅ bright text
     actionBlue: '#1E90FF',
     actionRed: '#FF453A',
+    online: '#30D158',
   },
 };
 
@@ -23,7 +23,24 @@ function FriendRow({ item, currentTheme, onSelectFriend }) {
   return (
     <TouchableOpacity onPress={() => onSelectFriend(item)}>
       <Cell>
-        <Thumbnail url={item.friend.thumbnail} size={44} />
+        <View>
+          <Thumbnail url={item.friend.thumbnail_small ?? item.friend.thumbnail} size={44} />
+          {item.online && (
+            <View
+              style={{
+                position: "absolute",
+                right: 0,
+                bottom: 0,
+                width: 12,
+                height: 12,
+                borderRadius: 6,
+                borderWidth: 2,
+                borderColor: currentTheme.colors.background,
+                backgroundColor: currentTheme.colors.online,
+              }}
+            />
+          )}
+        </View>
         <View
           style={{
             flex: 1,
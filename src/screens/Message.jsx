@@ -279,7 +279,7 @@ const MessageBubbleFriend = memo(function MessageBubbleFriend({
 
   return (
     <View style={{ flexDirection: "row", padding: currentTheme.spacing.xs, paddingLeft: currentTheme.spacing.md }}>
-      <Thumbnail url={friend?.thumbnail} size={42} />
+      <Thumbnail url={friend?.thumbnail_small ?? friend?.thumbnail} size={42} />
       <View
         style={{
           backgroundColor: currentTheme.colors.bubbleFriend,
@@ -318,6 +318,13 @@ const MessageBubbleFriend = memo(function MessageBubbleFriend({
 });
 
 
+// Smallest image variant that still fills a bubble; the upload until
+// the server has made them
+function bubbleImage(message) {
+  const variants = message.image_variants;
+  return variants?.['720'] ?? variants?.full ?? message.image;
+}
+
 // New MessageBubble with Memo:
 const MessageBubble = memo(function MessageBubble({ 
   message, 
@@ -342,7 +349,7 @@ const MessageBubble = memo(function MessageBubble({
       {message.is_me ? (
         <MessageBubbleMe
           text={message.text}
-          image={message.image}
+          image={bubbleImage(message)}
           voice={message.voice}
           waveform={message.waveform}
           video_url={message.video_url}
@@ -353,7 +360,7 @@ const MessageBubble = memo(function MessageBubble({
       ) : (
         <MessageBubbleFriend
           text={message.text}
-          image={message.image}
+          image={bubbleImage(message)}
           voice={message.voice}
           waveform={message.waveform}
           video_url={message.video_url}
@@ -1062,13 +1069,11 @@ export default function MessageScreen() {
       setShowTyping(false);
       return;
     }
-    setShowTyping(true);
-    const timer = setInterval(() => {
-      const now = new Date();
-      const ms = now - messagesTyping;
-      if (ms > 10000) setShowTyping(false);
-    }, 1000);
-    return () => clearInterval(timer);
+    // messagesTyping is when the indicator expires (see global.js)
+    const remaining = messagesTyping - new Date();
+    setShowTyping(remaining > 0);
+    const timer = setTimeout(() => setShowTyping(false), Math.max(remaining, 0));
+    return () => clearTimeout(timer);
   }, [isActiveChat, messagesTyping]);
   
 
@@ -1133,19 +1138,26 @@ export default function MessageScreen() {
     }
     console.log("[MessageScreen] Requesting messages for:", connectionId);
     messageList(connectionId);
-
-    // ✅ Trigger "seen" for any unseen messages in this chat
-    chatMessages
-      .filter(msg => !msg.is_me && !msg.seen)
-      .forEach(msg => {
-        socket.send(JSON.stringify({
-          source: "message.seen",
-          connectionId,
-          messageId: msg.id
-        }));
-      });
   }, [socketReady, connectionId]);
 
+  // Read receipts: one message.seen up to the newest unseen message from
+  // the friend covers every older one too (message.seen_up_to)
+  const newestUnseenId = useMemo(
+    () => chatMessages.reduce(
+      (newest, msg) => (!msg.is_me && !msg.seen && msg.id > newest ? msg.id : newest),
+      0
+    ),
+    [chatMessages]
+  );
+  useEffect(() => {
+    if (!socketReady || !connectionId || !newestUnseenId) return;
+    socket.send(JSON.stringify({
+      source: "message.seen",
+      connectionId,
+      upToId: newestUnseenId
+    }));
+  }, [socketReady, connectionId, newestUnseenId]);
+
   useEffect(() => {
     console.log('[MessageScreen] Requesting messages for:', connectionId);
     console.log('[MessageScreen] friend:', friend?.username);
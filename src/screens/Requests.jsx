@@ -53,7 +53,7 @@ function RequestRow({ item }) {
 
   return (
     <Cell>
-      <Thumbnail url={item.sender.thumbnail} size={76} />
+      <Thumbnail url={item.sender.thumbnail_small ?? item.sender.thumbnail} size={76} />
       <View
         style={{
           flex: 1,
@@ -87,7 +87,7 @@ function SearchRow({ user }) {
 
   return (
     <Cell>
-      <Thumbnail url={user.thumbnail} size={76} />
+      <Thumbnail url={user.thumbnail_small ?? user.thumbnail} size={76} />
       <View style={{ flex: 1, paddingHorizontal: currentTheme.spacing.md }}>
         <Text
           style={{